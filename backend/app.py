@@ -6,7 +6,9 @@ import os
 import requests
 import logging
 from datetime import datetime
-from routes.api_routes import register_routes
+from routes.api_routes import load_workflow_prompts, register_routes
+from service.upload_jobs import get_upload_job_manager
+from service.precompute import get_precompute_manager
 
 # Load environment variables
 load_dotenv()
@@ -35,6 +37,13 @@ def wake_up_app():
     except Exception as e:
         print(f"Error occurred while pinging app: {e}")
 
+# Scheduled analysis precompute for the indexes in PRECOMPUTE_INDEXES
+def precompute_analyses():
+    default_analysis_prompt, _ = load_workflow_prompts()
+    for index_id in os.environ.get('PRECOMPUTE_INDEXES', '').split(','):
+        if index_id.strip():
+            get_precompute_manager().start(index_id.strip(), default_analysis_prompt)
+
 # Initialize scheduler
 scheduler = BackgroundScheduler()
 scheduler.add_job(wake_up_app, 'interval', minutes=9)
@@ -47,7 +56,7 @@ CORS(app, resources={
     r"/*": {  
         "origins": "*", 
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],  
-        "allow_headers": ["Content-Type", "Authorization", "X-Requested-With", "Accept", "Origin"],  
+        "allow_headers": ["Content-Type", "Authorization", "X-Requested-With", "Accept", "Origin", "X-TwelveLabs-Key"],  
         "supports_credentials": True,  
         "expose_headers": ["Content-Range", "X-Content-Range"]  
     }
@@ -58,10 +67,33 @@ app.config['TWELVELABS_API_KEY'] = os.environ.get('TWELVELABS_API_KEY', '')
 app.config['TWELVELABS_API_KEY_ENV'] = os.environ.get('TWELVELABS_API_KEY', '')  # Store original env value
 app.config['PERPLEXITY_API_KEY'] = os.environ.get('PERPLEXITY', '')
 app.config['TWELVELABS_DEFAULT_INDEX_ID'] = os.environ.get('TWELVELABS_INDEX_ID', '')
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN', '')
+app.config['TWELVELABS_WEBHOOK_SECRET'] = os.environ.get('TWELVELABS_WEBHOOK_SECRET', '')
+app.config['WEBHOOK_TOLERANCE_SECONDS'] = int(os.environ.get('WEBHOOK_TOLERANCE_SECONDS', 300))
+app.config['CATALOG_STREAM_WINDOW'] = int(os.environ.get('CATALOG_STREAM_WINDOW', 4))
+app.config['THUMBNAIL_MAX_AGE'] = int(os.environ.get('THUMBNAIL_MAX_AGE', 86400))
+app.config['BATCH_WORKFLOW_CONCURRENCY'] = int(os.environ.get('BATCH_WORKFLOW_CONCURRENCY', 4))
+app.config['BATCH_WORKFLOW_MAX_CONCURRENCY'] = int(os.environ.get('BATCH_WORKFLOW_MAX_CONCURRENCY', 8))
+app.config['BATCH_WORKFLOW_MAX_VIDEOS'] = int(os.environ.get('BATCH_WORKFLOW_MAX_VIDEOS', 100))
+app.config['WORKFLOW_STREAM_RESEARCH'] = os.environ.get('WORKFLOW_STREAM_RESEARCH', 'false').lower() == 'true'
+app.config['WORKFLOW_DEADLINE_SECONDS'] = float(os.environ.get('WORKFLOW_DEADLINE_SECONDS', 240))
+app.config['WORKFLOW_MAX_DEADLINE_SECONDS'] = float(os.environ.get('WORKFLOW_MAX_DEADLINE_SECONDS', 600))
 
 # Register routes
 register_routes(app)
 
+# Resume upload and precompute jobs left in flight by a previous run. Under
+# the debug reloader only the serving child process does this, not the watcher.
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    get_upload_job_manager()
+    get_precompute_manager()
+    if os.environ.get('PRECOMPUTE_INDEXES'):
+        scheduler.add_job(
+            precompute_analyses, 'interval',
+            minutes=int(os.environ.get('PRECOMPUTE_INTERVAL_MINUTES', 360)),
+            next_run_time=datetime.now()
+        )
+
 if __name__ == '__main__':
     try:
         print("Starting TwelveLabs Video DeepResearch API...")
@@ -0,0 +1,16 @@
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from a2wsgi import WSGIMiddleware
+from app import app as flask_app
+from routes.async_routes import build_async_routes
+
+# ASGI entry point: the streaming endpoints run natively on the event loop so a
+# single process can hold many concurrent workflows, and every other route is
+# served by the regular Flask app mounted underneath.
+#
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+app = Starlette(
+    routes=build_async_routes(flask_app.config) + [
+        Mount('/', app=WSGIMiddleware(flask_app))
+    ]
+)
@@ -1,10 +1,34 @@
 from flask import jsonify, request, Response
 from datetime import datetime
+import hashlib
+import hmac
 import json
 import logging
 import os
-from service.twelvelabs_service import TwelveLabsService
-from service.sonar_service import SonarService
+import queue
+import threading
+import time
+from collections import deque
+from service.client_registry import get_client_registry, get_twelvelabs_service, get_sonar_service
+from service.http_transport import get_transport
+from service.rate_limiter import get_rate_limiter
+from service.resilience import Deadline, get_resilience
+from service.analysis_cache import get_analysis_cache, normalize_prompt
+from service.workflow_coalescer import get_workflow_coalescer, get_async_workflow_coalescer
+from service.workflow_scheduler import BATCH, INTERACTIVE, SchedulerBusy, get_workflow_scheduler
+from service.workflow_checkpoints import get_checkpoint_store
+from service.stage_graph import Stage, StageGraph, emit_from, get_batch_executor, get_stage_executor
+from service.speculative_research import SpeculationPolicy, SpeculativeResearch, get_speculation_metrics
+from service.upload_jobs import TERMINAL_STATUSES, get_upload_job_manager
+from service.task_poller import get_task_poller
+from service.content_index import get_content_index
+from service.catalog_cache import get_catalog_cache
+from service.webhooks import WebhookError, parse_task_event, verify_signature
+from service.video_catalog import RANGE_FIELDS
+from service.thumbnail_cache import get_thumbnail_cache
+from service.research_cache import get_research_cache
+from service.context_compactor import ContextCompactor
+from service.precompute import get_precompute_manager
 
 logger = logging.getLogger(__name__)
 
@@ -28,138 +52,649 @@ def load_prompt_from_file(filename):
         logger.error(f"Error loading prompt from {filename}: {str(e)}")
         return None
 
-def generate_workflow(twelvelabs_api_key, index_id, video_id, analysis_prompt, research_query, research_prompt_template):
-    # Input validation
+DEFAULT_ANALYSIS_PROMPT = 'Describe what happens in this video'
+
+DEFAULT_RESEARCH_PROMPT_TEMPLATE = """Based on this video analysis: {analysis_result}
+
+Please research: {research_query}
+
+IMPORTANT: Please provide a comprehensive research response using proper markdown formatting including:
+- Use ## for main headings and ### for subheadings
+- If table, then proper mardkown table format
+
+Provide comprehensive insights with clear structure and professional formatting."""
+
+
+def load_workflow_prompts():
+    # Load prompts from markdown files, falling back to the built-in defaults
+    default_analysis_prompt = load_prompt_from_file('video_analysis_prompt.md') or DEFAULT_ANALYSIS_PROMPT
+    research_prompt_template = load_prompt_from_file('research_prompt.md') or DEFAULT_RESEARCH_PROMPT_TEMPLATE
+    return default_analysis_prompt, research_prompt_template
+
+
+def parse_workflow_request(data, config):
+    # Shared by the Flask and ASGI workflow routes; returns generate_workflow kwargs
+    default_analysis_prompt, research_prompt_template = load_workflow_prompts()
+    return {
+        # Try client API key first, then fall back to environment
+        'twelvelabs_api_key': data.get('twelvelabs_api_key') or config.get('TWELVELABS_API_KEY_ENV'),
+        'index_id': data.get('index_id'),
+        'video_id': data.get('video_id'),
+        'analysis_prompt': data.get('analysis_prompt', default_analysis_prompt),
+        'research_query': data.get('research_query'),
+        'research_prompt_template': research_prompt_template,
+        'no_cache': bool(data.get('no_cache', False)),
+        'stream_research': bool(data.get('stream_research', config.get('WORKFLOW_STREAM_RESEARCH', False))),
+        'speculative_research': data.get('speculative_research')
+    }
+
+
+def workflow_coalescing_key(coalescer, params):
+    return coalescer.make_key(
+        params['twelvelabs_api_key'], params['index_id'], params['video_id'],
+        normalize_prompt(params['analysis_prompt']), params['research_query'],
+        params['no_cache'], params['stream_research'], params['speculative_research']
+    )
+
+
+def validate_workflow_params(twelvelabs_api_key, index_id, video_id, research_query):
     if not twelvelabs_api_key:
-        yield json.dumps({'type': 'error', 'message': 'TwelveLabs API key is required'}) + '\n'
-        return
+        return 'TwelveLabs API key is required'
     if not index_id or not video_id:
-        yield json.dumps({'type': 'error', 'message': 'Index ID and Video ID are required'}) + '\n'
-        return
+        return 'Index ID and Video ID are required'
     if not research_query:
-        yield json.dumps({'type': 'error', 'message': 'Research query is required'}) + '\n'
+        return 'Research query is required'
+    return None
+
+
+def ndjson(obj):
+    return safe_json_dumps(obj) + '\n'
+
+
+def progress_line(step, message, progress):
+    return ndjson({
+        'type': 'progress',
+        'step': step,
+        'message': message,
+        'progress': progress
+    })
+
+
+def video_details_line(video_details):
+    return ndjson({
+        'type': 'data',
+        'step': 'video_details',
+        'data': {
+            'id': video_details.get('_id', ''),
+            'filename': video_details.get('system_metadata', {}).get('filename', ''),
+            'duration': video_details.get('system_metadata', {}).get('duration', 0)
+        },
+        'progress': 33
+    })
+
+
+def analysis_line(analysis_result, analysis_cached):
+    return ndjson({
+        'type': 'data',
+        'step': 'analysis',
+        'data': analysis_result,
+        'cached': analysis_cached,
+        'progress': 66
+    })
+
+
+def context_compaction_line(report):
+    # Size of the analysis before and after compaction, for the research prompt
+    return ndjson(dict(report, type='context_compaction', step='research'))
+
+
+def research_draft_line(result):
+    return ndjson({
+        'type': 'research_draft',
+        'content': result['choices'][0].get('message', {}).get('content', ''),
+        'citations': result.get('citations', [])[:10]
+    })
+
+
+def research_delta_line(content, received):
+    return ndjson({
+        'type': 'research_delta',
+        'content': content,
+        'progress': min(99, 80 + received // 500)
+    })
+
+
+def research_cache_scope(analysis_result):
+    # Near-duplicate research questions may only share an answer when they
+    # were asked about the same analysis
+    return hashlib.sha256(normalize_prompt(str(analysis_result)).encode('utf-8')).hexdigest()[:16]
+
+
+def build_research_query(research_prompt_template, analysis_result, research_query, speculation=None):
+    enhanced_query = research_prompt_template.format(
+        analysis_result=analysis_result,
+        research_query=research_query
+    )
+    if speculation is not None:
+        speculative_result = speculation.claim()
+        if speculative_result is not None:
+            enhanced_query += speculation.prompt_context(speculative_result)
+    return enhanced_query
+
+
+def buffered_research_lines(research_result, cache=None):
+    # Extract research content
+    research_content = ""
+    if research_result and research_result.get('choices'):
+        research_content = research_result['choices'][0].get('message', {}).get('content', '')
+
+    lines = []
+    # Send research content in chunks if large
+    max_chunk_size = 10000
+    if len(research_content) > max_chunk_size:
+        for i in range(0, len(research_content), max_chunk_size):
+            chunk = research_content[i:i + max_chunk_size]
+            is_final = (i + max_chunk_size) >= len(research_content)
+
+            lines.append(ndjson({
+                'type': 'research_chunk',
+                'content': chunk,
+                'is_final': is_final,
+                'progress': 80 + (i / len(research_content)) * 20
+            }))
+
+        # Send completion with chunked content indicator
+        lines.append(ndjson(build_complete_event(research_result, '[CHUNKED_CONTENT]', cache)))
+    else:
+        # Send completion with research data directly (no separate data message)
+        lines.append(ndjson(build_complete_event(research_result, research_content, cache)))
+    return lines
+
+
+def should_speculate(api_key, index_id, video_id, analysis_prompt, research_query, no_cache, speculative_research):
+    analysis_cached = not no_cache and get_analysis_cache().contains(api_key, index_id, video_id, analysis_prompt)
+    return SpeculationPolicy().should_speculate(research_query, analysis_cached, requested=speculative_research)
+
+
+class WorkflowError(Exception):
+    pass
+
+
+def workflow_deadline(data, config):
+    # The client may ask for a shorter or longer budget, within the configured cap
+    seconds = config.get('WORKFLOW_DEADLINE_SECONDS', 240)
+    try:
+        seconds = float(data.get('deadline_seconds') or seconds)
+    except (TypeError, ValueError):
+        pass
+    return Deadline(min(max(seconds, 1.0), config.get('WORKFLOW_MAX_DEADLINE_SECONDS', 600)))
+
+
+def partial_complete_event(results, deadline):
+    # Sent instead of an error when the workflow runs out of time. Carries the
+    # stages that finished; a speculative draft stands in for missing research.
+    analysis_result = results.get('analysis')
+    research_result = results.get('research') or results.get('speculative_research')
+    if research_result:
+        event = build_complete_event(research_result, research_result['choices'][0].get('message', {}).get('content', ''))
+    else:
+        content = f"Research did not finish within {deadline.seconds:g} seconds."
+        if analysis_result:
+            content += f"\n\n## Video analysis\n\n{analysis_result}"
+        event = build_complete_event({}, content)
+    event['partial'] = True
+    event['reason'] = 'deadline_exceeded'
+    event['completed_stages'] = sorted(name for name, result in results.items() if result is not None)
+    video_details = results.get('video_details')
+    if video_details:
+        event['data']['video_details'] = json.loads(video_details_line(video_details))['data']
+    if analysis_result:
+        event['data']['analysis'] = analysis_result
+    return event
+
+
+def scheduler_busy_body(error):
+    return {'success': False, 'error': str(error), 'retry_after': error.retry_after}
+
+
+def workflow_elsewhere_body():
+    # Another worker holds the lease on the workflow being resumed
+    return {'success': False, 'error': 'Workflow is running on another worker, retry shortly'}
+
+
+def queued_line(scheduler, ticket):
+    position = ticket.position()
+    return ndjson({
+        'type': 'queued',
+        'position': position,
+        'retry_after': scheduler.retry_after(ticket),
+        'message': f'Waiting for a free workflow slot ({position} in line)...',
+        'progress': 0
+    })
+
+
+def last_event_id(data, headers):
+    # SSE-style Last-Event-ID header, or "last_event_id" in the body
+    try:
+        return max(int(headers.get('Last-Event-ID') or data.get('last_event_id') or 0), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def checkpointed_workflow(checkpoint, generator_factory, resumed=False):
+    # Numbers and logs every event of a run so a client that drops can resume
+    # it. ``generator_factory(checkpoint)`` produces the workflow events; a
+    # resumed run first replays everything logged so far. The caller has
+    # claimed the workflow's lease; it is released when the run ends.
+    try:
+        if resumed:
+            replayed = checkpoint.replay()
+            yield from replayed
+            yield checkpoint.record(ndjson({
+                'type': 'workflow',
+                'workflow_id': checkpoint.workflow_id,
+                'resumed': True,
+                'completed_stages': sorted(checkpoint.stages)
+            }))
+        else:
+            yield checkpoint.record(ndjson({'type': 'workflow', 'workflow_id': checkpoint.workflow_id}))
+        for line in generator_factory(checkpoint):
+            numbered = checkpoint.record(line)
+            if checkpoint.flush_due:
+                checkpoint.flush()
+            yield numbered
+    finally:
+        finish_checkpoint(checkpoint)
+
+
+def finish_checkpoint(checkpoint):
+    # Writes out the run's last events and hands its lease back
+    checkpoint.close()
+    checkpoint.store.release(checkpoint.workflow_id)
+
+
+def scheduled_workflow(scheduler, ticket, deadline, generator_factory):
+    # Holds the workflow back until its scheduler ticket is granted, sending a
+    # 'queued' update every few seconds meanwhile. Time spent in the queue
+    # counts against the deadline.
+    try:
+        while not ticket.granted:
+            if deadline.cancelled:
+                return
+            if deadline.expired:
+                yield ndjson({'type': 'error', 'message': 'Timed out waiting for a free workflow slot'})
+                return
+            yield queued_line(scheduler, ticket)
+            ticket.wait(min(scheduler.update_seconds, deadline.remaining()))
+        yield from generator_factory()
+    finally:
+        ticket.release()
+
+
+def generate_workflow(twelvelabs_api_key, index_id, video_id, analysis_prompt, research_query, research_prompt_template, no_cache=False, stream_research=False, speculative_research=None, deadline=None, checkpoint=None):
+    # ``deadline`` is the whole run's budget; each stage gets a share of it and
+    # passes it to its upstream calls. Cancelling it stops the run. Stage
+    # results are saved to ``checkpoint``; stages it already holds are not run
+    # again.
+    done = checkpoint.stages if checkpoint is not None else {}
+    if deadline is None:
+        deadline = Deadline(float(os.environ.get('WORKFLOW_DEADLINE_SECONDS', 240)))
+
+    # Input validation
+    validation_error = validate_workflow_params(twelvelabs_api_key, index_id, video_id, research_query)
+    if validation_error:
+        yield json.dumps({'type': 'error', 'message': validation_error}) + '\n'
         return
 
     try:
-        twelvelabs_service = TwelveLabsService(api_key=twelvelabs_api_key)
-        
+        twelvelabs_service = get_twelvelabs_service(twelvelabs_api_key)
+        sonar_service = get_sonar_service()
+
         # Step 1: Get video details
-        yield safe_json_dumps({
-            'type': 'progress',
-            'step': 'video_details',
-            'message': 'Fetching video details...',
-            'progress': 0
-        }) + '\n'
-
-        video_details = twelvelabs_service.get_video_details(index_id, video_id)
-        if not video_details:
-            yield safe_json_dumps({'type': 'error', 'message': 'Could not retrieve video details'}) + '\n'
-            return
-
-        yield safe_json_dumps({
-            'type': 'data',
-            'step': 'video_details',
-            'data': {
-                'id': video_details.get('_id', ''),
-                'filename': video_details.get('system_metadata', {}).get('filename', ''),
-                'duration': video_details.get('system_metadata', {}).get('duration', 0)
-            },
-            'progress': 33
-        }) + '\n'
-
-        # Step 2: Analyze video
-        yield safe_json_dumps({
-            'type': 'progress',
-            'step': 'analysis',
-            'message': 'Analyzing video content...',
-            'progress': 33
-        }) + '\n'
-
-        analysis_result = twelvelabs_service.analyze_video(video_id, analysis_prompt)
-        yield safe_json_dumps({
-            'type': 'data',
-            'step': 'analysis',
-            'data': analysis_result,
-            'progress': 66
-        }) + '\n'
-
-        # Step 3: Research with context
-        yield safe_json_dumps({
-            'type': 'progress',
-            'step': 'research',
-            'message': 'Conducting deep research...',
-            'progress': 66
-        }) + '\n'
-
-        enhanced_query = research_prompt_template.format(
-            analysis_result=analysis_result,
-            research_query=research_query
-        )
-        
-        sonar_service = SonarService()
-        research_result = sonar_service.deep_research(enhanced_query, timeout=180)
+        def video_details_stage(ctx):
+            ctx.emit(progress_line('video_details', 'Fetching video details...', 0))
+            video_details = twelvelabs_service.get_video_details(
+                index_id, video_id, deadline=deadline.child(deadline.seconds * WORKFLOW_STAGE_SHARES['video_details'])
+            )
+            if not video_details:
+                raise WorkflowError('Could not retrieve video details')
+            ctx.emit(video_details_line(video_details))
+            return video_details
 
-        if 'error' in research_result:
-            yield safe_json_dumps({'type': 'error', 'message': f'Research failed: {research_result["error"]}'}) + '\n'
-            return
+        # Step 2: Analyze video (independent of the details call, runs alongside it)
+        def analysis_stage(ctx):
+            ctx.emit(progress_line('analysis', 'Analyzing video content...', 33))
+            analysis_result, analysis_cached = twelvelabs_service.analyze_video_cached(
+                video_id, analysis_prompt, index_id=index_id, no_cache=no_cache,
+                deadline=deadline.child(deadline.seconds * WORKFLOW_STAGE_SHARES['analysis'])
+            )
+            ctx.emit(analysis_line(analysis_result, analysis_cached))
+            return analysis_result
 
-        # Extract research content
-        research_content = ""
-        if research_result and research_result.get('choices'):
-            research_content = research_result['choices'][0].get('message', {}).get('content', '')
-        
-        # Send research content in chunks if large
-        max_chunk_size = 10000
-        if len(research_content) > max_chunk_size:
-            for i in range(0, len(research_content), max_chunk_size):
-                chunk = research_content[i:i + max_chunk_size]
-                is_final = (i + max_chunk_size) >= len(research_content)
-                
-                yield safe_json_dumps({
-                    'type': 'research_chunk',
-                    'content': chunk,
-                    'is_final': is_final,
-                    'progress': 80 + (i / len(research_content)) * 20
-                }) + '\n'
-            
-            # Send completion with chunked content indicator
-            yield safe_json_dumps({
-                'type': 'complete',
-                'data': {
-                    'research': {
-                        'choices': [{
-                            'message': {
-                                'content': '[CHUNKED_CONTENT]'
-                            }
-                        }],
-                        'citations': research_result.get('citations', [])[:10],
-                        'usage': research_result.get('usage', {})
-                    },
-                    'sources': research_result.get('search_results', [])[:10]
-                },
-                'progress': 100
-            }) + '\n'
-        else:
-            # Send completion with research data directly (no separate data message)
-            yield safe_json_dumps({
-                'type': 'complete',
-                'data': {
-                    'research': {
-                        'choices': [{
-                            'message': {
-                                'content': research_content
-                            }
-                        }],
-                        'citations': research_result.get('citations', [])[:10],
-                        'usage': research_result.get('usage', {})
-                    },
-                    'sources': research_result.get('search_results', [])[:10]
-                },
-                'progress': 100
-            }) + '\n'
+        # Step 3 gets whatever is left of the budget: Research with context
+        def research_stage(ctx):
+            ctx.emit(progress_line('research', 'Conducting deep research...', 66))
+            # Cached answers are keyed on the prompt without speculative
+            # context, which differs from run to run
+            analysis_context, compaction = ContextCompactor().compact(ctx.results['analysis'], research_query)
+            ctx.emit(context_compaction_line(compaction))
+
+            research_cache = get_research_cache()
+            cache_query = build_research_query(research_prompt_template, analysis_context, research_query)
+            cache_scope = research_cache_scope(ctx.results['analysis'])
+            cached_result, cache_info = research_cache.lookup(cache_query, scope=cache_scope, question=research_query, no_cache=no_cache)
+            if cached_result is not None:
+                for line in buffered_research_lines(cached_result, cache_info):
+                    ctx.emit(line)
+                return cached_result
+
+            enhanced_query = build_research_query(
+                research_prompt_template, analysis_context, research_query, speculation
+            )
+
+            if stream_research:
+                research_result = emit_from(stream_research_events(sonar_service, enhanced_query, deadline), ctx.emit)
+                if research_result is not None:
+                    if 'error' in research_result:
+                        raise WorkflowError(f'Research failed: {research_result["error"]}')
+                    research_cache.set(cache_query, research_result, scope=cache_scope, question=research_query)
+                    research_content = research_result['choices'][0]['message']['content']
+                    ctx.emit(ndjson(build_complete_event(research_result, research_content)))
+                    return research_result
+                logger.warning("Streaming research failed before any content arrived, falling back to buffered research")
+
+            research_result = sonar_service.deep_research(enhanced_query, timeout=180, deadline=deadline)
+            if 'error' in research_result:
+                raise WorkflowError(f'Research failed: {research_result["error"]}')
+            research_cache.set(cache_query, research_result, scope=cache_scope, question=research_query)
+            for line in buffered_research_lines(research_result):
+                ctx.emit(line)
+            return research_result
+
+        # Optional: query-only research racing the analysis. Its answer is streamed
+        # as an early draft and folded into the final prompt if it is ready in time.
+        def speculative_research_stage(ctx):
+            return speculation.run(on_draft=lambda result: ctx.emit(research_draft_line(result)), deadline=deadline)
+
+        def restored(name, stage_fn):
+            # Finished before the client reconnected: its events were replayed
+            # from the checkpoint log, only its result is still needed
+            if name in done:
+                return lambda ctx: done[name]
+            return stage_fn
+
+        stages = [
+            Stage('video_details', restored('video_details', video_details_stage)),
+            Stage('analysis', restored('analysis', analysis_stage)),
+            Stage('research', restored('research', research_stage), deps=('video_details', 'analysis'))
+        ]
+
+        # A resumed run does not speculate; the draft was only a preview
+        speculation = None
+        if not done and should_speculate(twelvelabs_api_key, index_id, video_id, analysis_prompt, research_query, no_cache, speculative_research):
+            speculation = SpeculativeResearch(sonar_service, research_query, get_speculation_metrics())
+            stages.append(Stage('speculative_research', speculative_research_stage, ordered=False, required=False))
+
+        graph = StageGraph(stages, get_stage_executor(), deadline=deadline)
+
+        for kind, stage, payload in graph.run():
+            if kind == 'event':
+                yield payload
+            elif kind == 'result':
+                if checkpoint is not None and stage in WORKFLOW_CHECKPOINT_STAGES and stage not in done:
+                    checkpoint.stage_done(stage, payload)
+            elif kind == 'error' and stage != 'speculative_research':
+                if deadline.expired:
+                    # A call that ran out of budget; report what finished instead
+                    break
+                # Dependents of the failed stage are cancelled by the graph
+                yield ndjson({'type': 'error', 'message': str(payload)})
+                return
+
+        if deadline.cancelled:
+            logger.info(f"Workflow for video {video_id} cancelled, nobody is listening")
+        elif not graph.finished:
+            logger.warning(f"Workflow for video {video_id} hit its {deadline.seconds:g}s deadline, sending partial results")
+            yield ndjson(partial_complete_event(graph.results, deadline))
 
     except Exception as e:
-        yield safe_json_dumps({'type': 'error', 'message': str(e)}) + '\n'
+        yield ndjson({'type': 'error', 'message': str(e)})
+
+
+BATCH_MODES = ('per_video', 'aggregate')
+
+
+def parse_batch_request(data, config):
+    # Returns generate_batch_workflow kwargs
+    default_analysis_prompt, research_prompt_template = load_workflow_prompts()
+    video_ids = data.get('video_ids')
+    if isinstance(video_ids, list):
+        # Drop duplicates, keep the caller's order
+        video_ids = list(dict.fromkeys(str(video_id) for video_id in video_ids if video_id))
+    try:
+        concurrency = int(data.get('concurrency') or config.get('BATCH_WORKFLOW_CONCURRENCY', 4))
+    except (TypeError, ValueError):
+        concurrency = config.get('BATCH_WORKFLOW_CONCURRENCY', 4)
+    return {
+        'twelvelabs_api_key': data.get('twelvelabs_api_key') or config.get('TWELVELABS_API_KEY_ENV'),
+        'index_id': data.get('index_id'),
+        'video_ids': video_ids,
+        'analysis_prompt': data.get('analysis_prompt', default_analysis_prompt),
+        'research_query': data.get('research_query'),
+        'research_prompt_template': research_prompt_template,
+        'mode': data.get('mode', 'per_video'),
+        'concurrency': min(max(concurrency, 1), config.get('BATCH_WORKFLOW_MAX_CONCURRENCY', 8)),
+        'max_videos': config.get('BATCH_WORKFLOW_MAX_VIDEOS', 100),
+        'no_cache': bool(data.get('no_cache', False))
+    }
+
+
+def validate_batch_params(twelvelabs_api_key, index_id, video_ids, research_query, mode, max_videos):
+    if not twelvelabs_api_key:
+        return 'TwelveLabs API key is required'
+    if not index_id:
+        return 'Index ID is required'
+    if not isinstance(video_ids, list) or not video_ids:
+        return 'video_ids must be a non-empty list'
+    if len(video_ids) > max_videos:
+        return f'At most {max_videos} videos can be researched in one batch'
+    if not research_query:
+        return 'Research query is required'
+    if mode not in BATCH_MODES:
+        return f"mode must be one of {', '.join(BATCH_MODES)}"
+    return None
+
+
+def cached_research(sonar_service, research_prompt_template, analysis_context, research_query, scope, no_cache=False):
+    # Buffered research through the research cache; returns (result, cache provenance)
+    research_cache = get_research_cache()
+    query = build_research_query(research_prompt_template, analysis_context, research_query)
+    result, cache_info = research_cache.lookup(query, scope=scope, question=research_query, no_cache=no_cache)
+    if result is not None:
+        return result, cache_info
+    result = sonar_service.deep_research(query, timeout=180)
+    if 'error' in result:
+        raise WorkflowError(f'Research failed: {result["error"]}')
+    research_cache.set(query, result, scope=scope, question=research_query)
+    return result, LIVE_RESEARCH
+
+
+def generate_batch_workflow(twelvelabs_api_key, index_id, video_ids, analysis_prompt, research_query, research_prompt_template, mode='per_video', concurrency=4, max_videos=100, no_cache=False):
+    """Analyze many videos of one index against one research question.
+
+    At most ``concurrency`` videos are in flight at a time on the shared batch
+    pool. Per-video events are streamed as they happen, so lines for
+    different videos interleave. In ``per_video`` mode each analysis gets its
+    own research call as soon as it is ready. In ``aggregate`` mode the
+    analyses are compacted to share the context budget and researched once at
+    the end. A failed video is reported and skipped; the batch always ends
+    with a ``batch_complete`` summary.
+    """
+    validation_error = validate_batch_params(twelvelabs_api_key, index_id, video_ids, research_query, mode, max_videos)
+    if validation_error:
+        yield ndjson({'type': 'error', 'message': validation_error})
+        return
+
+    started = time.time()
+    twelvelabs_service = get_twelvelabs_service(twelvelabs_api_key)
+    sonar_service = get_sonar_service()
+    executor = get_batch_executor()
+    scheduler = get_workflow_scheduler()
+    events = queue.Queue()
+    pending = deque(video_ids)
+    stopped = threading.Event()
+    analyses = {}
+    failed = []
+
+    def run_video(video_id):
+        def emit(obj):
+            events.put(('event', video_id, ndjson(dict(obj, video_id=video_id))))
+
+        # Each video takes a batch-priority workflow slot, so interactive
+        # workflows go first when the server is busy
+        ticket = scheduler.admit(twelvelabs_api_key, BATCH, bounded=False)
+        try:
+            while not ticket.granted:
+                if stopped.is_set():
+                    return None
+                emit({'type': 'video_progress', 'step': 'analysis', 'status': 'queued', 'position': ticket.position()})
+                ticket.wait(scheduler.update_seconds)
+            return analyze_and_research(video_id, emit)
+        finally:
+            ticket.release()
+
+    def analyze_and_research(video_id, emit):
+        state = {'step': 'analysis'}
+        try:
+            emit({'type': 'video_progress', 'step': 'analysis', 'status': 'started'})
+            analysis, cached = twelvelabs_service.analyze_video_cached(
+                video_id, analysis_prompt, index_id=index_id, no_cache=no_cache
+            )
+            if not analysis:
+                raise WorkflowError('Analysis returned no content')
+            emit({'type': 'video_analysis', 'data': analysis, 'cached': cached})
+
+            if mode == 'per_video':
+                state['step'] = 'research'
+                emit({'type': 'video_progress', 'step': 'research', 'status': 'started'})
+                context, compaction = ContextCompactor().compact(analysis, research_query)
+                emit(dict(compaction, type='context_compaction', step='research'))
+                result, cache_info = cached_research(
+                    sonar_service, research_prompt_template, context, research_query,
+                    research_cache_scope(analysis), no_cache=no_cache
+                )
+                content = result['choices'][0].get('message', {}).get('content', '')
+                emit(dict(build_complete_event(result, content, cache_info)['data'], type='video_research'))
+            return analysis
+        except Exception as e:
+            emit({'type': 'video_error', 'step': state['step'], 'message': str(e)})
+            raise
+
+    def submit_next():
+        video_id = pending.popleft()
+        future = executor.submit(run_video, video_id)
+        future.add_done_callback(lambda f, video_id=video_id: events.put(('done', video_id, f)))
+
+    yield ndjson({'type': 'batch_started', 'total': len(video_ids), 'mode': mode, 'concurrency': concurrency})
+    in_flight = 0
+    finished = 0
+    try:
+        while pending and in_flight < concurrency:
+            submit_next()
+            in_flight += 1
+        while in_flight:
+            kind, video_id, payload = events.get()
+            if kind == 'event':
+                yield payload
+                continue
+            in_flight -= 1
+            finished += 1
+            if payload.exception() is None:
+                analyses[video_id] = payload.result()
+            else:
+                failed.append(video_id)
+                logger.warning(f"Batch video {video_id} failed: {payload.exception()}")
+            yield ndjson({'type': 'batch_progress', 'completed': finished, 'total': len(video_ids), 'progress': round(finished * 100 / len(video_ids))})
+            if pending:
+                submit_next()
+                in_flight += 1
+
+        if mode == 'aggregate' and analyses:
+            yield progress_line('research', f'Researching across {len(analyses)} videos...', 90)
+            # Split the context budget evenly so every video is represented
+            budget = ContextCompactor().token_budget
+            compactor = ContextCompactor(token_budget=max(budget // len(analyses), 200) if budget else 0)
+            sections, totals = [], {'tokens_before': 0, 'tokens_after': 0, 'duplicates_removed': 0, 'sentences_trimmed': 0}
+            for video_id in video_ids:
+                if video_id in analyses:
+                    context, compaction = compactor.compact(analyses[video_id], research_query)
+                    sections.append(f"### Video {video_id}\n{context}")
+                    for field in totals:
+                        totals[field] += compaction[field]
+            yield context_compaction_line(dict(totals, token_budget=budget, videos=len(sections)))
+            combined = '\n\n'.join(sections)
+            try:
+                result, cache_info = cached_research(
+                    sonar_service, research_prompt_template, combined, research_query,
+                    research_cache_scope(combined), no_cache=no_cache
+                )
+                yield ndjson(build_complete_event(result, result['choices'][0].get('message', {}).get('content', ''), cache_info))
+            except Exception as e:
+                logger.error(f"Aggregated batch research failed: {str(e)}")
+                yield ndjson({'type': 'error', 'step': 'research', 'message': str(e)})
+
+        yield ndjson({
+            'type': 'batch_complete',
+            'succeeded': len(analyses),
+            'failed': failed,
+            'elapsed_ms': int((time.time() - started) * 1000)
+        })
+    finally:
+        # Client went away: let running videos finish (their analyses are
+        # cached) but start no new ones
+        pending.clear()
+        stopped.set()
+
+
+def stream_research_events(sonar_service, enhanced_query, deadline=None):
+    # Forwards Sonar deltas as 'research_delta' events and returns the assembled
+    # result. Returns None when the stream failed before any content was sent so
+    # the caller can fall back to the buffered request.
+    received = 0
+    for event in sonar_service.deep_research_stream(enhanced_query, timeout=180, deadline=deadline):
+        if event['type'] == 'delta':
+            received += len(event['content'])
+            yield research_delta_line(event['content'], received)
+        elif event['type'] == 'done':
+            return event['result']
+        elif event['type'] == 'error':
+            if received == 0:
+                logger.warning(f"Streaming research error: {event['error']}")
+                return None
+            return {'error': event['error']}
+    return None if received == 0 else {'error': 'Research stream ended unexpectedly'}
+
+
+def build_complete_event(research_result, research_content, cache=None):
+    # ``cache`` is the research cache provenance: {'source': 'live'} or
+    # {'source': 'exact'|'semantic', 'age_seconds', ...}
+    return {
+        'type': 'complete',
+        'data': {
+            'research': {
+                'choices': [{
+                    'message': {
+                        'content': research_content
+                    }
+                }],
+                'citations': research_result.get('citations', [])[:10],
+                'usage': research_result.get('usage', {}),
+                'cache': cache or LIVE_RESEARCH
+            },
+            'sources': research_result.get('search_results', [])[:10]
+        },
+        'progress': 100
+    }
 
 
 def safe_json_dumps(obj):
@@ -179,6 +714,51 @@ def safe_json_dumps(obj):
             'message': f'Failed to serialize response data: {str(e)}'
         })
 
+LIVE_RESEARCH = {'source': 'live', 'age_seconds': 0}
+# Share of the workflow deadline each stage may use; research gets the rest
+WORKFLOW_STAGE_SHARES = {'video_details': 0.1, 'analysis': 0.6}
+# Stages whose results are checkpointed for resumed workflows
+WORKFLOW_CHECKPOINT_STAGES = ('video_details', 'analysis', 'research')
+UPLOAD_STREAM_HEARTBEAT = 15
+VIDEO_QUERY_MAX_LIMIT = 200
+
+
+def research_done_sse(result, cache_info):
+    # Closing events of a research stream
+    return [
+        f"data: {json.dumps({'citations': result.get('citations', []), 'usage': result.get('usage', {}), 'cache': cache_info})}\n\n",
+        f"data: {json.dumps({'done': True})}\n\n"
+    ]
+
+
+def cached_research_sse(cached, cache_info):
+    # A cached result sent as a research stream: the whole answer in one delta
+    content = cached['choices'][0].get('message', {}).get('content', '')
+    return [f"data: {json.dumps({'content': content})}\n\n"] + research_done_sse(cached, cache_info)
+
+
+def public_upload_job(job):
+    # Spool paths are server internals
+    return {key: value for key, value in job.items() if key != 'spool_path'}
+
+def upload_job_response(job):
+    # Duplicates of an indexed file come back already ready, with the video id
+    body = {'success': True, 'job_id': job['job_id'], 'status': job['status']}
+    if job['status'] == 'ready':
+        body['video_id'] = job['video_id']
+        body['duplicate'] = job.get('duplicate', False)
+        return jsonify(body), 200
+    return jsonify(body), 202
+
+def admin_error(config):
+    # Admin endpoints are off unless ADMIN_TOKEN is configured
+    token = config.get('ADMIN_TOKEN')
+    if not token:
+        return jsonify({'success': False, 'error': 'Admin endpoints are disabled (set ADMIN_TOKEN)'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+        return jsonify({'success': False, 'error': 'Invalid admin token'}), 401
+    return None
+
 def register_routes(app):
     @app.route('/')
     def index():
@@ -189,13 +769,28 @@ def register_routes(app):
             'endpoints': {
                 'indexes': 'POST /api/indexes',
                 'videos': 'POST /api/videos',
+                'videos_stream': 'POST /api/videos/stream',
+                'videos_query': 'POST /api/videos/query',
                 'video_details': 'POST /api/video/<index_id>/<video_id>',
+                'video_thumbnail': 'GET /api/video/<index_id>/<video_id>/thumbnail',
                 'analyze': 'POST /api/analyze/<video_id>',
                 'sonar_research': 'POST /api/sonar/research',
                 'sonar_research_stream': 'POST /api/sonar/research/stream',
                 'workflow': 'POST /api/workflow',
                 'workflow_steps': 'POST /api/workflow/steps',
-                'workflow_streaming': 'POST /api/workflow/streaming'
+                'workflow_batch': 'POST /api/workflow/batch',
+                'workflow_streaming': 'POST /api/workflow/streaming',
+                'upload': 'POST /api/upload',
+                'upload_stream': 'POST /api/upload/stream?filename=<name>',
+                'upload_job': 'GET /api/upload/jobs/<job_id>',
+                'upload_job_stream': 'GET /api/upload/jobs/<job_id>/stream',
+                'content_index_rebuild': 'POST /api/admin/content-index/rebuild',
+                'catalog_invalidate': 'POST /api/admin/catalog/invalidate',
+                'precompute': 'POST /api/admin/precompute',
+                'precompute_status': 'GET /api/admin/precompute/<index_id>',
+                'precompute_cancel': 'POST /api/admin/precompute/<index_id>/cancel',
+                'twelvelabs_webhook': 'POST /api/webhooks/twelvelabs',
+                'stats': 'GET /api/stats'
             }
         })
 
@@ -208,6 +803,30 @@ def register_routes(app):
             'version': '1.0.1' 
         })
 
+    @app.route('/api/stats', methods=['GET'])
+    def get_stats():
+        return jsonify({
+            'success': True,
+            'timestamp': datetime.now().isoformat(),
+            'analysis_cache': get_analysis_cache().stats(),
+            'workflow_coalescer': get_workflow_coalescer().stats(),
+            'async_workflow_coalescer': get_async_workflow_coalescer().stats(),
+            'workflow_scheduler': get_workflow_scheduler().stats(),
+            'workflow_checkpoints': get_checkpoint_store().stats(),
+            'http_transport': get_transport().stats(),
+            'clients': get_client_registry().stats(),
+            'speculative_research': get_speculation_metrics().stats(),
+            'upload_jobs': get_upload_job_manager().stats(),
+            'task_poller': get_task_poller().stats(),
+            'content_index': get_content_index().stats(),
+            'catalog_cache': get_catalog_cache().stats(),
+            'thumbnail_cache': get_thumbnail_cache().stats(),
+            'research_cache': get_research_cache().stats(),
+            'precompute': get_precompute_manager().stats(),
+            'rate_limits': get_rate_limiter().stats(),
+            'resilience': get_resilience().stats()
+        })
+
     @app.route('/api/config/twelvelabs', methods=['POST'])
     def set_twelvelabs_config():
         try:
@@ -217,9 +836,9 @@ def register_routes(app):
             if not api_key or api_key == '':
                 return jsonify({'success': False, 'error': 'TwelveLabs API key is required.'}), 400
             
-            # Test the API key by trying to fetch indexes
-            service = TwelveLabsService(api_key=api_key)
-            test_result = service.get_indexes()
+            # Test the API key by trying to fetch indexes (bypassing the catalog cache)
+            service = get_twelvelabs_service(api_key)
+            test_result = service.get_indexes(refresh=True)
             
             if isinstance(test_result, list):
                 # API key is valid, return success without storing it server-side
@@ -290,7 +909,7 @@ def register_routes(app):
                 return jsonify({'success': False, 'error': 'TwelveLabs API key is required. Please connect your API key in the UI or set TWELVELABS_API_KEY in environment variables.'}), 400
             
             # Create service with provided API key
-            service = TwelveLabsService(api_key=api_key)
+            service = get_twelvelabs_service(api_key)
             indexes = service.get_indexes()
             
             return jsonify({
@@ -317,7 +936,7 @@ def register_routes(app):
                 return jsonify({'success': False, 'error': 'Index ID is required'}), 400
             
             # Create service with provided API key
-            service = TwelveLabsService(api_key=api_key)
+            service = get_twelvelabs_service(api_key)
             videos = service.get_videos(index_id, page=page)
             
             return jsonify({
@@ -329,6 +948,95 @@ def register_routes(app):
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
 
+    @app.route('/api/videos/query', methods=['POST'])
+    def query_videos():
+        data = request.get_json(silent=True) or {}
+        api_key = data.get('api_key') or app.config.get('TWELVELABS_API_KEY_ENV')
+        index_id = data.get('index_id')
+
+        if not api_key:
+            return jsonify({'success': False, 'error': 'TwelveLabs API key is required. Please connect your API key in the UI or set TWELVELABS_API_KEY in environment variables.'}), 400
+        if not index_id:
+            return jsonify({'success': False, 'error': 'Index ID is required'}), 400
+
+        try:
+            ranges = {}
+            for field in RANGE_FIELDS:
+                low, high = data.get(f'min_{field}'), data.get(f'max_{field}')
+                ranges[field] = (
+                    float(low) if low is not None else None,
+                    float(high) if high is not None else None
+                )
+            sort = str(data.get('sort') or 'name')
+            descending = sort.startswith('-')
+            limit = min(max(int(data.get('limit', 50)), 1), VIDEO_QUERY_MAX_LIMIT)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Range bounds and limit must be numbers'}), 400
+
+        try:
+            catalog = get_twelvelabs_service(api_key).get_catalog(index_id, refresh=bool(data.get('refresh')))
+        except Exception as e:
+            logger.error(f"Error loading catalog for index {index_id}: {str(e)}")
+            return jsonify({'success': False, 'error': str(e)}), 500
+
+        try:
+            videos, next_cursor = catalog.query(
+                ranges=ranges,
+                search=str(data['q']) if data.get('q') else None,
+                prefix=str(data['prefix']) if data.get('prefix') else None,
+                sort=sort.lstrip('-'),
+                descending=descending,
+                limit=limit,
+                cursor=data.get('cursor')
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        return jsonify({
+            'success': True,
+            'videos': videos,
+            'next_cursor': next_cursor,
+            'catalog_size': len(catalog),
+            'catalog_age': round(time.time() - catalog.built_at, 1)
+        })
+
+    @app.route('/api/videos/stream', methods=['POST'])
+    def stream_videos():
+        # Every video in the index as NDJSON, one line per video, written as
+        # pages arrive rather than after the whole index is loaded
+        data = request.get_json(silent=True) or {}
+        api_key = data.get('api_key') or app.config.get('TWELVELABS_API_KEY_ENV')
+        index_id = data.get('index_id')
+
+        if not api_key:
+            return jsonify({'success': False, 'error': 'TwelveLabs API key is required. Please connect your API key in the UI or set TWELVELABS_API_KEY in environment variables.'}), 400
+        if not index_id:
+            return jsonify({'success': False, 'error': 'Index ID is required'}), 400
+        try:
+            page_limit = min(max(int(data.get('page_limit', 50)), 1), 50)
+            window = min(max(int(data.get('window', app.config.get('CATALOG_STREAM_WINDOW', 4))), 1), 16)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'page_limit and window must be integers'}), 400
+
+        service = get_twelvelabs_service(api_key)
+
+        def generate():
+            count = 0
+            try:
+                for video in service.iter_videos(index_id, page_limit=page_limit, window=window):
+                    count += 1
+                    yield ndjson({'type': 'video', 'video': video})
+                yield ndjson({'type': 'complete', 'index_id': index_id, 'count': count})
+            except Exception as e:
+                logger.error(f"Video stream for index {index_id} failed after {count} videos: {str(e)}")
+                yield ndjson({'type': 'error', 'message': str(e), 'count': count})
+
+        return Response(generate(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'
+        })
+
     @app.route('/api/upload', methods=['POST'])
     def upload_video():
         try:
@@ -346,38 +1054,187 @@ def register_routes(app):
             if not upload_file or upload_file.filename == '':
                 return jsonify({'success': False, 'error': 'Invalid file'}), 400
             
-            import tempfile
-            import os
-            tmp_file = tempfile.NamedTemporaryFile(delete=False)
-            tmp_file_path = tmp_file.name
-            tmp_file.close()
-            upload_file.save(tmp_file_path)
+            # Spool the file and hand it to the job workers; indexing can take
+            # many minutes, so the client polls or streams the job instead.
+            jobs = get_upload_job_manager()
+            job_id, spool_path, content_sha256 = jobs.spool(upload_file.stream)
+            job = jobs.submit(job_id, spool_path, default_index_id, filename=upload_file.filename, content_sha256=content_sha256)
             
-            logger.info(f"Temporary file created: {tmp_file_path}")
-            
-            try:
-                service = TwelveLabsService(api_key=api_key)
-                logger.info("Starting video upload and indexing...")
-                result = service.upload_video_file(index_id=default_index_id, file_path=tmp_file_path)
-                logger.info(f"Upload and indexing completed with result: {result}")
-            finally:
-                # Clean up temporary file after indexing is complete (or failed)
-                try:
-                    if os.path.exists(tmp_file_path):
-                        os.remove(tmp_file_path)
-                        logger.info(f"Temporary file deleted: {tmp_file_path}")
-                    else:
-                        logger.warning(f"Temporary file not found for deletion: {tmp_file_path}")
-                except Exception as e:
-                    logger.error(f"Failed to delete temporary file {tmp_file_path}: {str(e)}")
-            
-            if 'error' in result:
-                return jsonify({'success': False, 'error': result['error'], 'task': result.get('task')}), 400
-            
-            return jsonify({'success': True, 'video_id': result.get('video_id'), 'status': result.get('status')})
+            return upload_job_response(job)
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+
+    @app.route('/api/upload/stream', methods=['POST'])
+    def upload_video_stream():
+        # Raw video bytes in the body are piped to TwelveLabs as they arrive,
+        # without a temp file. Clients that need retries use /api/upload.
+        try:
+            api_key = app.config.get('TWELVELABS_API_KEY_ENV')
+            default_index_id = app.config.get('TWELVELABS_DEFAULT_INDEX_ID')
+            if not api_key:
+                return jsonify({'success': False, 'error': 'TwelveLabs API key not configured in environment'}), 400
+            if not default_index_id:
+                return jsonify({'success': False, 'error': 'Default index id not configured in environment (TWELVELABS_INDEX_ID)'}), 400
+
+            if request.mimetype == 'multipart/form-data':
+                return jsonify({'success': False, 'error': 'Send the raw file as the request body, or use /api/upload for form uploads'}), 400
+            filename = request.args.get('filename') or request.headers.get('X-Filename')
+            if not filename:
+                return jsonify({'success': False, 'error': 'filename query parameter is required'}), 400
+            if request.content_length == 0:
+                return jsonify({'success': False, 'error': 'No file uploaded'}), 400
+
+            content_sha256 = (request.headers.get('X-Content-SHA256') or '').strip().lower() or None
+            job = get_upload_job_manager().upload_stream(
+                request.stream,
+                default_index_id,
+                filename,
+                file_size=request.content_length,
+                content_sha256=content_sha256
+            )
+            if job['status'] == 'failed':
+                return jsonify({'success': False, 'error': job['error'], 'job_id': job['job_id']}), 400
+
+            return upload_job_response(job)
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+
+    @app.route('/api/upload/jobs/<job_id>', methods=['GET'])
+    def get_upload_job(job_id):
+        job = get_upload_job_manager().get(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'Upload job not found'}), 404
+        return jsonify({'success': True, 'job': public_upload_job(job)})
+
+    @app.route('/api/upload/jobs/<job_id>/stream', methods=['GET'])
+    def stream_upload_job(job_id):
+        jobs = get_upload_job_manager()
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'Upload job not found'}), 404
+
+        def generate():
+            current = job
+            yield ndjson({'type': 'job', 'job': public_upload_job(current)})
+            while current['status'] not in TERMINAL_STATUSES:
+                updated = jobs.wait(job_id, current['version'], timeout=UPLOAD_STREAM_HEARTBEAT)
+                if updated['version'] == current['version']:
+                    # Keep proxies from closing an idle stream during long indexing
+                    yield ndjson({'type': 'heartbeat'})
+                    continue
+                current = updated
+                yield ndjson({'type': 'job', 'job': public_upload_job(current)})
+
+        return Response(generate(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'
+        })
+
+    @app.route('/api/webhooks/twelvelabs', methods=['POST'])
+    def twelvelabs_webhook():
+        secret = app.config.get('TWELVELABS_WEBHOOK_SECRET')
+        if not secret:
+            return jsonify({'success': False, 'error': 'Webhooks are not configured (set TWELVELABS_WEBHOOK_SECRET)'}), 404
+
+        body = request.get_data()
+        try:
+            verify_signature(secret, request.headers.get('TL-Signature'), body, tolerance_seconds=app.config.get('WEBHOOK_TOLERANCE_SECONDS', 300))
+        except WebhookError as e:
+            logger.warning(f"Rejected TwelveLabs webhook: {str(e)}")
+            return jsonify({'success': False, 'error': str(e)}), 401
+
+        try:
+            event = parse_task_event(json.loads(body))
+        except (ValueError, WebhookError) as e:
+            return jsonify({'success': False, 'error': f'Invalid webhook payload: {str(e)}'}), 400
+        if event is None:
+            # Acknowledge events we do not use so they are not retried
+            return jsonify({'success': True, 'ignored': True})
+
+        task_id, status, task = event
+        matched = get_task_poller().notify(task_id, status, task)
+        logger.info(f"TwelveLabs webhook: task {task_id} {status} (matched={matched})")
+        return jsonify({'success': True, 'task_id': task_id, 'status': status, 'matched': matched})
+
+    @app.route('/api/admin/content-index/rebuild', methods=['POST'])
+    def rebuild_content_index():
+        error = admin_error(app.config)
+        if error:
+            return error
+        try:
+            data = request.get_json(silent=True) or {}
+            index_id = data.get('index_id') or app.config.get('TWELVELABS_DEFAULT_INDEX_ID')
+            if not index_id:
+                return jsonify({'success': False, 'error': 'Index ID is required'}), 400
+
+            # Videos uploaded through this backend carry their hash in user_metadata
+            service = get_twelvelabs_service(app.config.get('TWELVELABS_API_KEY_ENV'))
+            scanned = 0
+            hashed = []
+            for video in service.iter_index_videos(index_id):
+                scanned += 1
+                content_sha256 = (video.get('user_metadata') or {}).get('content_sha256')
+                if content_sha256:
+                    filename = (video.get('system_metadata') or {}).get('filename')
+                    hashed.append((content_sha256, video.get('_id'), filename))
+
+            entries = get_content_index().rebuild(index_id, hashed)
+            logger.info(f"Rebuilt content index for {index_id}: {entries} entries from {scanned} videos")
+            return jsonify({'success': True, 'index_id': index_id, 'videos_scanned': scanned, 'entries': entries})
         except Exception as e:
+            logger.error(f"Content index rebuild failed: {str(e)}")
             return jsonify({'success': False, 'error': str(e)}), 500
 
+    @app.route('/api/admin/catalog/invalidate', methods=['POST'])
+    def invalidate_catalog():
+        # For catalog changes made outside this backend (e.g. videos deleted
+        # in the TwelveLabs dashboard)
+        error = admin_error(app.config)
+        if error:
+            return error
+        data = request.get_json(silent=True) or {}
+        index_id = data.get('index_id')
+        get_catalog_cache().invalidate(index_id=index_id)
+        return jsonify({'success': True, 'index_id': index_id})
+
+    @app.route('/api/admin/precompute', methods=['POST'])
+    def start_precompute():
+        # Fills the analysis cache for every video of an index in the background
+        error = admin_error(app.config)
+        if error:
+            return error
+        data = request.get_json(silent=True) or {}
+        index_id = data.get('index_id') or app.config.get('TWELVELABS_DEFAULT_INDEX_ID')
+        if not index_id:
+            return jsonify({'success': False, 'error': 'Index ID is required'}), 400
+        if not app.config.get('TWELVELABS_API_KEY_ENV'):
+            return jsonify({'success': False, 'error': 'Precompute runs with the TWELVELABS_API_KEY environment key, which is not set'}), 400
+
+        prompt = data.get('prompt') or load_workflow_prompts()[0]
+        job, started = get_precompute_manager().start(index_id, prompt)
+        return jsonify({'success': True, 'started': started, 'job': job}), 202
+
+    @app.route('/api/admin/precompute/<index_id>', methods=['GET'])
+    def get_precompute(index_id):
+        error = admin_error(app.config)
+        if error:
+            return error
+        job = get_precompute_manager().get(index_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'No precompute job for this index'}), 404
+        return jsonify({'success': True, 'job': job})
+
+    @app.route('/api/admin/precompute/<index_id>/cancel', methods=['POST'])
+    def cancel_precompute(index_id):
+        error = admin_error(app.config)
+        if error:
+            return error
+        job = get_precompute_manager().cancel(index_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'No precompute job for this index'}), 404
+        return jsonify({'success': True, 'job': job})
+
     @app.route('/api/video/<index_id>/<video_id>', methods=['POST'])
     def get_video_details(index_id, video_id):
         try:
@@ -389,7 +1246,7 @@ def register_routes(app):
                 return jsonify({'success': False, 'error': 'TwelveLabs API key is required. Please connect your API key in the UI or set TWELVELABS_API_KEY in environment variables.'}), 400
             
             # Create service with provided API key
-            service = TwelveLabsService(api_key=api_key)
+            service = get_twelvelabs_service(api_key)
             video_details = service.get_video_details(index_id, video_id)
             
             if video_details:
@@ -403,6 +1260,25 @@ def register_routes(app):
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
 
+    @app.route('/api/video/<index_id>/<video_id>/thumbnail', methods=['GET'])
+    def get_video_thumbnail(index_id, video_id):
+        # GET so it can be an <img src>; the key comes from a header when the
+        # caller can set one, otherwise from the environment
+        api_key = request.headers.get('X-TwelveLabs-Key') or app.config.get('TWELVELABS_API_KEY_ENV')
+        if not api_key:
+            return jsonify({'success': False, 'error': 'TwelveLabs API key is required. Please connect your API key in the UI or set TWELVELABS_API_KEY in environment variables.'}), 400
+
+        thumbnail = get_twelvelabs_service(api_key).get_video_thumbnail_cached(index_id, video_id)
+        if thumbnail is None:
+            return jsonify({'success': False, 'error': 'Thumbnail not available'}), 404
+
+        response = Response(thumbnail['data'], mimetype=thumbnail['content_type'])
+        response.set_etag(thumbnail['etag'])
+        response.cache_control.private = True
+        response.cache_control.max_age = app.config.get('THUMBNAIL_MAX_AGE', 86400)
+        # Answers If-None-Match with an empty 304
+        return response.make_conditional(request)
+
     @app.route('/api/analyze/<video_id>', methods=['POST'])
     def analyze_video(video_id):
         try:
@@ -410,6 +1286,8 @@ def register_routes(app):
             # Try client API key first, then fall back to environment
             api_key = data.get('api_key') or app.config.get('TWELVELABS_API_KEY_ENV')
             prompt = data.get('prompt')
+            index_id = data.get('index_id') or app.config.get('TWELVELABS_DEFAULT_INDEX_ID')
+            no_cache = bool(data.get('no_cache', False))
             
             if not api_key or api_key == '':
                 return jsonify({'success': False, 'error': 'TwelveLabs API key is required. Please connect your API key in the UI or set TWELVELABS_API_KEY in environment variables.'}), 400
@@ -418,12 +1296,13 @@ def register_routes(app):
                 return jsonify({'success': False, 'error': 'Prompt is required'}), 400
             
             # Create service with provided API key
-            service = TwelveLabsService(api_key=api_key)
-            analysis = service.analyze_video(video_id, prompt)
+            service = get_twelvelabs_service(api_key)
+            analysis, cached = service.analyze_video_cached(video_id, prompt, index_id=index_id, no_cache=no_cache)
             
             return jsonify({
                 'success': True,
-                'analysis': analysis
+                'analysis': analysis,
+                'cached': cached
             })
             
         except Exception as e:
@@ -445,8 +1324,13 @@ def register_routes(app):
             if not query:
                 return jsonify({'success': False, 'error': 'Query is required'}), 400
             
+            research_cache = get_research_cache()
+            result, cache_info = research_cache.lookup(query, no_cache=bool(data.get('no_cache')))
+            if result is not None:
+                return jsonify({'success': True, 'research': result, 'cache': cache_info})
+
             # Create service with provided API key
-            service = SonarService(api_key=api_key)
+            service = get_sonar_service(api_key)
             result = service.deep_research(query)
             
             if isinstance(result, dict) and 'error' in result:
@@ -456,9 +1340,11 @@ def register_routes(app):
                     'error': result['error']
                 }), 500
             
+            research_cache.set(query, result)
             return jsonify({
                 'success': True,
-                'research': result
+                'research': result,
+                'cache': LIVE_RESEARCH
             })
             
         except Exception as e:
@@ -469,79 +1355,141 @@ def register_routes(app):
             }), 500
 
 
-    # @app.route('/api/sonar/research/stream', methods=['POST'])
-    # def sonar_research_stream():
-    #     try:
-    #         data = request.get_json()
-    #         api_key = data.get('api_key') or app.config.get('PERPLEXITY_API_KEY')
-    #         query = data.get('query')
-            
-    #         if not api_key:
-    #             return jsonify({
-    #                 'success': False, 
-    #                 'error': 'API key is required. Please check your environment configuration.'
-    #             }), 401
-            
-    #         if not query:
-    #             return jsonify({'success': False, 'error': 'Query is required'}), 400
-            
-    #         # Create service with provided API key
-    #         service = SonarService(api_key=api_key)
-            
-    #         def generate():
-    #             try:
-    #                 for chunk in service.deep_research_stream(query):
-    #                     yield chunk
-    #             except Exception as e:
-    #                 logger.error(f"Error in streaming research: {str(e)}")
-    #                 yield json.dumps({
-    #                     'type': 'error',
-    #                     'message': str(e)
-    #                 }) + '\n'
-            
-    #         return Response(generate(), mimetype='text/event-stream')
-            
-    #     except Exception as e:
-    #         logger.error(f"Error setting up research stream: {str(e)}")
-    #         return jsonify({
-    #             'success': False, 
-    #             'error': f"Research stream failed: {str(e)}"
-    #         }), 500
+    @app.route('/api/sonar/research/stream', methods=['POST'])
+    def sonar_research_stream():
+        try:
+            data = request.get_json()
+            api_key = data.get('api_key') or app.config.get('PERPLEXITY_API_KEY')
+            query = data.get('query')
+            
+            if not api_key:
+                return jsonify({
+                    'success': False, 
+                    'error': 'API key is required. Please check your environment configuration.'
+                }), 401
+            
+            if not query:
+                return jsonify({'success': False, 'error': 'Query is required'}), 400
+            
+            # Create service with provided API key
+            service = get_sonar_service(api_key)
+            research_cache = get_research_cache()
+            no_cache = bool(data.get('no_cache'))
+            
+            def generate():
+                try:
+                    cached, cache_info = research_cache.lookup(query, no_cache=no_cache)
+                    if cached is not None:
+                        yield from cached_research_sse(cached, cache_info)
+                        return
+                    for event in service.deep_research_stream(query):
+                        if event['type'] == 'delta':
+                            yield f"data: {json.dumps({'content': event['content']})}\n\n"
+                        elif event['type'] == 'done':
+                            result = event['result']
+                            research_cache.set(query, result)
+                            yield from research_done_sse(result, LIVE_RESEARCH)
+                        else:
+                            yield f"data: {json.dumps({'error': event['error']})}\n\n"
+                except Exception as e:
+                    logger.error(f"Error in streaming research: {str(e)}")
+                    yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            
+            return Response(generate(), mimetype='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            })
+            
+        except Exception as e:
+            logger.error(f"Error setting up research stream: {str(e)}")
+            return jsonify({
+                'success': False, 
+                'error': f"Research stream failed: {str(e)}"
+            }), 500
 
     @app.route('/api/workflow', methods=['POST'])
     def complete_workflow():
-        # Load prompts from markdown files first
-        default_analysis_prompt = load_prompt_from_file('video_analysis_prompt.md')
-        if not default_analysis_prompt:
-            default_analysis_prompt = 'Describe what happens in this video'
-        
-        research_prompt_template = load_prompt_from_file('research_prompt.md')
-        if not research_prompt_template:
-            research_prompt_template = """Based on this video analysis: {analysis_result}
-
-Please research: {research_query}
-
-IMPORTANT: Please provide a comprehensive research response using proper markdown formatting including:
-- Use ## for main headings and ### for subheadings
-- If table, then proper mardkown table format
-
-Provide comprehensive insights with clear structure and professional formatting."""
-        
         try:
             data = request.get_json()
             logger.info(f"=== WORKFLOW REQUEST START ===")
             logger.info(f"Request data: {json.dumps(data, indent=2)}")
             
-            # Try client API key first, then fall back to environment
-            twelvelabs_api_key = data.get('twelvelabs_api_key') or app.config.get('TWELVELABS_API_KEY_ENV')
-            index_id = data.get('index_id')
-            video_id = data.get('video_id')
-            
-            analysis_prompt = data.get('analysis_prompt', default_analysis_prompt)
-            research_query = data.get('research_query')
+            params = parse_workflow_request(data, app.config)
+            api_key = params['twelvelabs_api_key']
+            coalescer = get_workflow_coalescer()
+            scheduler = get_workflow_scheduler()
+            store = get_checkpoint_store()
+            deadline = workflow_deadline(data, app.config)
+            skip = 0
+
+            if data.get('workflow_id'):
+                # Reconnect: replay the events the client missed, then follow
+                # the live run or continue an interrupted one
+                workflow_id = data['workflow_id']
+                checkpoint = store.load(workflow_id, api_key)
+                if checkpoint is None:
+                    return jsonify({'success': False, 'error': 'Unknown workflow'}), 404
+                store.count('reconnects')
+                skip = last_event_id(data, request.headers)
+                workflow_key = store.live_key(workflow_id) or coalescer.make_key('resume', workflow_id)
+                if not coalescer.in_flight(workflow_key) and not checkpoint.resumable:
+                    return Response(checkpoint.replay(skip), mimetype='text/event-stream', headers={
+                        'Cache-Control': 'no-cache',
+                        'X-Accel-Buffering': 'no'
+                    })
+                if store.held_elsewhere(workflow_id):
+                    return jsonify(workflow_elsewhere_body()), 409, {'Retry-After': str(int(store.lease_seconds))}
+
+                def start_run(run_ticket):
+                    # The run may have moved on since the checks above
+                    current = store.load(workflow_id, api_key)
+                    if current is None or not current.resumable:
+                        run_ticket.release()
+                        return iter(current.replay() if current is not None else ())
+                    if not store.claim(workflow_id, workflow_key):
+                        run_ticket.release()
+                        return iter([ndjson(dict(workflow_elsewhere_body(), type='error'))])
+                    store.count('resumed')
+                    store.count('stages_restored', len(current.stages))
+                    logger.info(f"Resuming workflow {workflow_id} after {sorted(current.stages) or 'no finished stages'}")
+                    return checkpointed_workflow(current, lambda cp: scheduled_workflow(
+                        scheduler, run_ticket, deadline,
+                        lambda: generate_workflow(twelvelabs_api_key=api_key, **cp.params, deadline=deadline, checkpoint=cp)
+                    ), resumed=True)
+            else:
+                # Identical requests already in flight share one upstream run;
+                # it is cancelled once every subscriber has disconnected
+                workflow_key = workflow_coalescing_key(coalescer, params)
+
+                def start_run(run_ticket):
+                    checkpoint = store.create(api_key, {name: value for name, value in params.items() if name != 'twelvelabs_api_key'}, workflow_key)
+                    return checkpointed_workflow(checkpoint, lambda cp: scheduled_workflow(
+                        scheduler, run_ticket, deadline,
+                        lambda: generate_workflow(**params, deadline=deadline, checkpoint=cp)
+                    ))
+
+            # Only a new run needs a workflow slot; joining one is free
+            ticket = None
+            if not coalescer.in_flight(workflow_key):
+                try:
+                    ticket = scheduler.admit(api_key, INTERACTIVE)
+                except SchedulerBusy as e:
+                    logger.warning(f"Workflow rejected ({e.status}): {e}")
+                    return jsonify(scheduler_busy_body(e)), e.status, {'Retry-After': str(e.retry_after)}
+
+            def start_workflow():
+                # The run checked above may have finished in the meantime
+                return start_run(ticket or scheduler.admit(api_key, INTERACTIVE, bounded=False))
 
             return Response(
-                generate_workflow(twelvelabs_api_key, index_id, video_id, analysis_prompt, research_query, research_prompt_template), 
+                coalescer.subscribe(
+                    workflow_key,
+                    start_workflow,
+                    on_abandon=deadline.cancel,
+                    heartbeat=ndjson({'type': 'heartbeat'}),
+                    on_join=ticket.release if ticket else None,
+                    skip=skip
+                ), 
                 mimetype='text/event-stream', 
                 headers={
                     'Cache-Control': 'no-cache',
@@ -553,6 +1501,27 @@ Provide comprehensive insights with clear structure and professional formatting.
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
 
+    @app.route('/api/workflow/batch', methods=['POST'])
+    def batch_workflow():
+        try:
+            data = request.get_json(silent=True) or {}
+            params = parse_batch_request(data, app.config)
+            try:
+                get_workflow_scheduler().check(params['twelvelabs_api_key'], BATCH)
+            except SchedulerBusy as e:
+                logger.warning(f"Batch workflow rejected ({e.status}): {e}")
+                return jsonify(scheduler_busy_body(e)), e.status, {'Retry-After': str(e.retry_after)}
+            logger.info(f"Batch workflow: {len(params['video_ids'] or [])} videos in {params['index_id']} ({params['mode']}, concurrency {params['concurrency']})")
+
+            return Response(generate_batch_workflow(**params), mimetype='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'Connection': 'keep-alive',
+                'X-Accel-Buffering': 'no'
+            })
+
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+
 #     @app.route('/api/workflow/streaming', methods=['POST'])
 #     def streaming_workflow():
 #         try:
@@ -0,0 +1,410 @@
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+import asyncio
+import json
+import logging
+import os
+from service.client_registry import get_async_twelvelabs_service, get_async_sonar_service
+from service.workflow_coalescer import get_async_workflow_coalescer
+from service.workflow_scheduler import INTERACTIVE, SchedulerBusy, get_workflow_scheduler
+from service.workflow_checkpoints import get_checkpoint_store
+from service.stage_graph import Stage, AsyncStageGraph
+from service.speculative_research import SpeculativeResearch, get_speculation_metrics
+from service.research_cache import get_research_cache
+from service.context_compactor import ContextCompactor
+from service.resilience import Deadline
+from routes.api_routes import (
+    WorkflowError,
+    analysis_line,
+    build_complete_event,
+    WORKFLOW_CHECKPOINT_STAGES,
+    WORKFLOW_STAGE_SHARES,
+    build_research_query,
+    context_compaction_line,
+    LIVE_RESEARCH,
+    buffered_research_lines,
+    cached_research_sse,
+    finish_checkpoint,
+    last_event_id,
+    ndjson,
+    parse_workflow_request,
+    partial_complete_event,
+    progress_line,
+    queued_line,
+    research_cache_scope,
+    research_delta_line,
+    research_done_sse,
+    research_draft_line,
+    scheduler_busy_body,
+    should_speculate,
+    validate_workflow_params,
+    video_details_line,
+    workflow_coalescing_key,
+    workflow_deadline,
+    workflow_elsewhere_body
+)
+
+logger = logging.getLogger(__name__)
+
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no'
+}
+
+
+async def generate_workflow_async(twelvelabs_api_key, index_id, video_id, analysis_prompt, research_query, research_prompt_template, no_cache=False, stream_research=False, speculative_research=None, deadline=None, checkpoint=None):
+    # Same stages and NDJSON events as generate_workflow, on the event loop.
+    # Stages still running when ``deadline`` expires or is cancelled are
+    # cancelled with their in-flight requests.
+    done = checkpoint.stages if checkpoint is not None else {}
+    if deadline is None:
+        deadline = Deadline(float(os.environ.get('WORKFLOW_DEADLINE_SECONDS', 240)))
+    validation_error = validate_workflow_params(twelvelabs_api_key, index_id, video_id, research_query)
+    if validation_error:
+        yield json.dumps({'type': 'error', 'message': validation_error}) + '\n'
+        return
+
+    try:
+        twelvelabs_service = get_async_twelvelabs_service(twelvelabs_api_key)
+        sonar_service = get_async_sonar_service()
+
+        async def video_details_stage(ctx):
+            ctx.emit(progress_line('video_details', 'Fetching video details...', 0))
+            video_details = await twelvelabs_service.get_video_details(
+                index_id, video_id, deadline=deadline.child(deadline.seconds * WORKFLOW_STAGE_SHARES['video_details'])
+            )
+            if not video_details:
+                raise WorkflowError('Could not retrieve video details')
+            ctx.emit(video_details_line(video_details))
+            return video_details
+
+        async def analysis_stage(ctx):
+            ctx.emit(progress_line('analysis', 'Analyzing video content...', 33))
+            analysis_result, analysis_cached = await twelvelabs_service.analyze_video_cached(
+                video_id, analysis_prompt, index_id=index_id, no_cache=no_cache,
+                deadline=deadline.child(deadline.seconds * WORKFLOW_STAGE_SHARES['analysis'])
+            )
+            ctx.emit(analysis_line(analysis_result, analysis_cached))
+            return analysis_result
+
+        async def research_stage(ctx):
+            ctx.emit(progress_line('research', 'Conducting deep research...', 66))
+            analysis_context, compaction = ContextCompactor().compact(ctx.results['analysis'], research_query)
+            ctx.emit(context_compaction_line(compaction))
+
+            research_cache = get_research_cache()
+            cache_query = build_research_query(research_prompt_template, analysis_context, research_query)
+            cache_scope = research_cache_scope(ctx.results['analysis'])
+            cached_result, cache_info = await asyncio.to_thread(
+                research_cache.lookup, cache_query, scope=cache_scope, question=research_query, no_cache=no_cache
+            )
+            if cached_result is not None:
+                for line in buffered_research_lines(cached_result, cache_info):
+                    ctx.emit(line)
+                return cached_result
+
+            enhanced_query = build_research_query(
+                research_prompt_template, analysis_context, research_query, speculation
+            )
+
+            if stream_research:
+                research_result = await stream_research_events_async(sonar_service, enhanced_query, ctx.emit, deadline)
+                if research_result is not None:
+                    if 'error' in research_result:
+                        raise WorkflowError(f'Research failed: {research_result["error"]}')
+                    await asyncio.to_thread(research_cache.set, cache_query, research_result, scope=cache_scope, question=research_query)
+                    research_content = research_result['choices'][0]['message']['content']
+                    ctx.emit(ndjson(build_complete_event(research_result, research_content)))
+                    return research_result
+                logger.warning("Streaming research failed before any content arrived, falling back to buffered research")
+
+            research_result = await sonar_service.deep_research(enhanced_query, timeout=180, deadline=deadline)
+            if 'error' in research_result:
+                raise WorkflowError(f'Research failed: {research_result["error"]}')
+            await asyncio.to_thread(research_cache.set, cache_query, research_result, scope=cache_scope, question=research_query)
+            for line in buffered_research_lines(research_result):
+                ctx.emit(line)
+            return research_result
+
+        async def speculative_research_stage(ctx):
+            return await speculation.run_async(on_draft=lambda result: ctx.emit(research_draft_line(result)), deadline=deadline)
+
+        def restored(name, stage_fn):
+            if name in done:
+                async def restored_stage(ctx):
+                    return done[name]
+                return restored_stage
+            return stage_fn
+
+        stages = [
+            Stage('video_details', restored('video_details', video_details_stage)),
+            Stage('analysis', restored('analysis', analysis_stage)),
+            Stage('research', restored('research', research_stage), deps=('video_details', 'analysis'))
+        ]
+
+        speculation = None
+        if not done and await asyncio.to_thread(should_speculate, twelvelabs_api_key, index_id, video_id, analysis_prompt, research_query, no_cache, speculative_research):
+            speculation = SpeculativeResearch(sonar_service, research_query, get_speculation_metrics())
+            stages.append(Stage('speculative_research', speculative_research_stage, ordered=False, required=False))
+
+        graph = AsyncStageGraph(stages, deadline=deadline)
+
+        async for kind, stage, payload in graph.run():
+            if kind == 'event':
+                yield payload
+            elif kind == 'result':
+                if checkpoint is not None and stage in WORKFLOW_CHECKPOINT_STAGES and stage not in done:
+                    await asyncio.to_thread(checkpoint.stage_done, stage, payload)
+            elif kind == 'error' and stage != 'speculative_research':
+                if deadline.expired:
+                    break
+                yield ndjson({'type': 'error', 'message': str(payload)})
+                return
+
+        if deadline.cancelled:
+            logger.info(f"Async workflow for video {video_id} cancelled, nobody is listening")
+        elif not graph.finished:
+            logger.warning(f"Async workflow for video {video_id} hit its {deadline.seconds:g}s deadline, sending partial results")
+            yield ndjson(partial_complete_event(graph.results, deadline))
+
+    except Exception as e:
+        yield ndjson({'type': 'error', 'message': str(e)})
+
+
+async def checkpointed_workflow_async(checkpoint, generator_factory, resumed=False):
+    # Async counterpart of checkpointed_workflow. Events are recorded into the
+    # checkpoint's buffer on the event loop; reading, flushing and closing the
+    # log happen in a worker thread.
+    try:
+        if resumed:
+            for line in await asyncio.to_thread(checkpoint.replay):
+                yield line
+            yield checkpoint.record(ndjson({
+                'type': 'workflow',
+                'workflow_id': checkpoint.workflow_id,
+                'resumed': True,
+                'completed_stages': sorted(checkpoint.stages)
+            }))
+        else:
+            yield checkpoint.record(ndjson({'type': 'workflow', 'workflow_id': checkpoint.workflow_id}))
+        async for line in generator_factory(checkpoint):
+            numbered = checkpoint.record(line)
+            if checkpoint.flush_due:
+                await asyncio.to_thread(checkpoint.flush)
+            yield numbered
+    finally:
+        await asyncio.to_thread(finish_checkpoint, checkpoint)
+
+
+async def replay_async(lines):
+    for line in lines:
+        yield line
+
+
+async def scheduled_workflow_async(scheduler, ticket, deadline, generator_factory):
+    # Async counterpart of scheduled_workflow. The scheduler is shared with
+    # the Flask routes, so its grant is handed over to the event loop.
+    loop = asyncio.get_running_loop()
+    granted = asyncio.Event()
+    ticket.on_grant(lambda: loop.call_soon_threadsafe(granted.set))
+    try:
+        while not ticket.granted:
+            if deadline.cancelled:
+                return
+            if deadline.expired:
+                yield ndjson({'type': 'error', 'message': 'Timed out waiting for a free workflow slot'})
+                return
+            yield queued_line(scheduler, ticket)
+            try:
+                await asyncio.wait_for(granted.wait(), min(scheduler.update_seconds, deadline.remaining()))
+            except asyncio.TimeoutError:
+                pass
+        async for event in generator_factory():
+            yield event
+    finally:
+        ticket.release()
+
+
+async def stream_research_events_async(sonar_service, enhanced_query, emit, deadline=None):
+    # Async counterpart of stream_research_events: emits research_delta lines and
+    # returns the assembled result, or None to fall back to buffered research.
+    received = 0
+    async for event in sonar_service.deep_research_stream(enhanced_query, timeout=180, deadline=deadline):
+        if event['type'] == 'delta':
+            received += len(event['content'])
+            emit(research_delta_line(event['content'], received))
+        elif event['type'] == 'done':
+            return event['result']
+        elif event['type'] == 'error':
+            if received == 0:
+                logger.warning(f"Streaming research error: {event['error']}")
+                return None
+            return {'error': event['error']}
+    return None if received == 0 else {'error': 'Research stream ended unexpectedly'}
+
+
+def build_async_routes(config):
+    # Async handlers for the long-lived streaming endpoints. Everything else is
+    # served by the Flask app mounted behind these routes (see asgi_app.py).
+
+    async def complete_workflow(request):
+        try:
+            data = await request.json()
+            logger.info(f"=== ASYNC WORKFLOW REQUEST START ===")
+
+            params = parse_workflow_request(data, config)
+            api_key = params['twelvelabs_api_key']
+            coalescer = get_async_workflow_coalescer()
+            scheduler = get_workflow_scheduler()
+            store = get_checkpoint_store()
+            deadline = workflow_deadline(data, config)
+            skip = 0
+
+            if data.get('workflow_id'):
+                # Reconnect: replay the events the client missed, then follow
+                # the live run or continue an interrupted one
+                workflow_id = data['workflow_id']
+                checkpoint = await asyncio.to_thread(store.load, workflow_id, api_key)
+                if checkpoint is None:
+                    return JSONResponse({'success': False, 'error': 'Unknown workflow'}, status_code=404)
+                store.count('reconnects')
+                skip = last_event_id(data, request.headers)
+                workflow_key = store.live_key(workflow_id) or coalescer.make_key('resume', workflow_id)
+                if not coalescer.in_flight(workflow_key) and not checkpoint.resumable:
+                    replayed = await asyncio.to_thread(checkpoint.replay, skip)
+                    return StreamingResponse(replay_async(replayed), media_type='text/event-stream', headers=STREAM_HEADERS)
+                if await asyncio.to_thread(store.held_elsewhere, workflow_id):
+                    return JSONResponse(workflow_elsewhere_body(), status_code=409, headers={'Retry-After': str(int(store.lease_seconds))})
+
+                async def start_run(run_ticket):
+                    # The run may have moved on since the checks above
+                    current = await asyncio.to_thread(store.load, workflow_id, api_key)
+                    if current is None or not current.resumable:
+                        run_ticket.release()
+                        replayed = await asyncio.to_thread(current.replay) if current is not None else ()
+                        async for line in replay_async(replayed):
+                            yield line
+                        return
+                    if not await asyncio.to_thread(store.claim, workflow_id, workflow_key):
+                        run_ticket.release()
+                        yield ndjson(dict(workflow_elsewhere_body(), type='error'))
+                        return
+                    store.count('resumed')
+                    store.count('stages_restored', len(current.stages))
+                    logger.info(f"Resuming async workflow {workflow_id} after {sorted(current.stages) or 'no finished stages'}")
+                    async for line in checkpointed_workflow_async(current, lambda cp: scheduled_workflow_async(
+                        scheduler, run_ticket, deadline,
+                        lambda: generate_workflow_async(twelvelabs_api_key=api_key, **cp.params, deadline=deadline, checkpoint=cp)
+                    ), resumed=True):
+                        yield line
+            else:
+                # Identical requests already in flight share one upstream run;
+                # it is cancelled once every subscriber has disconnected
+                workflow_key = workflow_coalescing_key(coalescer, params)
+
+                async def start_run(run_ticket):
+                    checkpoint = await asyncio.to_thread(
+                        store.create, api_key, {name: value for name, value in params.items() if name != 'twelvelabs_api_key'}, workflow_key
+                    )
+                    async for line in checkpointed_workflow_async(checkpoint, lambda cp: scheduled_workflow_async(
+                        scheduler, run_ticket, deadline,
+                        lambda: generate_workflow_async(**params, deadline=deadline, checkpoint=cp)
+                    )):
+                        yield line
+
+            # Only a new run needs a workflow slot; joining one is free. The
+            # async coalescer lives on this loop, so nothing can start or end
+            # a run between this check and subscribe().
+            ticket = None
+            if not coalescer.in_flight(workflow_key):
+                try:
+                    ticket = scheduler.admit(api_key, INTERACTIVE)
+                except SchedulerBusy as e:
+                    logger.warning(f"Async workflow rejected ({e.status}): {e}")
+                    return JSONResponse(scheduler_busy_body(e), status_code=e.status, headers={'Retry-After': str(e.retry_after)})
+
+            return StreamingResponse(
+                coalescer.subscribe(
+                    workflow_key,
+                    lambda: start_run(ticket),
+                    on_abandon=deadline.cancel,
+                    on_join=ticket.release if ticket else None,
+                    skip=skip
+                ),
+                media_type='text/event-stream',
+                headers=STREAM_HEADERS
+            )
+
+        except Exception as e:
+            return JSONResponse({'success': False, 'error': str(e)}, status_code=500)
+
+    async def sonar_research_stream(request):
+        try:
+            data = await request.json()
+            api_key = data.get('api_key') or config.get('PERPLEXITY_API_KEY')
+            query = data.get('query')
+
+            if not api_key:
+                return JSONResponse({
+                    'success': False,
+                    'error': 'API key is required. Please check your environment configuration.'
+                }, status_code=401)
+
+            if not query:
+                return JSONResponse({'success': False, 'error': 'Query is required'}, status_code=400)
+
+            service = get_async_sonar_service(api_key)
+            research_cache = get_research_cache()
+            no_cache = bool(data.get('no_cache'))
+
+            async def generate():
+                try:
+                    cached, cache_info = await asyncio.to_thread(research_cache.lookup, query, no_cache=no_cache)
+                    if cached is not None:
+                        for line in cached_research_sse(cached, cache_info):
+                            yield line
+                        return
+                    async for event in service.deep_research_stream(query):
+                        if event['type'] == 'delta':
+                            yield f"data: {json.dumps({'content': event['content']})}\n\n"
+                        elif event['type'] == 'done':
+                            result = event['result']
+                            await asyncio.to_thread(research_cache.set, query, result)
+                            for line in research_done_sse(result, LIVE_RESEARCH):
+                                yield line
+                        else:
+                            yield f"data: {json.dumps({'error': event['error']})}\n\n"
+                except Exception as e:
+                    logger.error(f"Error in streaming research: {str(e)}")
+                    yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+            return StreamingResponse(generate(), media_type='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            })
+
+        except Exception as e:
+            logger.error(f"Error setting up research stream: {str(e)}")
+            return JSONResponse({
+                'success': False,
+                'error': f"Research stream failed: {str(e)}"
+            }, status_code=500)
+
+    # Same CORS policy as the Flask app; applied per route so the mounted Flask
+    # app (which has its own CORS handling) does not get duplicate headers.
+    cors = [Middleware(
+        CORSMiddleware,
+        allow_origins=['*'],
+        allow_methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH'],
+        allow_headers=['Content-Type', 'Authorization', 'X-Requested-With', 'Accept', 'Origin'],
+        allow_credentials=True,
+        expose_headers=['Content-Range', 'X-Content-Range']
+    )]
+
+    return [
+        Route('/api/workflow', complete_workflow, methods=['POST', 'OPTIONS'], middleware=cors),
+        Route('/api/sonar/research/stream', sonar_research_stream, methods=['POST', 'OPTIONS'], middleware=cors)
+    ]
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from service.disk_store import SizeCappedDiskStore
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_DIR = os.path.join(BACKEND_DIR, '.cache', 'analysis')
+
+
+def normalize_prompt(prompt):
+    # Whitespace differences (trailing newlines from the markdown prompt files,
+    # double spaces from the UI) should not produce separate cache entries.
+    return re.sub(r'\s+', ' ', prompt or '').strip()
+
+
+def prompt_hash(prompt):
+    return hashlib.sha256(normalize_prompt(prompt).encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """Two-tier cache for TwelveLabs analyze results.
+
+    Entries are keyed on (API key, index_id, video_id, normalized prompt
+    hash), so one tenant's analyses are never served to another. The
+    memory tier is a bounded LRU; the disk tier stores one JSON file per key so
+    results survive restarts and is trimmed oldest-first once it grows past
+    ``max_disk_bytes``. Both tiers honour the same TTL.
+    """
+
+    def __init__(self, cache_dir=None, ttl_seconds=None, max_memory_entries=None, max_disk_bytes=None):
+        self.cache_dir = cache_dir or os.environ.get('ANALYSIS_CACHE_DIR') or DEFAULT_CACHE_DIR
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.environ.get('ANALYSIS_CACHE_TTL', 7 * 24 * 3600))
+        self.max_memory_entries = max_memory_entries or int(os.environ.get('ANALYSIS_CACHE_MEMORY_ENTRIES', 256))
+        self.max_disk_bytes = max_disk_bytes or int(os.environ.get('ANALYSIS_CACHE_DISK_MB', 512)) * 1024 * 1024
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = SizeCappedDiskStore(self.cache_dir, '.json', self.max_disk_bytes, name='analysis cache')
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'bypassed': 0,
+            'writes': 0,
+            'expired': 0
+        }
+
+    def make_key(self, api_key, index_id, video_id, prompt):
+        raw = json.dumps([api_key or '', index_id or '', video_id, prompt_hash(prompt)])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _is_expired(self, created_at):
+        return self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds
+
+    def get(self, api_key, index_id, video_id, prompt):
+        key = self.make_key(api_key, index_id, video_id, prompt)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._is_expired(entry['created_at']):
+                    del self._memory[key]
+                    self._stats['expired'] += 1
+                else:
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return entry['analysis']
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+            self._remember(key, entry)
+        return entry['analysis']
+
+    def contains(self, api_key, index_id, video_id, prompt):
+        # Cheap presence check that does not count towards hit/miss stats
+        key = self.make_key(api_key, index_id, video_id, prompt)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._is_expired(entry['created_at']):
+                return True
+        return self._read_disk(key) is not None
+
+    def set(self, api_key, index_id, video_id, prompt, analysis):
+        if not analysis:
+            return
+        key = self.make_key(api_key, index_id, video_id, prompt)
+        entry = {
+            'index_id': index_id or '',
+            'video_id': video_id,
+            'prompt_hash': prompt_hash(prompt),
+            'created_at': time.time(),
+            'analysis': analysis
+        }
+        with self._lock:
+            self._remember(key, entry)
+            self._stats['writes'] += 1
+        self._write_disk(key, entry)
+
+    def invalidate(self, api_key, index_id, video_id, prompt):
+        key = self.make_key(api_key, index_id, video_id, prompt)
+        with self._lock:
+            self._memory.pop(key, None)
+        self._disk.remove(key)
+
+    def lookup(self, api_key, index_id, video_id, prompt, no_cache=False):
+        if no_cache:
+            with self._lock:
+                self._stats['bypassed'] += 1
+            return None
+        return self.get(api_key, index_id, video_id, prompt)
+
+    def get_or_compute(self, api_key, index_id, video_id, prompt, compute, no_cache=False):
+        """Return ``(analysis, cache_hit)``, calling ``compute()`` on a miss.
+
+        ``no_cache`` skips the lookup but still stores the fresh result so the
+        next normal request benefits from it.
+        """
+        cached = self.lookup(api_key, index_id, video_id, prompt, no_cache=no_cache)
+        if cached is not None:
+            return cached, True
+
+        analysis = compute()
+        self.set(api_key, index_id, video_id, prompt, analysis)
+        return analysis, False
+
+    def stats(self):
+        disk_bytes = self._disk.disk_bytes
+        with self._lock:
+            stats = dict(self._stats)
+            stats['evictions'] = self._disk.evictions
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_bytes'] = disk_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        entry = self._disk.read(key, lambda data: json.loads(data.decode('utf-8')))
+        if entry is not None and self._is_expired(entry.get('created_at', 0)):
+            with self._lock:
+                self._stats['expired'] += 1
+            self._disk.remove(key)
+            return None
+        return entry
+
+    def _write_disk(self, key, entry):
+        self._disk.write(key, json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+
+
+_analysis_cache = None
+_analysis_cache_lock = threading.Lock()
+
+
+def get_analysis_cache():
+    global _analysis_cache
+    if _analysis_cache is None:
+        with _analysis_cache_lock:
+            if _analysis_cache is None:
+                _analysis_cache = AnalysisCache()
+    return _analysis_cache
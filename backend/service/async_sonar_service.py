@@ -0,0 +1,104 @@
+import httpx
+import os
+from service.http_transport import get_transport
+from service.sonar_service import SonarStreamAssembler
+
+
+class AsyncSonarService:
+    # asyncio variant of SonarService with the same return and event shapes
+
+    def __init__(self, api_key=None):
+        if api_key is None:
+            api_key = os.environ.get('PERPLEXITY', '')
+        self.api_key = api_key
+        self.transport = get_transport()
+        self.base_url = "https://api.perplexity.ai/chat/completions"
+
+    def _request(self, query, stream=False):
+        payload = {
+            "model": "sonar",
+            "messages": [
+                {"role": "user", "content": query}
+            ]
+        }
+        if stream:
+            payload["stream"] = True
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        return payload, headers
+
+    async def deep_research(self, query, timeout=180, deadline=None):
+        try:
+            if not self.api_key:
+                raise ValueError("API key is required")
+
+            payload, headers = self._request(query)
+            response = await self.transport.arequest(
+                'POST',
+                self.base_url,
+                json=payload,
+                headers=headers,
+                timeout=timeout,
+                deadline=deadline
+            )
+
+            if response.status_code == 200:
+                return response.json()
+            else:
+                print(f"Error: {response.status_code} - {response.text}")
+                return {"error": f"API request failed with status {response.status_code}"}
+
+        except httpx.TimeoutException:
+            print("Request timed out")
+            return {"error": "Request timed out - Sonar research is taking too long"}
+        except httpx.HTTPError as e:
+            print(f"Request error: {e}")
+            return {"error": f"Network error: {str(e)}"}
+        except Exception as e:
+            print(f"Error in deep_research: {e}")
+            return {"error": str(e)}
+
+    async def deep_research_stream(self, query, timeout=180, deadline=None):
+        # Same events as SonarService.deep_research_stream, including the stop
+        # once ``deadline`` expires or is cancelled
+        try:
+            if not self.api_key:
+                raise ValueError("API key is required")
+
+            payload, headers = self._request(query, stream=True)
+            response = await self.transport.arequest(
+                'POST', self.base_url, json=payload, headers=headers, stream=True, timeout=timeout, deadline=deadline
+            )
+            try:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    print(f"Error: {response.status_code} - {body[:500]!r}")
+                    yield {'type': 'error', 'error': f"API request failed with status {response.status_code}"}
+                    return
+
+                assembler = SonarStreamAssembler()
+                async for line in response.aiter_lines():
+                    if deadline is not None and (deadline.cancelled or deadline.expired):
+                        yield {'type': 'error', 'error': 'Research stopped: deadline exceeded or cancelled'}
+                        return
+                    content = assembler.feed(line)
+                    if content:
+                        yield {'type': 'delta', 'content': content}
+                    if assembler.done:
+                        break
+            finally:
+                await response.aclose()
+
+            yield {'type': 'done', 'result': assembler.final_result()}
+
+        except httpx.TimeoutException:
+            print("Streaming request timed out")
+            yield {'type': 'error', 'error': 'Request timed out - Sonar research is taking too long'}
+        except httpx.HTTPError as e:
+            print(f"Streaming request error: {e}")
+            yield {'type': 'error', 'error': f"Network error: {str(e)}"}
+        except Exception as e:
+            print(f"Error in deep_research_stream: {e}")
+            yield {'type': 'error', 'error': str(e)}
@@ -0,0 +1,69 @@
+from twelvelabs import AsyncTwelveLabs
+import asyncio
+import os
+from service.analysis_cache import get_analysis_cache
+from service.http_transport import get_transport
+from service.resilience import CallCancelled
+
+
+class AsyncTwelveLabsService:
+    # asyncio variant of TwelveLabsService for the ASGI app; shares the
+    # analysis cache and the transport's async connection pool.
+
+    def __init__(self, api_key=None):
+        if api_key is None:
+            api_key = os.environ.get('TWELVELABS_API_KEY', '')
+        self.api_key = api_key
+        self.transport = get_transport()
+        self.http = self.transport.async_client()
+        self.client = AsyncTwelveLabs(api_key=api_key, httpx_client=self.http)
+
+    async def analyze_video(self, video_id, prompt, index_id=None, no_cache=False):
+        analysis, _ = await self.analyze_video_cached(video_id, prompt, index_id=index_id, no_cache=no_cache)
+        return analysis
+
+    async def analyze_video_cached(self, video_id, prompt, index_id=None, no_cache=False, deadline=None):
+        cache = get_analysis_cache()
+        # Cache reads may hit the disk tier, keep them off the event loop
+        cached = await asyncio.to_thread(cache.lookup, self.api_key, index_id, video_id, prompt, no_cache)
+        if cached is not None:
+            return cached, True
+
+        try:
+            request_options = None
+            if deadline is not None:
+                if deadline.cancelled:
+                    raise CallCancelled(f"Analysis of video {video_id} was cancelled")
+                request_options = {'timeout_in_seconds': max(1, int(deadline.remaining()))}
+            analysis_response = await self.client.analyze(
+                video_id=video_id,
+                prompt=prompt,
+                request_options=request_options
+            )
+        except Exception as e:
+            print(f"Error analyzing video {video_id}: {e}")
+            raise e
+
+        analysis = analysis_response.data
+        await asyncio.to_thread(cache.set, self.api_key, index_id, video_id, prompt, analysis)
+        return analysis, False
+
+    async def get_video_details(self, index_id, video_id, deadline=None):
+        if not self.api_key:
+            return None
+        url = f"https://api.twelvelabs.io/v1.3/indexes/{index_id}/videos/{video_id}?embed=false"
+        headers = {
+            "accept": "application/json",
+            "x-api-key": self.api_key,
+            "Content-Type": "application/json"
+        }
+        try:
+            response = await self.transport.arequest('GET', url, headers=headers, hedge=True, deadline=deadline)
+            if response.status_code == 200:
+                return response.json()
+            else:
+                print(f"Failed to get video details: Status {response.status_code}")
+                return None
+        except Exception as e:
+            print(f"Exception getting video details: {str(e)}")
+            return None
@@ -0,0 +1,177 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+
+    def __init__(self, value):
+        self.value = value
+        self.fetched_at = time.time()
+
+
+class CatalogCache:
+    """Stale-while-revalidate cache for catalog listings.
+
+    Keys are ``(kind, api_key, index_id, page)`` tuples. Entries younger than
+    ``fresh_seconds`` are served as is; older ones up to ``stale_seconds``
+    are served immediately while a background refresh replaces them. Only a
+    missing or expired entry makes the caller wait, and concurrent callers
+    for the same key share a single upstream fetch.
+
+    ``invalidate`` drops matching entries and discards results of fetches
+    that were already running, so a refresh started before an upload cannot
+    put the old listing back.
+    """
+
+    def __init__(self, fresh_seconds=None, stale_seconds=None, max_entries=None, workers=None):
+        self.fresh_seconds = fresh_seconds if fresh_seconds is not None else float(os.environ.get('CATALOG_FRESH_SECONDS', 30))
+        self.stale_seconds = stale_seconds if stale_seconds is not None else float(os.environ.get('CATALOG_STALE_SECONDS', 600))
+        self.max_entries = max_entries or int(os.environ.get('CATALOG_CACHE_ENTRIES', 512))
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or int(os.environ.get('CATALOG_REFRESH_WORKERS', 4)),
+            thread_name_prefix='catalog-refresh'
+        )
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'fresh_hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'prefetches': 0,
+            'invalidations': 0,
+            'errors': 0
+        }
+
+    def get(self, key, fetch, refresh=False):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not refresh:
+                age = now - entry.fetched_at
+                if age < self.fresh_seconds:
+                    self._entries.move_to_end(key)
+                    self._stats['fresh_hits'] += 1
+                    return entry.value
+                if age < self.stale_seconds:
+                    self._entries.move_to_end(key)
+                    self._stats['stale_hits'] += 1
+                    if self._schedule(key, fetch):
+                        self._stats['refreshes'] += 1
+                    return entry.value
+            self._stats['misses'] += 1
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._loading[key] = future
+
+        if owner:
+            self._load(key, fetch, future)
+        return future.result()
+
+    def peek(self, key):
+        # Cached value regardless of age, without touching stats or LRU order
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.value if entry is not None else None
+
+    def prefetch(self, key, fetch):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry.fetched_at < self.fresh_seconds:
+                return
+            if self._schedule(key, fetch):
+                self._stats['prefetches'] += 1
+
+    def _schedule(self, key, fetch):
+        # Called with the lock held; starts a background load unless one is
+        # already running for this key
+        if key in self._loading:
+            return False
+        future = Future()
+        self._loading[key] = future
+        self._executor.submit(self._load, key, fetch, future)
+        return True
+
+    def _load(self, key, fetch, future):
+        with self._lock:
+            epoch = self._epoch
+        try:
+            value = fetch()
+        except Exception as e:
+            with self._lock:
+                self._loading.pop(key, None)
+                self._stats['errors'] += 1
+            logger.warning(f"Catalog fetch for {key[0]} {key[2] or ''} failed: {e}")
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            self._loading.pop(key, None)
+            if epoch == self._epoch:
+                self._entries[key] = _Entry(value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(value)
+
+    def invalidate(self, index_id=None, api_key=None):
+        # With no arguments everything is dropped
+        with self._lock:
+            self._epoch += 1
+            self._stats['invalidations'] += 1
+            for key in list(self._entries):
+                _, key_api_key, key_index_id, _ = key
+                if index_id is not None and key_index_id != index_id:
+                    continue
+                if api_key is not None and key_api_key != api_key:
+                    continue
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['loading'] = len(self._loading)
+        served = stats['fresh_hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['fresh_hits'] + stats['stale_hits']) / served, 4) if served else 0.0
+        return stats
+
+
+_catalog_cache = None
+_catalog_cache_lock = threading.Lock()
+
+
+def get_catalog_cache():
+    global _catalog_cache
+    if _catalog_cache is None:
+        with _catalog_cache_lock:
+            if _catalog_cache is None:
+                _catalog_cache = CatalogCache()
+    return _catalog_cache
+
+
+_catalog_executor = None
+
+
+def get_catalog_executor():
+    # Shared pool for full-index scans; each scan bounds its own share of it
+    # with a fetch window
+    global _catalog_executor
+    if _catalog_executor is None:
+        with _catalog_cache_lock:
+            if _catalog_executor is None:
+                _catalog_executor = ThreadPoolExecutor(
+                    max_workers=int(os.environ.get('CATALOG_STREAM_WORKERS', 8)),
+                    thread_name_prefix='catalog-scan'
+                )
+    return _catalog_executor
@@ -0,0 +1,83 @@
+import os
+import threading
+from collections import OrderedDict
+
+from service.twelvelabs_service import TwelveLabsService
+from service.sonar_service import SonarService
+from service.async_twelvelabs_service import AsyncTwelveLabsService
+from service.async_sonar_service import AsyncSonarService
+
+
+class ClientRegistry:
+    """Bounded LRU of service instances keyed by (service, API key).
+
+    Building a ``TwelveLabsService`` constructs a TwelveLabs SDK client; reusing
+    one per key keeps its warm connections and avoids the setup on every
+    request.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or int(os.environ.get('CLIENT_CACHE_SIZE', 64))
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, kind, api_key, factory):
+        key = (kind, api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self._stats['hits'] += 1
+                return client
+
+        client = factory()
+        with self._lock:
+            existing = self._clients.get(key)
+            if existing is not None:
+                self._stats['hits'] += 1
+                return existing
+            self._clients[key] = client
+            self._stats['misses'] += 1
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self._stats['evictions'] += 1
+        return client
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._clients)
+            stats['max_size'] = self.max_size
+        return stats
+
+
+_registry = ClientRegistry()
+
+
+def get_client_registry():
+    return _registry
+
+
+def get_twelvelabs_service(api_key=None):
+    if api_key is None:
+        api_key = os.environ.get('TWELVELABS_API_KEY', '')
+    return _registry.get('twelvelabs', api_key, lambda: TwelveLabsService(api_key=api_key))
+
+
+def get_sonar_service(api_key=None):
+    if api_key is None:
+        api_key = os.environ.get('PERPLEXITY', '')
+    return _registry.get('sonar', api_key, lambda: SonarService(api_key=api_key))
+
+
+def get_async_twelvelabs_service(api_key=None):
+    if api_key is None:
+        api_key = os.environ.get('TWELVELABS_API_KEY', '')
+    return _registry.get('twelvelabs_async', api_key, lambda: AsyncTwelveLabsService(api_key=api_key))
+
+
+def get_async_sonar_service(api_key=None):
+    if api_key is None:
+        api_key = os.environ.get('PERPLEXITY', '')
+    return _registry.get('sonar_async', api_key, lambda: AsyncSonarService(api_key=api_key))
@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from service.analysis_cache import BACKEND_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_PATH = os.path.join(BACKEND_DIR, '.cache', 'content_index.json')
+
+
+class ContentHashIndex:
+    """Persisted map of (index_id, sha256 of the video file) to video_id.
+
+    Lets a repeated upload of the same file resolve to the already-indexed
+    video without sending anything upstream. The whole map lives in memory
+    and is rewritten atomically on every change; it holds one small entry
+    per uploaded video. The source of truth is the ``content_sha256`` key in
+    each video's ``user_metadata``, which ``rebuild`` reads back.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('CONTENT_INDEX_PATH') or DEFAULT_INDEX_PATH
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'removed': 0, 'rebuilds': 0}
+        self._load()
+
+    @staticmethod
+    def _key(index_id, content_sha256):
+        return f"{index_id}:{content_sha256}"
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable content index {self.path}: {e}")
+            self._entries = {}
+
+    def _save(self):
+        # Called with the lock held
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, index_id, content_sha256):
+        with self._lock:
+            entry = self._entries.get(self._key(index_id, content_sha256))
+            self._stats['hits' if entry else 'misses'] += 1
+            return dict(entry) if entry else None
+
+    def set(self, index_id, content_sha256, video_id, filename=None):
+        with self._lock:
+            self._entries[self._key(index_id, content_sha256)] = {
+                'video_id': video_id,
+                'filename': filename,
+                'indexed_at': time.time()
+            }
+            self._stats['writes'] += 1
+            self._save()
+
+    def remove(self, index_id, content_sha256, video_id):
+        # Drops a mapping whose video no longer exists, unless it has been
+        # pointed at another video meanwhile
+        key = self._key(index_id, content_sha256)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['video_id'] != video_id:
+                return
+            del self._entries[key]
+            self._stats['removed'] += 1
+            self._save()
+
+    def rebuild(self, index_id, videos):
+        # Replace every entry for ``index_id`` with the (content_sha256,
+        # video_id, filename) tuples found in the catalog.
+        prefix = f"{index_id}:"
+        with self._lock:
+            self._entries = {key: entry for key, entry in self._entries.items() if not key.startswith(prefix)}
+            for content_sha256, video_id, filename in videos:
+                self._entries[self._key(index_id, content_sha256)] = {
+                    'video_id': video_id,
+                    'filename': filename,
+                    'indexed_at': time.time()
+                }
+            self._stats['rebuilds'] += 1
+            self._save()
+            return sum(1 for key in self._entries if key.startswith(prefix))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+
+_content_index = None
+_content_index_lock = threading.Lock()
+
+
+def get_content_index():
+    global _content_index
+    if _content_index is None:
+        with _content_index_lock:
+            if _content_index is None:
+                _content_index = ContentHashIndex()
+    return _content_index
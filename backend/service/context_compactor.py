@@ -0,0 +1,96 @@
+import math
+import os
+import re
+import time
+from collections import Counter
+
+from service.research_cache import STOPWORDS
+
+# Paragraph/line breaks, or whitespace after sentence-ending punctuation
+UNIT_BOUNDARY = re.compile(r'\n+|(?<=[.!?])\s+')
+WORD = re.compile(r'[a-z0-9]+')
+
+
+def estimate_tokens(text):
+    # About four characters per token for English prose; cheap enough to run
+    # on every request and close enough to size a prompt
+    return (len(text or '') + 3) // 4
+
+
+def _terms(text):
+    return [t for t in WORD.findall(text.lower()) if t not in STOPWORDS]
+
+
+class ContextCompactor:
+    """Shrinks the video analysis before it is pasted into the research prompt.
+
+    The text is split into sentences (and lines, so markdown bullets and
+    headings stay whole). Repeated sentences are dropped first. If the result
+    is still over ``token_budget``, sentences are ranked by how many research
+    query terms they contain, weighted towards terms that are rare in the
+    analysis, with a small bonus for the opening sentences. The best ones that
+    fit are kept, in their original order. A budget of 0 only deduplicates.
+    """
+
+    LEAD_SENTENCES = 3
+
+    def __init__(self, token_budget=None):
+        self.token_budget = token_budget if token_budget is not None else int(os.environ.get('RESEARCH_CONTEXT_TOKENS', 3000))
+
+    def compact(self, text, query):
+        """Return ``(compacted_text, report)``.
+
+        ``report`` holds token estimates before and after, the number of
+        duplicate and trimmed sentences and the time taken.
+        """
+        started = time.perf_counter()
+        text = text if isinstance(text, str) else str(text or '')
+        tokens_before = estimate_tokens(text)
+
+        units, seen, duplicates = [], set(), 0
+        for unit in UNIT_BOUNDARY.split(text):
+            unit = unit.strip()
+            if not unit:
+                continue
+            fingerprint = ' '.join(WORD.findall(unit.lower()))
+            if fingerprint and fingerprint in seen:
+                duplicates += 1
+                continue
+            seen.add(fingerprint)
+            units.append(unit)
+
+        sizes = [estimate_tokens(unit) + 1 for unit in units]
+        trimmed = 0
+        if self.token_budget and sum(sizes) > self.token_budget:
+            keep = self._select(units, sizes, query)
+            trimmed = len(units) - len(keep)
+            units = [unit for i, unit in enumerate(units) if i in keep]
+
+        # Untouched text keeps its original layout
+        compacted = '\n'.join(units) if duplicates or trimmed else text
+        return compacted, {
+            'tokens_before': tokens_before,
+            'tokens_after': estimate_tokens(compacted),
+            'duplicates_removed': duplicates,
+            'sentences_trimmed': trimmed,
+            'token_budget': self.token_budget,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    def _select(self, units, sizes, query):
+        unit_terms = [set(_terms(unit)) for unit in units]
+        document_frequency = Counter(term for terms in unit_terms for term in terms)
+        query_terms = set(_terms(query or ''))
+        count = len(units)
+
+        def score(i):
+            relevance = sum(math.log(1 + count / document_frequency[t]) for t in query_terms & unit_terms[i])
+            lead = 0.5 if i < self.LEAD_SENTENCES else 0.0
+            return relevance + lead
+
+        keep, used = set(), 0
+        for i in sorted(range(count), key=lambda i: (-score(i), i)):
+            if used + sizes[i] <= self.token_budget:
+                keep.add(i)
+                used += sizes[i]
+        return keep
@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SizeCappedDiskStore:
+    """One file per key under ``directory``, trimmed least recently used first.
+
+    Values are opaque bytes; callers own the entry format and expiry. Every
+    read touches the file, so once the files with ``suffix`` grow past
+    ``max_bytes`` the ones read or written longest ago are removed, down to
+    90% of the budget so a full store does not evict on every write.
+    ``name`` only labels log messages.
+    """
+
+    def __init__(self, directory, suffix, max_bytes, name='cache'):
+        self.directory = directory
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.name = name
+        self.evictions = 0
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def read(self, key, decode):
+        """Return ``decode(data)`` for ``key``, or None if it is not stored.
+
+        An entry that cannot be read or decoded (``decode`` raising
+        ``ValueError``) is removed.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = decode(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Discarding unreadable {self.name} entry {path}: {e}")
+            self.remove(key)
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def write(self, key, data):
+        path = self.path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f"Failed to write {self.name} entry {path}: {e}")
+            return
+
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_bytes()
+            else:
+                self._bytes += size - previous_size
+            over_budget = self._bytes > self.max_bytes
+        if over_budget:
+            self._evict()
+
+    def remove(self, key):
+        path = self.path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes = max(0, self._bytes - size)
+
+    def recent_keys(self, limit):
+        # Up to ``limit`` stored keys, most recently used first
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(self.suffix)]
+            paths = sorted((os.path.join(self.directory, name) for name in names), key=os.path.getmtime, reverse=True)
+        except OSError:
+            return []
+        return [os.path.basename(path)[:-len(self.suffix)] for path in paths[:limit]]
+
+    @property
+    def disk_bytes(self):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_bytes()
+            return self._bytes
+
+    def _scan_bytes(self):
+        total = 0
+        try:
+            for name in os.listdir(self.directory):
+                if name.endswith(self.suffix):
+                    total += os.path.getsize(os.path.join(self.directory, name))
+        except OSError:
+            pass
+        return total
+
+    def _evict(self):
+        try:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith(self.suffix):
+                    path = os.path.join(self.directory, name)
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, st.st_size, path))
+        except OSError as e:
+            logger.warning(f"Failed to scan {self.name} directory: {e}")
+            return
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self._bytes = total
+            self.evictions += evicted
@@ -0,0 +1,590 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from service.rate_limiter import get_rate_limiter, retry_after_seconds
+from service.resilience import IDEMPOTENT_METHODS, RETRY_STATUSES, CallCancelled, Deadline, get_resilience
+
+logger = logging.getLogger(__name__)
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _replayable(kwargs):
+    # Streamed or file bodies are consumed by the first attempt
+    data = kwargs.get('data')
+    return 'files' not in kwargs and (data is None or isinstance(data, (bytes, str, dict)))
+
+
+def _attempt_timeout(timeout, remaining):
+    # The caller's timeout (a number or a (connect, read) pair) capped by
+    # what is left of the call's deadline
+    if isinstance(timeout, tuple):
+        return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+    if timeout is None:
+        return (min(10.0, remaining), remaining)
+    return min(timeout, remaining)
+
+
+def _httpx_timeout(timeout):
+    # _attempt_timeout's (connect, read) pair in httpx form
+    if isinstance(timeout, tuple):
+        return httpx.Timeout(timeout[1], connect=timeout[0])
+    return timeout
+
+
+def _discard_response(future):
+    # Closes the response of a hedge that lost the race
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+class _UpstreamTransport(httpx.BaseTransport):
+    # Puts SDK calls through the endpoint circuit breakers, the upstream rate
+    # limiter and the key pool
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def handle_request(self, request):
+        endpoint = get_resilience().endpoint(request.method, request.url)
+        endpoint.admit()
+        try:
+            response = self._send(request)
+        except httpx.TransportError:
+            endpoint.record(False)
+            raise
+        except BaseException:
+            endpoint.abandon()
+            raise
+        endpoint.record(response.status_code < 500)
+        return response
+
+    def _send(self, request):
+        upstream = get_rate_limiter().for_host(request.url.host)
+        if upstream is None:
+            return self.transport.handle_request(request)
+        key, tried = upstream.key_from(request.headers), set()
+        while True:
+            lease = upstream.acquire(key, exclude=tried)
+            if lease.wait:
+                time.sleep(lease.wait)
+            lease.apply(request.headers)
+            try:
+                response = self.transport.handle_request(request)
+            finally:
+                lease.release()
+            if response.status_code != 429:
+                return response
+            lease.throttled(retry_after_seconds(response.headers))
+            tried.add(lease.key)
+            if not (lease.pooled and isinstance(request.stream, httpx.ByteStream) and upstream.has_untried(tried)):
+                return response
+            response.close()
+
+    def close(self):
+        self.transport.close()
+
+
+class _AsyncUpstreamTransport(httpx.AsyncBaseTransport):
+    # Async counterpart of _UpstreamTransport. It also feeds the endpoint's
+    # latency window, which ``HttpTransport.arequest`` hedges on.
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        endpoint = get_resilience().endpoint(request.method, request.url)
+        endpoint.admit()
+        try:
+            response, latency = await self._send(request)
+        except httpx.TransportError:
+            endpoint.record(False)
+            raise
+        except BaseException:
+            endpoint.abandon()
+            raise
+        endpoint.record(response.status_code < 500, latency)
+        return response
+
+    async def _send(self, request):
+        # Returns the response and the seconds it took once sent, leaving out
+        # time spent queued in the rate limiter
+        upstream = get_rate_limiter().for_host(request.url.host)
+        if upstream is None:
+            sent_at = time.monotonic()
+            response = await self.transport.handle_async_request(request)
+            return response, time.monotonic() - sent_at
+        key, tried = upstream.key_from(request.headers), set()
+        while True:
+            lease = upstream.acquire(key, exclude=tried)
+            if lease.wait:
+                await asyncio.sleep(lease.wait)
+            lease.apply(request.headers)
+            sent_at = time.monotonic()
+            try:
+                response = await self.transport.handle_async_request(request)
+            finally:
+                lease.release()
+            if response.status_code != 429:
+                return response, time.monotonic() - sent_at
+            lease.throttled(retry_after_seconds(response.headers))
+            tried.add(lease.key)
+            if not (lease.pooled and isinstance(request.stream, httpx.ByteStream) and upstream.has_untried(tried)):
+                return response, time.monotonic() - sent_at
+            await response.aclose()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class HttpTransport:
+    """Process-wide keep-alive connection pools for upstream calls.
+
+    Direct REST calls go through one ``requests.Session`` per upstream host,
+    each with a bounded, blocking connection pool so a burst of requests waits
+    for a warm connection instead of opening unbounded sockets. The TwelveLabs
+    SDK gets a single shared ``httpx.Client`` (HTTP/2 when ``h2`` is installed)
+    instead of a fresh client per service instance.
+
+    Calls to the TwelveLabs and Perplexity APIs, on any of these clients,
+    first take a token from the upstream rate limiter and may be re-keyed
+    from the key pool; a 429 on a pooled key is replayed once per other key
+    when the request body can be sent again. Every call also passes its
+    endpoint's circuit breaker, and REST calls (``request``, or ``arequest``
+    on the async client) get the deadline, retry and hedging behaviour
+    described in ``Resilience``.
+    """
+
+    def __init__(self, pool_maxsize=None, http2=None, sdk_timeout=None):
+        self.pool_maxsize = pool_maxsize or int(os.environ.get('HTTP_POOL_MAXSIZE', 32))
+        if http2 is None:
+            http2 = os.environ.get('HTTP2_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+        self.http2 = http2 and _http2_available()
+        self.sdk_timeout = sdk_timeout or float(os.environ.get('TWELVELABS_SDK_TIMEOUT', 60))
+
+        self._sessions = {}
+        self._host_stats = {}
+        self._sdk_client = None
+        self._async_client = None
+        self._hedge_pool = None
+        self._sdk_stats = {'requests': 0, 'responses': 0, 'errors': 0}
+        self._async_stats = {'requests': 0, 'responses': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+    def _session_for(self, host):
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=1,
+                        pool_maxsize=self.pool_maxsize,
+                        pool_block=True
+                    )
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._sessions[host] = session
+                    self._host_stats[host] = {
+                        'requests': 0,
+                        'errors': 0,
+                        'in_flight': 0,
+                        'peak_in_flight': 0
+                    }
+        return session
+
+    def request(self, method, url, deadline=None, hedge=False, **kwargs):
+        """Send a request with a deadline, retries, hedging and circuit breaking.
+
+        ``deadline`` (seconds) bounds all attempts and backoff together; it
+        defaults to a numeric ``timeout``, else the resilience default. It
+        may also be a ``Deadline`` shared with other calls, which caps that
+        default and raises ``CallCancelled`` once cancelled.
+        Pass ``hedge=True`` for cheap GETs that may be sent twice when slow.
+        Raises ``CircuitOpenError`` without sending while the endpoint's
+        breaker is open.
+        """
+        resilience = get_resilience()
+        endpoint = resilience.endpoint(method, url)
+        timeout = kwargs.pop('timeout', None)
+        budget = deadline if isinstance(deadline, Deadline) else None
+        if deadline is None or budget is not None:
+            deadline = timeout if isinstance(timeout, (int, float)) else resilience.default_deadline
+            if budget is not None:
+                deadline = min(deadline, budget.remaining())
+        expires = time.monotonic() + deadline
+        retryable = method.upper() in IDEMPOTENT_METHODS and _replayable(kwargs)
+        send = self._hedged if hedge and method.upper() == 'GET' and not kwargs.get('stream') else self._attempt
+
+        attempt = 0
+        while True:
+            if budget is not None and budget.cancelled:
+                raise CallCancelled(f"{endpoint.name} was cancelled")
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                raise requests.exceptions.Timeout(f"{endpoint.name} exceeded its {deadline:.0f}s deadline")
+            response, error = None, None
+            try:
+                response = send(endpoint, method, url, timeout, remaining, kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+
+            retry = retryable and attempt + 1 < resilience.max_attempts and (
+                error is not None or response.status_code in RETRY_STATUSES)
+            if retry:
+                delay = resilience.backoff(attempt)
+                if response is not None and response.status_code == 429:
+                    delay = max(delay, retry_after_seconds(response.headers) or 0.0)
+                retry = time.monotonic() + delay < expires
+            if not retry:
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                response.close()
+            endpoint.count('retries')
+            if budget is not None:
+                budget.cancel_event.wait(delay)
+            else:
+                time.sleep(delay)
+            attempt += 1
+
+    def _attempt(self, endpoint, method, url, timeout, remaining, kwargs, sent=None):
+        endpoint.admit()
+        try:
+            response = self._limited(method, url, sent, timeout=_attempt_timeout(timeout, remaining), **kwargs)
+        except requests.exceptions.RequestException:
+            endpoint.record(False)
+            raise
+        except BaseException:
+            endpoint.abandon()
+            raise
+        finally:
+            if sent is not None:
+                sent.set()
+        # elapsed runs from sending to the response headers, so time spent
+        # queued in the rate limiter does not skew the latency window
+        endpoint.record(response.status_code < 500, response.elapsed.total_seconds())
+        return response
+
+    def _hedged(self, endpoint, method, url, timeout, remaining, kwargs):
+        delay = get_resilience().hedge_delay(endpoint)
+        if delay is None or delay >= remaining:
+            return self._attempt(endpoint, method, url, timeout, remaining, kwargs)
+
+        started = time.monotonic()
+        pool = self._hedge_executor()
+        sent = threading.Event()
+        pending = [pool.submit(self._attempt, endpoint, method, url, timeout, remaining, kwargs, sent)]
+        hedge = None
+        # Time spent queued in the rate limiter is not upstream latency, so
+        # the hedge clock starts once the first copy is on the wire
+        sent.wait(remaining)
+        delay = min(delay, max(0.0, started + remaining - time.monotonic()))
+        if not wait(pending, timeout=delay).done:
+            endpoint.count('hedged')
+            hedge = pool.submit(self._attempt, endpoint, method, url, timeout, started + remaining - time.monotonic(), kwargs)
+            pending.append(hedge)
+
+        error = None
+        while pending:
+            done, _ = wait(pending, timeout=max(0.0, started + remaining - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            answered = []
+            for future in done:
+                pending.remove(future)
+                try:
+                    answered.append((future, future.result()))
+                except Exception as e:
+                    error = e
+            if answered:
+                winner, response = answered[0]
+                for _, extra in answered[1:]:
+                    extra.close()
+                for future in pending:
+                    future.add_done_callback(_discard_response)
+                if winner is hedge:
+                    endpoint.count('hedge_wins')
+                return response
+
+        for future in pending:
+            future.add_done_callback(_discard_response)
+        if error is not None:
+            raise error
+        raise requests.exceptions.Timeout(f"{endpoint.name} did not answer within {remaining:.1f}s")
+
+    def _hedge_executor(self):
+        if self._hedge_pool is None:
+            with self._lock:
+                if self._hedge_pool is None:
+                    self._hedge_pool = ThreadPoolExecutor(max_workers=self.pool_maxsize * 2, thread_name_prefix='http-hedge')
+        return self._hedge_pool
+
+    def _limited(self, method, url, sent=None, **kwargs):
+        parts = urlsplit(url)
+        upstream = get_rate_limiter().for_host(parts.hostname)
+        if upstream is None:
+            return self._send(parts.netloc, method, url, **kwargs)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        key, tried = upstream.key_from(headers), set()
+        while True:
+            lease = upstream.acquire(key, exclude=tried)
+            if lease.wait:
+                time.sleep(lease.wait)
+            if sent is not None:
+                sent.set()
+            try:
+                response = self._send(parts.netloc, method, url, headers=lease.apply(headers), **kwargs)
+            finally:
+                lease.release()
+            if response.status_code != 429:
+                return response
+            lease.throttled(retry_after_seconds(response.headers))
+            tried.add(lease.key)
+            if not (lease.pooled and _replayable(kwargs) and upstream.has_untried(tried)):
+                return response
+            response.close()
+
+    def _send(self, host, method, url, **kwargs):
+        session = self._session_for(host)
+        with self._lock:
+            stats = self._host_stats[host]
+            stats['requests'] += 1
+            stats['in_flight'] += 1
+            stats['peak_in_flight'] = max(stats['peak_in_flight'], stats['in_flight'])
+        try:
+            return session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                stats['in_flight'] -= 1
+
+    async def arequest(self, method, url, deadline=None, hedge=False, stream=False, **kwargs):
+        """Async counterpart of ``request`` on the shared async client.
+
+        Same deadline, retry and hedging rules, with httpx exceptions in place
+        of the requests ones. The circuit breaker is applied by the client's
+        transport. With ``stream=True`` the body is left unread; the caller
+        must close the response.
+        """
+        resilience = get_resilience()
+        endpoint = resilience.endpoint(method, url)
+        timeout = kwargs.pop('timeout', None)
+        budget = deadline if isinstance(deadline, Deadline) else None
+        if deadline is None or budget is not None:
+            deadline = timeout if isinstance(timeout, (int, float)) else resilience.default_deadline
+            if budget is not None:
+                deadline = min(deadline, budget.remaining())
+        expires = time.monotonic() + deadline
+        retryable = method.upper() in IDEMPOTENT_METHODS and _replayable(kwargs)
+        client = self.async_client()
+
+        def send(remaining):
+            request = client.build_request(method, url, timeout=_httpx_timeout(_attempt_timeout(timeout, remaining)), **kwargs)
+            return client.send(request, stream=stream)
+
+        attempt = 0
+        while True:
+            if budget is not None and budget.cancelled:
+                raise CallCancelled(f"{endpoint.name} was cancelled")
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                raise httpx.TimeoutException(f"{endpoint.name} exceeded its {deadline:.0f}s deadline")
+            response, error = None, None
+            try:
+                if hedge and method.upper() == 'GET' and not stream:
+                    response = await self._ahedged(endpoint, send, remaining)
+                else:
+                    response = await send(remaining)
+            except httpx.TransportError as e:
+                error = e
+
+            retry = retryable and attempt + 1 < resilience.max_attempts and (
+                error is not None or response.status_code in RETRY_STATUSES)
+            if retry:
+                delay = resilience.backoff(attempt)
+                if response is not None and response.status_code == 429:
+                    delay = max(delay, retry_after_seconds(response.headers) or 0.0)
+                retry = time.monotonic() + delay < expires
+            if not retry:
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                await response.aclose()
+            endpoint.count('retries')
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _ahedged(self, endpoint, send, remaining):
+        delay = get_resilience().hedge_delay(endpoint)
+        if delay is None or delay >= remaining:
+            return await send(remaining)
+
+        started = time.monotonic()
+        first = asyncio.ensure_future(send(remaining))
+        pending, hedge, error = {first}, None, None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                endpoint.count('hedged')
+                hedge = asyncio.ensure_future(send(started + remaining - time.monotonic()))
+                pending.add(hedge)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, started + remaining - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                answered = [task for task in done if task.exception() is None]
+                error = next((task.exception() for task in done if task.exception() is not None), error)
+                if answered:
+                    for extra in answered[1:]:
+                        await extra.result().aclose()
+                    if answered[0] is hedge:
+                        endpoint.count('hedge_wins')
+                    return answered[0].result()
+        finally:
+            # Cancelling the copy still in flight closes its connection
+            for task in pending:
+                task.cancel()
+        if error is not None:
+            raise error
+        raise httpx.TimeoutException(f"{endpoint.name} did not answer within {remaining:.1f}s")
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def sdk_client(self):
+        if self._sdk_client is None:
+            with self._lock:
+                if self._sdk_client is None:
+                    self._sdk_client = httpx.Client(
+                        transport=_UpstreamTransport(httpx.HTTPTransport(
+                            http2=self.http2,
+                            limits=httpx.Limits(
+                                max_connections=self.pool_maxsize,
+                                max_keepalive_connections=self.pool_maxsize
+                            )
+                        )),
+                        timeout=httpx.Timeout(self.sdk_timeout, connect=10.0),
+                        follow_redirects=True,
+                        event_hooks={
+                            'request': [self._on_sdk_request],
+                            'response': [self._on_sdk_response]
+                        }
+                    )
+        return self._sdk_client
+
+    def async_client(self):
+        # Shared by the async services and the async SDK client; only used from
+        # the event loop of the ASGI server.
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = httpx.AsyncClient(
+                        transport=_AsyncUpstreamTransport(httpx.AsyncHTTPTransport(
+                            http2=self.http2,
+                            limits=httpx.Limits(
+                                max_connections=self.pool_maxsize * 4,
+                                max_keepalive_connections=self.pool_maxsize
+                            )
+                        )),
+                        timeout=httpx.Timeout(self.sdk_timeout, connect=10.0),
+                        follow_redirects=True,
+                        event_hooks={
+                            'request': [self._on_async_request],
+                            'response': [self._on_async_response]
+                        }
+                    )
+        return self._async_client
+
+    async def _on_async_request(self, request):
+        with self._lock:
+            self._async_stats['requests'] += 1
+
+    async def _on_async_response(self, response):
+        with self._lock:
+            self._async_stats['responses'] += 1
+            if response.status_code >= 400:
+                self._async_stats['errors'] += 1
+
+    def _on_sdk_request(self, request):
+        with self._lock:
+            self._sdk_stats['requests'] += 1
+
+    def _on_sdk_response(self, response):
+        with self._lock:
+            self._sdk_stats['responses'] += 1
+            if response.status_code >= 400:
+                self._sdk_stats['errors'] += 1
+
+    def stats(self):
+        hosts = {}
+        with self._lock:
+            sessions = dict(self._sessions)
+            for host, stats in self._host_stats.items():
+                hosts[host] = dict(stats)
+            sdk_stats = dict(self._sdk_stats)
+            async_stats = dict(self._async_stats)
+
+        for host, session in sessions.items():
+            adapter = session.get_adapter(f'https://{host}')
+            open_connections = 0
+            idle_connections = 0
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                open_connections += pool.num_connections
+                idle_connections += pool.pool.qsize() if pool.pool else 0
+            hosts[host]['connections_opened'] = open_connections
+            hosts[host]['idle_slots'] = idle_connections
+
+        return {
+            'pool_maxsize': self.pool_maxsize,
+            'http2': self.http2,
+            'hosts': hosts,
+            'sdk': sdk_stats,
+            'async': async_stats
+        }
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HttpTransport()
+    return _transport
@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+
+class FileLeases:
+    """Exclusive leases on named jobs, shared by every process using ``directory``.
+
+    A lease is a ``<name>.lease`` file created with ``O_EXCL`` that records
+    the owner's pid. While this process holds it, a daemon thread refreshes
+    its mtime every third of ``lease_seconds``; a lease that has not been
+    refreshed for longer than ``lease_seconds`` was left by a process that
+    died and is taken over by the next ``claim``.
+    """
+
+    def __init__(self, directory, lease_seconds):
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        # name -> token written into the lease file
+        self._held = {}
+        self._refresher = None
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.lease")
+
+    def _age(self, name):
+        try:
+            return time.time() - os.path.getmtime(self.path(name))
+        except FileNotFoundError:
+            return None
+
+    def claim(self, name):
+        # False while another process holds a fresh lease on ``name``
+        path = self.path(name)
+        token = uuid.uuid4().hex
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                age = self._age(name)
+                if age is not None and age <= self.lease_seconds:
+                    return False
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'pid': os.getpid(), 'token': token}, f)
+            with self._lock:
+                self._held[name] = token
+                if self._refresher is None:
+                    self._refresher = threading.Thread(target=self._refresh, name='file-leases', daemon=True)
+                    self._refresher.start()
+            return True
+        return False
+
+    def release(self, name):
+        with self._lock:
+            token = self._held.pop(name, None)
+        if token is None:
+            return
+        path = self.path(name)
+        try:
+            # Only remove the file if it is still ours and was not taken over
+            with open(path, 'r', encoding='utf-8') as f:
+                owner = json.load(f).get('token')
+            if owner == token:
+                os.remove(path)
+        except (OSError, ValueError):
+            pass
+
+    def holds(self, name):
+        with self._lock:
+            return name in self._held
+
+    def held_elsewhere(self, name):
+        if self.holds(name):
+            return False
+        age = self._age(name)
+        return age is not None and age <= self.lease_seconds
+
+    def _refresh(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._lock:
+                names = list(self._held)
+            for name in names:
+                try:
+                    os.utime(self.path(name))
+                except OSError:
+                    pass
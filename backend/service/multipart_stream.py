@@ -0,0 +1,77 @@
+import os
+import uuid
+
+
+def _quote(value):
+    # Header parameter values cannot carry quotes or line breaks
+    return value.replace('\r', '').replace('\n', '').replace('"', '%22')
+
+
+class MultipartStream:
+    """multipart/form-data body produced on the fly from a readable stream.
+
+    The form fields and part headers are built up front; the file part is
+    read from ``stream`` in ``chunk_size`` pieces as the body is iterated, so
+    memory use stays at one chunk regardless of file size. When ``file_size``
+    is known, ``body()`` reports the total length and ``requests`` sends a
+    regular Content-Length body; otherwise it falls back to chunked transfer
+    encoding.
+
+    The stream can only be iterated once, so a failed request cannot be
+    retried with the same instance.
+    """
+
+    def __init__(self, fields, file_field, filename, stream, file_size=None, chunk_size=None, on_chunk=None):
+        self.boundary = uuid.uuid4().hex
+        self.stream = stream
+        self.file_size = file_size
+        self.chunk_size = chunk_size or int(os.environ.get('UPLOAD_STREAM_CHUNK_BYTES', 1024 * 1024))
+        self.on_chunk = on_chunk
+        self.bytes_read = 0
+
+        head = b''
+        for name, value in fields.items():
+            head += (
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+                f'{value}\r\n'
+            ).encode('utf-8')
+        head += (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{_quote(file_field)}"; filename="{_quote(os.path.basename(filename))}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode('utf-8')
+        self._head = head
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    @property
+    def length(self):
+        if self.file_size is None:
+            return None
+        return len(self._head) + self.file_size + len(self._tail)
+
+    def __len__(self):
+        return self.length
+
+    def body(self):
+        # requests sends a sized iterable with Content-Length; a plain
+        # generator goes out with chunked transfer encoding instead.
+        return self if self.length is not None else iter(self)
+
+    def __iter__(self):
+        yield self._head
+        while True:
+            chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                break
+            self.bytes_read += len(chunk)
+            if self.on_chunk:
+                self.on_chunk(chunk)
+            yield chunk
+        if self.file_size is not None and self.bytes_read != self.file_size:
+            raise IOError(f"Upload ended after {self.bytes_read} of {self.file_size} bytes")
+        yield self._tail
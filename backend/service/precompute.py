@@ -0,0 +1,318 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from service.analysis_cache import BACKEND_DIR, get_analysis_cache, prompt_hash
+from service.leases import FileLeases
+from service.workflow_scheduler import PRECOMPUTE, get_workflow_scheduler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_DIR = os.path.join(BACKEND_DIR, '.cache', 'precompute')
+
+RUNNING = 'running'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+
+MAX_RECORDED_ERRORS = 50
+
+
+class _IntervalLimiter:
+    # Spaces calls at least 60 / rate_per_minute seconds apart across all
+    # workers; a rate of 0 means unlimited
+
+    def __init__(self, rate_per_minute):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, cancelled=None):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        while True:
+            delay = slot - time.monotonic()
+            if delay <= 0 or (cancelled is not None and cancelled.is_set()):
+                return
+            time.sleep(min(delay, 1.0))
+
+
+class PrecomputeManager:
+    """Background jobs that fill the analysis cache for a whole index.
+
+    A job walks the index catalog page by page and runs the analysis prompt
+    for every video that has no cached result yet, on a small worker pool
+    throttled to ``rate_per_minute`` analyze calls. Results go into the
+    regular analysis cache, so interactive workflows for those videos start
+    with the analysis already done.
+
+    There is one job per index, persisted as JSON in ``jobs_dir``. Progress
+    needs no checkpoint: the analysis cache already records which videos are
+    done, so a job interrupted by a restart is resumed by ``recover`` and
+    simply skips them. Like upload jobs, precompute runs with the environment
+    API key, which is never persisted.
+
+    Several backend processes may share ``jobs_dir``. A job only runs in the
+    process holding its lease (see ``FileLeases``); the others report its
+    state from disk, and cancelling it there marks it cancelled on disk for
+    the owner to notice.
+    """
+
+    def __init__(self, jobs_dir=None, workers=None, rate_per_minute=None, service_factory=None, lease_seconds=None):
+        self.jobs_dir = jobs_dir or os.environ.get('PRECOMPUTE_JOBS_DIR') or DEFAULT_JOBS_DIR
+        self.workers = workers or int(os.environ.get('PRECOMPUTE_WORKERS', 2))
+        self.rate_per_minute = rate_per_minute if rate_per_minute is not None else float(os.environ.get('PRECOMPUTE_RATE_PER_MINUTE', 20))
+        self._leases = FileLeases(self.jobs_dir, lease_seconds or float(os.environ.get('PRECOMPUTE_LEASE_SECONDS', 30)))
+        self._service_factory = service_factory
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='precompute')
+        self._limiter = _IntervalLimiter(self.rate_per_minute)
+        self._jobs = {}
+        self._cancel_events = {}
+        self._lock = threading.Lock()
+        self._stats = {'started': 0, 'resumed': 0, 'analyzed': 0, 'skipped': 0, 'failed': 0}
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+    def _service(self):
+        if self._service_factory is not None:
+            return self._service_factory()
+        from service.client_registry import get_twelvelabs_service
+        return get_twelvelabs_service()
+
+    def _path(self, index_id):
+        return os.path.join(self.jobs_dir, f"{index_id}.json")
+
+    def _load(self, index_id):
+        try:
+            with open(self._path(index_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _persist(self, job):
+        tmp_path = f"{self._path(job['index_id'])}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._path(job['index_id']))
+
+    def _update(self, index_id, persist=True, **fields):
+        with self._lock:
+            job = self._jobs[index_id]
+            job.update(fields)
+            job['updated_at'] = time.time()
+            snapshot = dict(job)
+        if persist:
+            self._persist(snapshot)
+        return snapshot
+
+    def start(self, index_id, prompt):
+        """Start (or join) the precompute job for ``index_id``.
+
+        Returns ``(job, started)``; ``started`` is False when a job for the
+        index is already running, here or in another process.
+        """
+        with self._lock:
+            job = self._jobs.get(index_id)
+            if job is not None and job['status'] == RUNNING and self._leases.holds(index_id):
+                return dict(job), False
+        if not self._leases.claim(index_id):
+            return self.get(index_id), False
+        with self._lock:
+            now = time.time()
+            job = {
+                'index_id': index_id,
+                'prompt': prompt,
+                'prompt_hash': prompt_hash(prompt),
+                'status': RUNNING,
+                'scanned': 0,
+                'analyzed': 0,
+                'skipped': 0,
+                'failed': 0,
+                'errors': {},
+                'started_at': now,
+                'updated_at': now,
+                'finished_at': None
+            }
+            self._jobs[index_id] = job
+            self._cancel_events[index_id] = threading.Event()
+            self._stats['started'] += 1
+            snapshot = dict(job)
+        self._persist(snapshot)
+        threading.Thread(target=self._run, args=(index_id,), name=f'precompute-{index_id}', daemon=True).start()
+        return snapshot, True
+
+    def cancel(self, index_id):
+        if not self._leases.holds(index_id):
+            # Running in another process, if at all: it watches the file
+            job = self._load(index_id)
+            if job is None or job['status'] != RUNNING:
+                return job
+            job.update(status=CANCELLED, finished_at=time.time(), updated_at=time.time())
+            self._persist(job)
+            return job
+        with self._lock:
+            job = self._jobs.get(index_id)
+            if job is None or job['status'] != RUNNING:
+                return dict(job) if job else None
+            self._cancel_events[index_id].set()
+        return self._update(index_id, status=CANCELLED, finished_at=time.time())
+
+    def get(self, index_id):
+        if not self._leases.holds(index_id):
+            # Another process may own the job; the file has its latest state
+            job = self._load(index_id)
+            if job is not None:
+                with self._lock:
+                    self._jobs[index_id] = job
+        with self._lock:
+            job = self._jobs.get(index_id)
+            return dict(job, errors=dict(job['errors'])) if job else None
+
+    def _run(self, index_id):
+        # The job's lease is held for as long as it runs
+        try:
+            self._walk(index_id)
+        finally:
+            self._leases.release(index_id)
+
+    def _walk(self, index_id):
+        # Feeds uncached videos to the worker pool, never more than two per
+        # worker ahead, so memory stays flat on large indexes
+        with self._lock:
+            job = self._jobs[index_id]
+            prompt = job['prompt']
+            cancelled = self._cancel_events[index_id]
+        cache = get_analysis_cache()
+        service = self._service()
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        futures = []
+        last_persist = time.time()
+        try:
+            for video in service.iter_index_videos(index_id):
+                if cancelled.is_set():
+                    break
+                video_id = video.get('_id')
+                with self._lock:
+                    job['scanned'] += 1
+                if not video_id or cache.contains(service.api_key, index_id, video_id, prompt):
+                    with self._lock:
+                        job['skipped'] += 1
+                        self._stats['skipped'] += 1
+                else:
+                    slots.acquire()
+                    future = self._executor.submit(self._analyze, index_id, video_id, prompt, cancelled)
+                    future.add_done_callback(lambda f: slots.release())
+                    futures.append(future)
+                    futures = [f for f in futures if not f.done()]
+                if time.time() - last_persist > 2:
+                    on_disk = self._load(index_id)
+                    if on_disk is not None and on_disk['status'] == CANCELLED:
+                        # Cancelled through another process
+                        cancelled.set()
+                        with self._lock:
+                            job.update(status=CANCELLED, finished_at=on_disk.get('finished_at'))
+                    self._update(index_id)
+                    last_persist = time.time()
+            for future in futures:
+                future.result()
+        except Exception as e:
+            logger.error(f"Precompute for index {index_id} failed: {e}")
+            if not cancelled.is_set():
+                self._update(index_id, status=FAILED, last_error=str(e), finished_at=time.time())
+            return
+
+        if not cancelled.is_set():
+            job = self._update(index_id, status=COMPLETED, finished_at=time.time())
+            logger.info(f"Precompute for index {index_id} done: {job['analyzed']} analyzed, {job['skipped']} already cached, {job['failed']} failed")
+
+    def _analyze(self, index_id, video_id, prompt, cancelled):
+        self._limiter.wait(cancelled)
+        if cancelled.is_set():
+            return
+        # Lowest priority workflow slot: waits while interactive and batch
+        # workflows keep the server busy
+        service = self._service()
+        ticket = get_workflow_scheduler().acquire(service.api_key, PRECOMPUTE, cancelled)
+        if ticket is None:
+            return
+        try:
+            service.analyze_video_cached(video_id, prompt, index_id=index_id)
+        except Exception as e:
+            with self._lock:
+                job = self._jobs[index_id]
+                job['failed'] += 1
+                if len(job['errors']) < MAX_RECORDED_ERRORS:
+                    job['errors'][video_id] = str(e)
+                self._stats['failed'] += 1
+            return
+        finally:
+            ticket.release()
+        with self._lock:
+            self._jobs[index_id]['analyzed'] += 1
+            self._stats['analyzed'] += 1
+
+    def recover(self):
+        # Reload job states after a restart and resume the ones that were
+        # running, unless another process has already claimed them
+        try:
+            names = os.listdir(self.jobs_dir)
+        except FileNotFoundError:
+            return 0
+        interrupted = []
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.jobs_dir, name), 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable precompute job {name}: {e}")
+                continue
+            index_id = job.get('index_id')
+            if not index_id:
+                continue
+            with self._lock:
+                if index_id in self._jobs:
+                    continue
+                self._jobs[index_id] = job
+            if job.get('status') == RUNNING and job.get('prompt'):
+                interrupted.append((index_id, job['prompt']))
+
+        resumed = 0
+        for index_id, prompt in interrupted:
+            # start() only joins jobs this process runs, so these are restarted
+            _, started = self.start(index_id, prompt)
+            if started:
+                resumed += 1
+                with self._lock:
+                    self._stats['resumed'] += 1
+        if resumed:
+            logger.info(f"Resumed {resumed} precompute job(s)")
+        return resumed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['running'] = sum(1 for job in self._jobs.values() if job['status'] == RUNNING)
+            stats['jobs'] = len(self._jobs)
+        stats['rate_per_minute'] = self.rate_per_minute
+        return stats
+
+
+_precompute_manager = None
+_precompute_manager_lock = threading.Lock()
+
+
+def get_precompute_manager():
+    global _precompute_manager
+    if _precompute_manager is None:
+        with _precompute_manager_lock:
+            if _precompute_manager is None:
+                manager = PrecomputeManager()
+                manager.recover()
+                _precompute_manager = manager
+    return _precompute_manager
@@ -0,0 +1,281 @@
+import email.utils
+import os
+import threading
+import time
+from collections import OrderedDict
+
+STRATEGIES = ('least_loaded', 'round_robin')
+
+
+class RateLimitExceeded(Exception):
+    """A call would have had to queue longer than the limiter's max wait."""
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"{upstream} rate limit reached, retry in {retry_after:.1f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(headers):
+    # Retry-After as delta seconds or an HTTP date; None when absent or unparseable
+    value = headers.get('retry-after') if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def pool_keys(primary_env, extra_env):
+    # The primary key followed by any extra comma-separated keys, deduplicated
+    keys = [os.environ.get(primary_env, '')] + os.environ.get(extra_env, '').split(',')
+    return list(OrderedDict.fromkeys(key.strip() for key in keys if key.strip()))
+
+
+class TokenBucket:
+    # Not thread-safe on its own; the owning UpstreamLimiter holds its lock
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        # Seconds until a token is free; reservations already taken push this out
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        # Reserve a token, going into debt when empty; returns the wait for it
+        wait = self.delay(now)
+        if self.rate > 0:
+            self.tokens -= 1
+        return wait
+
+
+class _KeyState:
+    __slots__ = ('key', 'bucket', 'in_flight', 'cooldown_until', 'requests', 'throttled')
+
+    def __init__(self, key, bucket):
+        self.key = key
+        self.bucket = bucket
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+
+    def ready_in(self, now):
+        return max(self.cooldown_until - now, self.bucket.delay(now), 0.0)
+
+
+class Lease:
+    """One admitted call: the key to send it with and how long to wait first."""
+
+    def __init__(self, upstream, state, wait, pooled):
+        self.upstream = upstream
+        self.state = state
+        self.key = state.key
+        self.wait = wait
+        self.pooled = pooled
+        self._released = False
+
+    def apply(self, headers):
+        # Write the chosen key into a mutable headers mapping
+        for name in [name for name in headers if name.lower() == self.upstream.header.lower()]:
+            del headers[name]
+        headers[self.upstream.header] = f"{self.upstream.prefix}{self.key}"
+        return headers
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.upstream._release(self.state)
+
+    def throttled(self, retry_after=None):
+        self.upstream._cool_down(self.state, retry_after)
+
+
+class UpstreamLimiter:
+    """Token buckets for one upstream API, one bucket per API key.
+
+    Calls over the rate queue for a token instead of failing; only a call
+    that would wait longer than ``max_wait`` seconds is rejected with
+    ``RateLimitExceeded``. When ``keys`` holds more than one key, a call made
+    with any of them may be sent with whichever pooled key is free first
+    (``least_loaded`` picks the one with the fewest calls in flight,
+    ``round_robin`` rotates), so throughput scales with the number of keys.
+    A key that gets a 429 cools down for the upstream's Retry-After, or
+    ``cooldown_seconds`` without one, and the pool routes around it.
+
+    Keys outside the pool (a user's own key) are limited on their own bucket
+    and never swapped.
+    """
+
+    def __init__(self, name, header, prefix='', rate=0.0, burst=1.0, keys=(), strategy='least_loaded',
+                 max_wait=30.0, cooldown_seconds=30.0, max_tracked_keys=256):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategy must be one of {', '.join(STRATEGIES)}")
+        self.name = name
+        self.header = header
+        self.prefix = prefix
+        self.rate = rate
+        self.burst = burst
+        self.strategy = strategy
+        self.max_wait = max_wait
+        self.cooldown_seconds = cooldown_seconds
+        self.max_tracked_keys = max_tracked_keys
+        self._pool = [_KeyState(key, TokenBucket(rate, burst)) for key in keys]
+        self._pool_index = {state.key: state for state in self._pool}
+        self._others = OrderedDict()
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'queued': 0, 'wait_seconds': 0.0, 'rejected': 0, 'throttled': 0, 'swapped': 0}
+
+    def key_from(self, headers):
+        for name, value in (headers or {}).items():
+            if name.lower() == self.header.lower() and value:
+                return value[len(self.prefix):] if value.startswith(self.prefix) else value
+        return ''
+
+    def _state(self, key):
+        state = self._pool_index.get(key)
+        if state is not None:
+            return state
+        state = self._others.get(key)
+        if state is None:
+            state = self._others[key] = _KeyState(key, TokenBucket(self.rate, self.burst))
+            while len(self._others) > self.max_tracked_keys:
+                self._others.popitem(last=False)
+        else:
+            self._others.move_to_end(key)
+        return state
+
+    def _choose(self, candidates, now):
+        if self.strategy == 'round_robin':
+            count = len(candidates)
+            rotated = [candidates[(self._next + i) % count] for i in range(count)]
+            self._next = (self._next + 1) % count
+            return min(rotated, key=lambda state: state.ready_in(now))
+        return min(candidates, key=lambda state: (state.ready_in(now), state.in_flight))
+
+    def pooled(self, key):
+        return len(self._pool) > 1 and key in self._pool_index
+
+    def has_untried(self, tried):
+        return any(state.key not in tried for state in self._pool)
+
+    def acquire(self, key, exclude=()):
+        """Reserve a token for a call made with ``key``.
+
+        Returns a ``Lease``; the caller sleeps ``lease.wait`` seconds, sends
+        with ``lease.key`` and calls ``release()`` once the response arrives.
+        ``exclude`` lists pooled keys that were already throttled for this
+        call.
+        """
+        with self._lock:
+            now = time.monotonic()
+            pooled = self.pooled(key)
+            if pooled:
+                candidates = [state for state in self._pool if state.key not in exclude] or self._pool
+                state = self._choose(candidates, now)
+            else:
+                state = self._state(key)
+            wait = state.ready_in(now)
+            if wait > self.max_wait:
+                self._stats['rejected'] += 1
+                raise RateLimitExceeded(self.name, wait)
+            wait = max(wait, state.bucket.take(now))
+            state.in_flight += 1
+            state.requests += 1
+            self._stats['requests'] += 1
+            if state.key != key:
+                self._stats['swapped'] += 1
+            if wait > 0:
+                self._stats['queued'] += 1
+                self._stats['wait_seconds'] += wait
+        return Lease(self, state, wait, pooled)
+
+    def _release(self, state):
+        with self._lock:
+            state.in_flight -= 1
+
+    def _cool_down(self, state, retry_after):
+        seconds = retry_after if retry_after is not None else self.cooldown_seconds
+        with self._lock:
+            state.cooldown_until = max(state.cooldown_until, time.monotonic() + seconds)
+            state.throttled += 1
+            self._stats['throttled'] += 1
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            stats = dict(self._stats)
+            stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+            # Keys are identified by their last four characters only
+            stats['pool'] = [{
+                'key': f"...{state.key[-4:]}",
+                'in_flight': state.in_flight,
+                'requests': state.requests,
+                'throttled': state.throttled,
+                'cooling_down_seconds': round(max(0.0, state.cooldown_until - now), 1)
+            } for state in self._pool]
+            stats['tracked_keys'] = len(self._others)
+        stats['rate_per_second'] = self.rate
+        stats['burst'] = self.burst
+        stats['strategy'] = self.strategy
+        stats['max_wait'] = self.max_wait
+        return stats
+
+
+class RateLimiter:
+    # Upstream limiters by API host; hosts without one (CDNs, presigned
+    # upload URLs) are not limited
+
+    def __init__(self, max_wait=None, strategy=None, cooldown_seconds=None):
+        self.max_wait = max_wait if max_wait is not None else float(os.environ.get('RATE_LIMIT_MAX_WAIT', 30))
+        strategy = strategy or os.environ.get('KEY_POOL_STRATEGY', 'least_loaded')
+        cooldown_seconds = cooldown_seconds if cooldown_seconds is not None else float(os.environ.get('KEY_COOLDOWN_SECONDS', 30))
+        self.upstreams = {
+            'api.twelvelabs.io': UpstreamLimiter(
+                'twelvelabs', 'x-api-key',
+                rate=float(os.environ.get('TWELVELABS_RATE_LIMIT', 5)),
+                burst=float(os.environ.get('TWELVELABS_RATE_BURST', 10)),
+                keys=pool_keys('TWELVELABS_API_KEY', 'TWELVELABS_API_KEYS'),
+                strategy=strategy, max_wait=self.max_wait, cooldown_seconds=cooldown_seconds
+            ),
+            'api.perplexity.ai': UpstreamLimiter(
+                'perplexity', 'Authorization', prefix='Bearer ',
+                rate=float(os.environ.get('PERPLEXITY_RATE_LIMIT', 0.8)),
+                burst=float(os.environ.get('PERPLEXITY_RATE_BURST', 5)),
+                keys=pool_keys('PERPLEXITY', 'PERPLEXITY_API_KEYS'),
+                strategy=strategy, max_wait=self.max_wait, cooldown_seconds=cooldown_seconds
+            )
+        }
+
+    def for_host(self, host):
+        return self.upstreams.get(host)
+
+    def stats(self):
+        return {upstream.name: upstream.stats() for upstream in self.upstreams.values()}
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter()
+    return _rate_limiter
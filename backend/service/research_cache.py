@@ -0,0 +1,300 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+
+from service.analysis_cache import BACKEND_DIR, normalize_prompt
+from service.disk_store import SizeCappedDiskStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(BACKEND_DIR, '.cache', 'research')
+
+STOPWORDS = frozenset((
+    'a', 'about', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'could', 'did', 'do', 'does',
+    'for', 'from', 'has', 'have', 'how', 'i', 'in', 'is', 'it', 'its', 'me', 'of', 'on', 'or',
+    'please', 'tell', 'that', 'the', 'their', 'there', 'this', 'to', 'was', 'were', 'what', 'when',
+    'where', 'which', 'who', 'why', 'will', 'with', 'would', 'you'
+))
+
+
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+def hash_vector(np, text, dim):
+    # Signed feature hashing of unigrams and bigrams with sublinear term
+    # frequency, L2-normalised so a dot product is the cosine similarity
+    tokens = [t for t in re.findall(r"[a-z0-9]+", (text or '').lower()) if t not in STOPWORDS]
+    features = Counter(tokens)
+    features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, count in features.items():
+        h = zlib.crc32(feature.encode('utf-8'))
+        vector[h % dim] += (1.0 + math.log(count)) * (1.0 if h & 0x80000000 else -1.0)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+class _SemanticIndex:
+    # Vectors of the entries held in memory, grouped by scope so a question
+    # is only ever compared with questions asked about the same context.
+    # Each scope keeps a matrix with spare rows that doubles when full;
+    # removal moves the last row into the freed slot.
+
+    def __init__(self, np, dim):
+        self.np = np
+        self.dim = dim
+        self._scopes = {}
+        self._locations = {}
+
+    def add(self, key, scope, text):
+        self.remove(key)
+        group = self._scopes.get(scope)
+        if group is None:
+            group = self._scopes[scope] = {'keys': [], 'matrix': self.np.zeros((4, self.dim), dtype=self.np.float32)}
+        keys, matrix = group['keys'], group['matrix']
+        if len(keys) == len(matrix):
+            grown = self.np.zeros((2 * len(matrix), self.dim), dtype=self.np.float32)
+            grown[:len(matrix)] = matrix
+            matrix = group['matrix'] = grown
+        matrix[len(keys)] = hash_vector(self.np, text, self.dim)
+        self._locations[key] = (scope, len(keys))
+        keys.append(key)
+
+    def remove(self, key):
+        location = self._locations.pop(key, None)
+        if location is None:
+            return
+        scope, row = location
+        group = self._scopes[scope]
+        keys, matrix = group['keys'], group['matrix']
+        last = len(keys) - 1
+        if row != last:
+            matrix[row] = matrix[last]
+            keys[row] = keys[last]
+            self._locations[keys[row]] = (scope, row)
+        keys.pop()
+        if not keys:
+            del self._scopes[scope]
+
+    def search(self, scope, text):
+        # (key, similarity) of the closest entry in ``scope``, or None
+        group = self._scopes.get(scope)
+        if group is None:
+            return None
+        keys = group['keys']
+        similarities = group['matrix'][:len(keys)] @ hash_vector(self.np, text, self.dim)
+        row = int(similarities.argmax())
+        return keys[row], float(similarities[row])
+
+
+class ResearchCache:
+    """Two-tier cache for Sonar research results with optional near-duplicate matching.
+
+    The exact tier is keyed on the normalized research prompt and works like
+    the analysis cache: bounded memory LRU, one JSON file per entry on disk,
+    shared TTL. Research is web-grounded, so the default TTL is a day.
+
+    The semantic tier (``RESEARCH_CACHE_SEMANTIC=true``, needs NumPy) also
+    serves an entry whose question is close enough to the new one. Each entry
+    carries a ``scope`` (e.g. a hash of the video analysis it was asked
+    about) and the bare question; questions are hashed into fixed-size
+    vectors and compared by cosine similarity only within the same scope, so
+    the long shared context cannot make unrelated questions look alike.
+    Entries without a scope have no context to share and are only served on
+    an exact match.
+    Without NumPy the tier stays off and only exact hits are served.
+    """
+
+    def __init__(self, cache_dir=None, ttl_seconds=None, max_memory_entries=None, max_disk_bytes=None,
+                 semantic=None, similarity_threshold=None, vector_dim=None):
+        self.cache_dir = cache_dir or os.environ.get('RESEARCH_CACHE_DIR') or DEFAULT_CACHE_DIR
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.environ.get('RESEARCH_CACHE_TTL', 24 * 3600))
+        self.max_memory_entries = max_memory_entries or int(os.environ.get('RESEARCH_CACHE_MEMORY_ENTRIES', 512))
+        self.max_disk_bytes = max_disk_bytes or int(os.environ.get('RESEARCH_CACHE_DISK_MB', 256)) * 1024 * 1024
+        self.similarity_threshold = similarity_threshold if similarity_threshold is not None else float(os.environ.get('RESEARCH_CACHE_SIMILARITY', 0.9))
+        if semantic is None:
+            semantic = os.environ.get('RESEARCH_CACHE_SEMANTIC', 'false').lower() == 'true'
+        self._semantic = None
+        self._semantic_loaded = False
+        if semantic:
+            np = _numpy()
+            if np is None:
+                logger.warning("RESEARCH_CACHE_SEMANTIC is set but NumPy is not installed; serving exact matches only")
+            else:
+                self._semantic = _SemanticIndex(np, vector_dim or int(os.environ.get('RESEARCH_CACHE_VECTOR_DIM', 2048)))
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = SizeCappedDiskStore(self.cache_dir, '.json', self.max_disk_bytes, name='research cache')
+        self._stats = {
+            'exact_hits': 0,
+            'semantic_hits': 0,
+            'misses': 0,
+            'bypassed': 0,
+            'writes': 0,
+            'expired': 0
+        }
+
+    @property
+    def semantic_enabled(self):
+        return self._semantic is not None
+
+    def make_key(self, query):
+        return hashlib.sha256(normalize_prompt(query).encode('utf-8')).hexdigest()
+
+    def _is_expired(self, created_at):
+        return self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds
+
+    def _provenance(self, source, entry, similarity=None):
+        info = {'source': source, 'age_seconds': int(time.time() - entry['created_at'])}
+        if similarity is not None:
+            info['similarity'] = round(similarity, 4)
+            info['matched_question'] = entry.get('question')
+        return info
+
+    def lookup(self, query, scope=None, question=None, no_cache=False):
+        """Return ``(result, provenance)`` or ``(None, None)`` on a miss.
+
+        ``provenance`` is ``{'source': 'exact'|'semantic', 'age_seconds'}``
+        plus ``similarity`` and ``matched_question`` for semantic hits.
+        ``question`` is the text compared by the semantic tier; it defaults
+        to ``query``.
+        """
+        if no_cache:
+            with self._lock:
+                self._stats['bypassed'] += 1
+            return None, None
+
+        key = self.make_key(query)
+        with self._lock:
+            entry = self._memory_entry(key)
+            if entry is not None:
+                self._stats['exact_hits'] += 1
+                return entry['result'], self._provenance('exact', entry)
+
+        entry = self._read_disk(key)
+        if entry is not None:
+            with self._lock:
+                self._stats['exact_hits'] += 1
+                self._remember(key, entry)
+            return entry['result'], self._provenance('exact', entry)
+
+        if self._semantic is not None and scope is not None:
+            self._load_semantic()
+            with self._lock:
+                match = self._semantic.search(scope, normalize_prompt(question or query))
+                if match is not None and match[1] >= self.similarity_threshold:
+                    entry = self._memory_entry(match[0])
+                    if entry is not None:
+                        self._stats['semantic_hits'] += 1
+                        return entry['result'], self._provenance('semantic', entry, match[1])
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None, None
+
+    def set(self, query, result, scope=None, question=None):
+        if not result or 'error' in result:
+            return
+        key = self.make_key(query)
+        entry = {
+            'scope': scope,
+            'question': normalize_prompt(question or query),
+            'created_at': time.time(),
+            'result': result
+        }
+        with self._lock:
+            self._remember(key, entry)
+            self._stats['writes'] += 1
+        self._write_disk(key, entry)
+
+    def stats(self):
+        disk_bytes = self._disk.disk_bytes
+        with self._lock:
+            stats = dict(self._stats)
+            stats['evictions'] = self._disk.evictions
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_bytes'] = disk_bytes
+            stats['semantic_enabled'] = self._semantic is not None
+        lookups = stats['exact_hits'] + stats['semantic_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['exact_hits'] + stats['semantic_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _memory_entry(self, key):
+        # Called with the lock held
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if self._is_expired(entry['created_at']):
+            self._forget(key)
+            self._stats['expired'] += 1
+            return None
+        self._memory.move_to_end(key)
+        return entry
+
+    def _remember(self, key, entry):
+        # Called with the lock held
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        if self._semantic is not None and entry.get('scope') is not None:
+            self._semantic.add(key, entry['scope'], entry.get('question') or '')
+        while len(self._memory) > self.max_memory_entries:
+            self._forget(next(iter(self._memory)))
+
+    def _forget(self, key):
+        self._memory.pop(key, None)
+        if self._semantic is not None:
+            self._semantic.remove(key)
+
+    def _load_semantic(self):
+        # Entries from earlier runs only exist on disk; pull the most recent
+        # ones into memory once so they can be matched semantically
+        if self._semantic_loaded:
+            return
+        with self._lock:
+            if self._semantic_loaded:
+                return
+            self._semantic_loaded = True
+        for key in self._disk.recent_keys(self.max_memory_entries):
+            entry = self._read_disk(key)
+            if entry is not None:
+                with self._lock:
+                    if key not in self._memory:
+                        self._remember(key, entry)
+                        self._memory.move_to_end(key, last=False)
+
+    def _read_disk(self, key):
+        entry = self._disk.read(key, lambda data: json.loads(data.decode('utf-8')))
+        if entry is not None and self._is_expired(entry.get('created_at', 0)):
+            with self._lock:
+                self._stats['expired'] += 1
+            self._disk.remove(key)
+            return None
+        return entry
+
+    def _write_disk(self, key, entry):
+        self._disk.write(key, json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+
+
+_research_cache = None
+_research_cache_lock = threading.Lock()
+
+
+def get_research_cache():
+    global _research_cache
+    if _research_cache is None:
+        with _research_cache_lock:
+            if _research_cache is None:
+                _research_cache = ResearchCache()
+    return _research_cache
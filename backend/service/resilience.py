@@ -0,0 +1,257 @@
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Path segments that are resource ids rather than part of the route
+ID_SEGMENT = re.compile(r'[0-9a-fA-F-]{16,}|\d+')
+
+
+class CircuitOpenError(Exception):
+    """The endpoint's circuit breaker is open; the call was not sent."""
+
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"{endpoint} is failing, not retrying for {retry_after:.0f}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CallCancelled(Exception):
+    """The work this call belonged to was cancelled before it was sent."""
+
+
+class _CancelSwitch:
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+
+class Deadline:
+    """Time budget and cancel switch shared by the upstream calls of one job.
+
+    Pass it as ``deadline=`` to transport calls and to the services that make
+    them: a call's own timeout is capped by the time left, and once the
+    deadline is cancelled no further call or retry is sent. ``child`` carves
+    out a smaller budget for one stage that shares the cancel switch.
+    """
+
+    def __init__(self, seconds, switch=None):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self._switch = switch or _CancelSwitch()
+
+    @property
+    def cancel_event(self):
+        return self._switch.event
+
+    @property
+    def cancelled(self):
+        return self._switch.event.is_set()
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def child(self, seconds):
+        return Deadline(min(seconds, self.remaining()), self._switch)
+
+    def cancel(self):
+        switch = self._switch
+        with switch.lock:
+            if switch.event.is_set():
+                return
+            switch.event.set()
+            callbacks, switch.callbacks = switch.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        # Runs ``callback`` on cancel, or right away if already cancelled
+        switch = self._switch
+        with switch.lock:
+            if not switch.event.is_set():
+                switch.callbacks.append(callback)
+                return
+        callback()
+
+
+def endpoint_name(method, url):
+    # "GET api.twelvelabs.io/v1.3/indexes/:id/videos/:id"
+    parts = urlsplit(str(url))
+    path = '/'.join(':id' if ID_SEGMENT.fullmatch(segment) else segment for segment in parts.path.split('/'))
+    return f"{method.upper()} {parts.hostname}{path}"
+
+
+class Endpoint:
+    """Latency window, circuit breaker and counters for one upstream route.
+
+    The breaker opens after ``failure_threshold`` consecutive failures
+    (connection errors, timeouts and 5xx responses) and rejects calls for
+    ``reset_seconds``. After that one probe call is let through; it closes
+    the breaker on success and reopens it on failure.
+    """
+
+    def __init__(self, name, failure_threshold, reset_seconds, window=200):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.latencies = deque(maxlen=window)
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'retries': 0, 'hedged': 0, 'hedge_wins': 0, 'opened': 0}
+        self._lock = threading.Lock()
+
+    def admit(self):
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.reset_seconds - time.monotonic()
+                if remaining > 0:
+                    self.stats['rejected'] += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    self.stats['rejected'] += 1
+                    raise CircuitOpenError(self.name, self.reset_seconds)
+                self.probing = True
+            self.stats['calls'] += 1
+
+    def record(self, ok, latency=None):
+        with self._lock:
+            self.probing = False
+            if ok:
+                self.failures = 0
+                self.state = CLOSED
+                if latency is not None:
+                    self.latencies.append(latency)
+                return
+            self.failures += 1
+            self.stats['failures'] += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.stats['opened'] += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def abandon(self):
+        # The call never reached the upstream (e.g. it was rate limited)
+        with self._lock:
+            self.probing = False
+
+    def count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+
+    def p95(self, min_samples):
+        with self._lock:
+            if len(self.latencies) < min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def snapshot(self):
+        p95 = self.p95(1)
+        with self._lock:
+            stats = dict(self.stats)
+            stats['state'] = self.state
+            stats['consecutive_failures'] = self.failures
+            stats['samples'] = len(self.latencies)
+        stats['p95_ms'] = round(p95 * 1000, 1) if p95 is not None else None
+        return stats
+
+
+class Resilience:
+    """Deadlines, retries, hedging and circuit breakers for upstream calls.
+
+    ``HttpTransport`` consults this for every REST call: each call has a
+    deadline (its ``timeout``, or ``default_deadline``) that bounds all its
+    attempts and backoff together. Idempotent calls that hit a connection
+    error, a timeout or a 429/5xx are retried up to ``max_attempts`` times
+    with full-jitter exponential backoff. GETs marked ``hedge=True`` send a
+    second copy once the first has been outstanding longer than the
+    endpoint's p95 latency, and use whichever answers first; hedges are
+    capped at ``hedge_budget`` of an endpoint's calls so they cannot double
+    the load on a slow upstream.
+    """
+
+    def __init__(self, default_deadline=None, max_attempts=None, backoff_base=None, backoff_max=None,
+                 hedge_budget=None, hedge_min_samples=None, hedge_min_delay=None,
+                 failure_threshold=None, reset_seconds=None, max_endpoints=256):
+        self.default_deadline = default_deadline or float(os.environ.get('HTTP_DEFAULT_DEADLINE', 30))
+        self.max_attempts = max_attempts or int(os.environ.get('HTTP_RETRY_MAX_ATTEMPTS', 3))
+        self.backoff_base = backoff_base or float(os.environ.get('HTTP_RETRY_BACKOFF_BASE', 0.25))
+        self.backoff_max = backoff_max or float(os.environ.get('HTTP_RETRY_BACKOFF_MAX', 4))
+        self.hedge_budget = hedge_budget if hedge_budget is not None else float(os.environ.get('HTTP_HEDGE_BUDGET', 0.1))
+        self.hedge_min_samples = hedge_min_samples or int(os.environ.get('HTTP_HEDGE_MIN_SAMPLES', 20))
+        self.hedge_min_delay = hedge_min_delay if hedge_min_delay is not None else float(os.environ.get('HTTP_HEDGE_MIN_DELAY', 0.05))
+        self.failure_threshold = failure_threshold or int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+        self.reset_seconds = reset_seconds or float(os.environ.get('BREAKER_RESET_SECONDS', 30))
+        self.max_endpoints = max_endpoints
+        self._endpoints = OrderedDict()
+        self._lock = threading.Lock()
+
+    def endpoint(self, method, url):
+        name = endpoint_name(method, url)
+        with self._lock:
+            endpoint = self._endpoints.get(name)
+            if endpoint is None:
+                endpoint = self._endpoints[name] = Endpoint(name, self.failure_threshold, self.reset_seconds)
+                while len(self._endpoints) > self.max_endpoints:
+                    self._endpoints.popitem(last=False)
+            else:
+                self._endpoints.move_to_end(name)
+        return endpoint
+
+    def backoff(self, attempt):
+        # Full jitter: anywhere between 0 and the exponential cap
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def hedge_delay(self, endpoint):
+        # Seconds to wait before hedging, or None when a hedge is not allowed
+        p95 = endpoint.p95(self.hedge_min_samples)
+        if p95 is None:
+            return None
+        with endpoint._lock:
+            if endpoint.stats['hedged'] >= self.hedge_budget * endpoint.stats['calls']:
+                return None
+        return max(p95, self.hedge_min_delay)
+
+    def stats(self):
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+        return {
+            'default_deadline': self.default_deadline,
+            'max_attempts': self.max_attempts,
+            'open_breakers': sum(1 for endpoint in endpoints if endpoint.state != CLOSED),
+            'endpoints': {endpoint.name: endpoint.snapshot() for endpoint in endpoints}
+        }
+
+
+_resilience = None
+_resilience_lock = threading.Lock()
+
+
+def get_resilience():
+    global _resilience
+    if _resilience is None:
+        with _resilience_lock:
+            if _resilience is None:
+                _resilience = Resilience()
+    return _resilience
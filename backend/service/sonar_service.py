@@ -1,6 +1,58 @@
 import requests
 import os
 import json
+from service.http_transport import get_transport
+
+
+class SonarStreamAssembler:
+    # Parses Sonar SSE lines and assembles the final response; shared by the
+    # sync and async services.
+
+    def __init__(self):
+        self.content_parts = []
+        self.result = {}
+        self.finish_reason = None
+        self.done = False
+
+    def feed(self, line):
+        # Returns the content delta carried by ``line``, if any
+        if not line or not line.startswith('data: '):
+            return None
+        data_str = line[6:]  # Remove 'data: ' prefix
+        if data_str == '[DONE]':
+            self.done = True
+            return None
+        try:
+            chunk_data = json.loads(data_str)
+        except json.JSONDecodeError:
+            return None
+
+        # Citations, search results and usage are repeated on every
+        # chunk and only complete on the last one, so keep the latest.
+        for field in ('id', 'model', 'created', 'citations', 'search_results', 'usage'):
+            if chunk_data.get(field):
+                self.result[field] = chunk_data[field]
+
+        choices = chunk_data.get('choices') or [{}]
+        self.finish_reason = choices[0].get('finish_reason') or self.finish_reason
+        content = (choices[0].get('delta') or {}).get('content', '')
+        if content:
+            self.content_parts.append(content)
+            return content
+        return None
+
+    def final_result(self):
+        result = dict(self.result)
+        result['choices'] = [{
+            'index': 0,
+            'finish_reason': self.finish_reason,
+            'message': {
+                'role': 'assistant',
+                'content': ''.join(self.content_parts)
+            }
+        }]
+        return result
+
 
 class SonarService:
     
@@ -8,9 +60,10 @@ class SonarService:
         if api_key is None:
             api_key = os.environ.get('PERPLEXITY', '')
         self.api_key = api_key
+        self.http = get_transport()
         self.base_url = "https://api.perplexity.ai/chat/completions"
     
-    def deep_research(self, query, timeout=180):
+    def deep_research(self, query, timeout=180, deadline=None):
 
         try:
             if not self.api_key:
@@ -28,11 +81,12 @@ class SonarService:
                 "Content-Type": "application/json"
             }
             
-            response = requests.post(
+            response = self.http.post(
                 self.base_url, 
                 json=payload, 
                 headers=headers, 
-                timeout=timeout
+                timeout=timeout,
+                deadline=deadline
             )
             
             if response.status_code == 200:
@@ -51,61 +105,72 @@ class SonarService:
             print(f"Error in deep_research: {e}")
             return {"error": str(e)}
     
-    # def deep_research_stream(self, query, timeout=90):
+    def deep_research_stream(self, query, timeout=180, deadline=None):
+        """Stream a Sonar completion as it is generated.
 
-    #     try:
-    #         if not self.api_key:
-    #             raise ValueError("API key is required")
-            
-    #         payload = {
-    #             "model": "sonar",
-    #             "messages": [
-    #                 {"role": "user", "content": query}
-    #             ],
-    #             "stream": True
-    #         }
+        Yields ``{'type': 'delta', 'content': ...}`` for each content delta and
+        finishes with ``{'type': 'done', 'result': ...}`` where ``result`` has
+        the same shape as the ``deep_research`` response (choices, citations,
+        search_results, usage). Failures are yielded as
+        ``{'type': 'error', 'error': ...}``. A ``Deadline`` caps the timeout,
+        and the stream stops at the next chunk once it expires or is
+        cancelled.
+        """
+        response = None
+        try:
+            if not self.api_key:
+                raise ValueError("API key is required")
             
-    #         headers = {
-    #             "Authorization": f"Bearer {self.api_key}",
-    #             "Content-Type": "application/json"
-    #         }
+            payload = {
+                "model": "sonar",
+                "messages": [
+                    {"role": "user", "content": query}
+                ],
+                "stream": True
+            }
             
-    #         # Add timeout to prevent hanging requests
-    #         response = requests.post(
-    #             self.base_url, 
-    #             json=payload, 
-    #             headers=headers, 
-    #             stream=True,
-    #             timeout=timeout
-    #         )
+            headers = {
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            }
             
-    #         if response.status_code != 200:
-    #             print(f"Error: {response.status_code} - {response.text}")
-    #             yield f"data: {json.dumps({'error': f'API request failed with status {response.status_code}'})}\n\n"
-    #             return
+            response = self.http.post(
+                self.base_url, 
+                json=payload, 
+                headers=headers, 
+                stream=True,
+                timeout=timeout,
+                deadline=deadline
+            )
             
-    #         for line in response.iter_lines():
-    #             if line:
-    #                 line = line.decode('utf-8')
-    #                 if line.startswith('data: '):
-    #                     data_str = line[6:]  # Remove 'data: ' prefix
-    #                     if data_str == '[DONE]':
-    #                         yield f"data: {json.dumps({'done': True})}\n\n"
-    #                         break
-    #                     try:
-    #                         chunk_data = json.loads(data_str)
-    #                         content = chunk_data['choices'][0]['delta'].get('content', '')
-    #                         if content:
-    #                             yield f"data: {json.dumps({'content': content})}\n\n"
-    #                     except json.JSONDecodeError:
-    #                         continue
+            if response.status_code != 200:
+                print(f"Error: {response.status_code} - {response.text}")
+                yield {'type': 'error', 'error': f"API request failed with status {response.status_code}"}
+                return
+
+            assembler = SonarStreamAssembler()
+            for line in response.iter_lines():
+                if deadline is not None and (deadline.cancelled or deadline.expired):
+                    yield {'type': 'error', 'error': 'Research stopped: deadline exceeded or cancelled'}
+                    return
+                content = assembler.feed(line.decode('utf-8') if line else '')
+                if content:
+                    yield {'type': 'delta', 'content': content}
+                if assembler.done:
+                    break
+
+            yield {'type': 'done', 'result': assembler.final_result()}
                 
-    #     except requests.exceptions.Timeout:
-    #         print("Streaming request timed out")
-    #         yield f"data: {json.dumps({'error': 'Request timed out - Sonar research is taking too long'})}\n\n"
-    #     except requests.exceptions.RequestException as e:
-    #         print(f"Streaming request error: {e}")
-    #         yield f"data: {json.dumps({'error': f'Network error: {str(e)}'})}\n\n"
-    #     except Exception as e:
-    #         print(f"Error in deep_research_stream: {e}")
-    #         yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        except requests.exceptions.Timeout:
+            print("Streaming request timed out")
+            yield {'type': 'error', 'error': 'Request timed out - Sonar research is taking too long'}
+        except requests.exceptions.RequestException as e:
+            print(f"Streaming request error: {e}")
+            yield {'type': 'error', 'error': f"Network error: {str(e)}"}
+        except Exception as e:
+            print(f"Error in deep_research_stream: {e}")
+            yield {'type': 'error', 'error': str(e)}
+        finally:
+            # Return the connection to the pool even if the consumer stopped early
+            if response is not None:
+                response.close()
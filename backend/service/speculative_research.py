@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_QUERY_TEMPLATE = """Please research: {research_query}
+
+Give a concise, well-sourced overview using markdown headings. This is a preliminary answer that will be refined once the related video has been analyzed."""
+
+SPECULATIVE_CONTEXT_TEMPLATE = """
+
+Preliminary web research on the same question (gathered before the video analysis was available; use it where it is relevant and verify it against the analysis):
+{speculative_content}"""
+
+
+class SpeculationPolicy:
+    """Decides whether a workflow should start a query-only research pass.
+
+    Modes: ``off`` never speculates, ``always`` speculates on every workflow,
+    ``auto`` speculates only when the analysis is not cached (so there is a
+    real wait to overlap with) and the query is long enough to be researched
+    on its own. A per-request flag overrides the mode.
+    """
+
+    MODES = ('off', 'auto', 'always')
+
+    def __init__(self, mode=None, min_query_chars=None):
+        mode = (mode or os.environ.get('SPECULATIVE_RESEARCH', 'off')).lower()
+        self.mode = mode if mode in self.MODES else 'off'
+        self.min_query_chars = min_query_chars or int(os.environ.get('SPECULATIVE_MIN_QUERY_CHARS', 20))
+
+    def should_speculate(self, research_query, analysis_cached, requested=None):
+        if requested is not None:
+            return bool(requested)
+        if self.mode == 'always':
+            return True
+        if self.mode == 'auto':
+            return not analysis_cached and len((research_query or '').strip()) >= self.min_query_chars
+        return False
+
+
+class SpeculationMetrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {
+            'started': 0,
+            'completed': 0,
+            'failed': 0,
+            'drafts_streamed': 0,
+            'used_in_prompt': 0,
+            'late': 0
+        }
+
+    def incr(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+        stats['use_rate'] = round(stats['used_in_prompt'] / stats['started'], 4) if stats['started'] else 0.0
+        return stats
+
+
+class SpeculativeResearch:
+    """One speculative Sonar call racing the video analysis.
+
+    ``run`` performs the query-only call and, if the main research step has
+    not started yet, stores the result and hands it to ``on_draft`` so it can
+    be streamed as an early draft. ``claim`` is called by the research step:
+    it returns the finished result (to fold into the prompt) or None, and
+    marks any result that arrives afterwards as late.
+    """
+
+    def __init__(self, sonar_service, research_query, metrics, timeout=None, max_context_chars=None):
+        self.sonar_service = sonar_service
+        self.research_query = research_query
+        self.metrics = metrics
+        self.timeout = timeout or int(os.environ.get('SPECULATIVE_TIMEOUT', 90))
+        self.max_context_chars = max_context_chars or int(os.environ.get('SPECULATIVE_CONTEXT_CHARS', 4000))
+        self._lock = threading.Lock()
+        self._result = None
+        self._claimed = False
+
+    def run(self, on_draft=None, deadline=None):
+        self.metrics.incr('started')
+        try:
+            result = self.sonar_service.deep_research(self.query(), timeout=self.timeout, deadline=deadline)
+        except Exception as e:
+            result = {'error': str(e)}
+        return self._finish(result, on_draft)
+
+    async def run_async(self, on_draft=None, deadline=None):
+        # Same as run() for an AsyncSonarService
+        self.metrics.incr('started')
+        try:
+            result = await self.sonar_service.deep_research(self.query(), timeout=self.timeout, deadline=deadline)
+        except Exception as e:
+            result = {'error': str(e)}
+        return self._finish(result, on_draft)
+
+    def query(self):
+        return SPECULATIVE_QUERY_TEMPLATE.format(research_query=self.research_query)
+
+    def _finish(self, result, on_draft):
+        if not result or 'error' in result or not result.get('choices'):
+            self.metrics.incr('failed')
+            logger.info(f"Speculative research failed: {(result or {}).get('error')}")
+            return None
+
+        self.metrics.incr('completed')
+        with self._lock:
+            if self._claimed:
+                self.metrics.incr('late')
+                return None
+            self._result = result
+            if on_draft is not None:
+                on_draft(result)
+                self.metrics.incr('drafts_streamed')
+        return result
+
+    def claim(self):
+        with self._lock:
+            self._claimed = True
+            result = self._result
+        if result is not None:
+            self.metrics.incr('used_in_prompt')
+        return result
+
+    def prompt_context(self, result):
+        content = result['choices'][0].get('message', {}).get('content', '')
+        if not content:
+            return ''
+        return SPECULATIVE_CONTEXT_TEMPLATE.format(speculative_content=content[:self.max_context_chars])
+
+
+_metrics = SpeculationMetrics()
+
+
+def get_speculation_metrics():
+    return _metrics
@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from service.workflow_scheduler import get_workflow_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class StageCancelled(Exception):
+    pass
+
+
+class Stage:
+
+    def __init__(self, name, fn, deps=(), ordered=True, required=True):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        # Unordered stages release their events as soon as they are emitted
+        # instead of waiting for every earlier stage to finish.
+        self.ordered = ordered
+        # The run ends once every required stage is done; optional stages
+        # still running at that point are abandoned.
+        self.required = required
+
+
+class StageContext:
+
+    def __init__(self, graph, stage, results):
+        self.name = stage.name
+        self.results = results
+        self._graph = graph
+
+    @property
+    def cancelled(self):
+        return self._graph.cancel_event.is_set()
+
+    def emit(self, item):
+        self._graph._queue.put_nowait(('event', self.name, item))
+
+
+def emit_from(generator, emit):
+    """Forward every item of ``generator`` to ``emit`` and return its return value."""
+    while True:
+        try:
+            item = next(generator)
+        except StopIteration as stop:
+            return stop.value
+        emit(item)
+
+
+class _StageScheduler:
+    # Dependency bookkeeping and ordered release shared by the thread and
+    # asyncio graphs; ``submit`` starts a stage with its dependency results.
+
+    def __init__(self, stages, submit):
+        self.stages = list(stages)
+        by_name = {stage.name: stage for stage in self.stages}
+        for stage in self.stages:
+            for dep in stage.deps:
+                if dep not in by_name:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+        self._submit = submit
+        self.started = set()
+        self.results = {}
+        self.outcome = {}
+        self.buffers = {stage.name: [] for stage in self.stages}
+        self.released = set()
+        self.required = {stage.name for stage in self.stages if stage.required}
+
+    @property
+    def finished(self):
+        return self.required <= self.released
+
+    def start(self):
+        for stage in self.stages:
+            if not stage.deps:
+                self._start(stage)
+
+    def _start(self, stage):
+        self.started.add(stage.name)
+        self._submit(stage, {dep: self.results[dep] for dep in stage.deps})
+
+    def _dependents(self, name):
+        return [stage for stage in self.stages if name in stage.deps]
+
+    def handle(self, kind, name, payload):
+        if kind == 'event':
+            self.buffers[name].append(payload)
+        elif name not in self.outcome:
+            if kind == 'error':
+                logger.warning(f"Stage {name} failed: {payload}")
+            self._settle(name, kind, payload)
+
+    def _settle(self, name, kind, payload):
+        self.outcome[name] = (kind, payload)
+        if kind == 'result':
+            self.results[name] = payload
+            for dependent in self._dependents(name):
+                if dependent.name in self.outcome or dependent.name in self.started:
+                    continue
+                if all(dep in self.results for dep in dependent.deps):
+                    self._start(dependent)
+        else:
+            for dependent in self._dependents(name):
+                if dependent.name not in self.outcome and dependent.name not in self.started:
+                    self._settle(dependent.name, 'cancelled', name)
+
+    def drain_ready(self):
+        ready = []
+        for stage in self.stages:
+            if stage.ordered or stage.name in self.released:
+                continue
+            ready.extend(('event', stage.name, item) for item in self.buffers[stage.name])
+            self.buffers[stage.name] = []
+            if stage.name in self.outcome:
+                ready.append((self.outcome[stage.name][0], stage.name, self.outcome[stage.name][1]))
+                self.released.add(stage.name)
+        for stage in self.stages:
+            if not stage.ordered or stage.name in self.released:
+                continue
+            ready.extend(('event', stage.name, item) for item in self.buffers[stage.name])
+            self.buffers[stage.name] = []
+            if stage.name not in self.outcome:
+                break
+            ready.append((self.outcome[stage.name][0], stage.name, self.outcome[stage.name][1]))
+            self.released.add(stage.name)
+        return ready
+
+
+class StageGraph:
+    """Run workflow stages concurrently according to their dependencies.
+
+    Each stage function receives a ``StageContext`` with the results of its
+    dependencies and an ``emit`` callback. ``run()`` yields
+    ``(kind, stage_name, payload)`` tuples where ``kind`` is ``'event'``,
+    ``'result'``, ``'error'`` or ``'cancelled'``. Output of ordered stages is
+    released in declaration order, so the stream looks the same as a sequential
+    run; the frontmost unfinished stage streams live. A failed stage cancels
+    everything that depends on it.
+
+    With a ``deadline`` (``service.resilience.Deadline``) the run also ends
+    when it expires or is cancelled, without waiting for running stages;
+    ``finished`` then stays False and ``results`` holds what did complete.
+    """
+
+    def __init__(self, stages, executor, deadline=None):
+        self.executor = executor
+        self.cancel_event = threading.Event()
+        self._queue = queue.Queue()
+        self._futures = {}
+        self._scheduler = _StageScheduler(stages, self._submit)
+        self._deadline = deadline
+        if deadline is not None:
+            deadline.on_cancel(self._interrupt)
+
+    @property
+    def finished(self):
+        return self._scheduler.finished
+
+    @property
+    def results(self):
+        return dict(self._scheduler.results)
+
+    def _interrupt(self):
+        # Wake run() so it notices the cancellation
+        self.cancel()
+        self._queue.put(None)
+
+    def _submit(self, stage, results):
+        ctx = StageContext(self, stage, results)
+        self._futures[stage.name] = self.executor.submit(self._execute, stage, ctx)
+
+    def _execute(self, stage, ctx):
+        if self.cancel_event.is_set():
+            self._queue.put(('cancelled', stage.name, None))
+            return
+        try:
+            result = stage.fn(ctx)
+        except StageCancelled:
+            self._queue.put(('cancelled', stage.name, None))
+        except Exception as e:
+            self._queue.put(('error', stage.name, e))
+        else:
+            self._queue.put(('result', stage.name, result))
+
+    def cancel(self):
+        self.cancel_event.set()
+        for future in list(self._futures.values()):
+            future.cancel()
+
+    def run(self):
+        scheduler = self._scheduler
+        deadline = self._deadline
+        try:
+            scheduler.start()
+            while True:
+                for item in scheduler.drain_ready():
+                    yield item
+                if scheduler.finished or self.cancel_event.is_set():
+                    break
+                try:
+                    item = self._queue.get(timeout=deadline.remaining() if deadline is not None else None)
+                except queue.Empty:
+                    # Out of time; running stages are abandoned
+                    break
+                if item is not None:
+                    scheduler.handle(*item)
+        finally:
+            # Consumer finished or went away: stop anything not yet running
+            self.cancel()
+
+
+class AsyncStageGraph:
+    """asyncio counterpart of ``StageGraph`` for coroutine stage functions.
+
+    Stages run as tasks on the current event loop; ``run()`` is an async
+    generator with the same output and ordering rules. Tasks still running
+    when the deadline expires or is cancelled are cancelled, which aborts
+    their in-flight upstream requests.
+    """
+
+    def __init__(self, stages, deadline=None):
+        self.cancel_event = threading.Event()
+        self._queue = asyncio.Queue()
+        self._tasks = {}
+        self._scheduler = _StageScheduler(stages, self._submit)
+        self._deadline = deadline
+        if deadline is not None:
+            deadline.on_cancel(self._interrupt)
+
+    @property
+    def finished(self):
+        return self._scheduler.finished
+
+    @property
+    def results(self):
+        return dict(self._scheduler.results)
+
+    def _interrupt(self):
+        # Called on the event loop (the async coalescer cancels from there)
+        self.cancel()
+        self._queue.put_nowait(None)
+
+    def _submit(self, stage, results):
+        ctx = StageContext(self, stage, results)
+        self._tasks[stage.name] = asyncio.ensure_future(self._execute(stage, ctx))
+
+    async def _execute(self, stage, ctx):
+        try:
+            result = await stage.fn(ctx)
+        except (StageCancelled, asyncio.CancelledError):
+            self._queue.put_nowait(('cancelled', stage.name, None))
+        except Exception as e:
+            self._queue.put_nowait(('error', stage.name, e))
+        else:
+            self._queue.put_nowait(('result', stage.name, result))
+
+    def cancel(self):
+        self.cancel_event.set()
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+
+    async def run(self):
+        scheduler = self._scheduler
+        deadline = self._deadline
+        try:
+            scheduler.start()
+            while True:
+                for item in scheduler.drain_ready():
+                    yield item
+                if scheduler.finished or self.cancel_event.is_set():
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), deadline.remaining() if deadline is not None else None)
+                except asyncio.TimeoutError:
+                    break
+                if item is not None:
+                    scheduler.handle(*item)
+        finally:
+            self.cancel()
+
+
+_stage_executor = None
+_stage_executor_lock = threading.Lock()
+
+
+def get_stage_executor():
+    global _stage_executor
+    if _stage_executor is None:
+        with _stage_executor_lock:
+            if _stage_executor is None:
+                # An admitted workflow runs up to three stages at once (video
+                # details, analysis and speculative research), so the pool has
+                # room for every slot the scheduler grants
+                workers = os.environ.get('WORKFLOW_STAGE_WORKERS')
+                _stage_executor = ThreadPoolExecutor(
+                    max_workers=int(workers) if workers else get_workflow_scheduler().max_concurrent * 3,
+                    thread_name_prefix='workflow-stage'
+                )
+    return _stage_executor
+
+
+_batch_executor = None
+
+
+def get_batch_executor():
+    # Separate from the stage pool so a large batch cannot starve
+    # interactive workflows; each batch caps its own share of it
+    global _batch_executor
+    if _batch_executor is None:
+        with _stage_executor_lock:
+            if _batch_executor is None:
+                _batch_executor = ThreadPoolExecutor(
+                    max_workers=int(os.environ.get('BATCH_WORKFLOW_WORKERS', 8)),
+                    thread_name_prefix='workflow-batch'
+                )
+    return _batch_executor
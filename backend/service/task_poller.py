@@ -0,0 +1,351 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+READY_STATUSES = ('ready', 'completed')
+FAILED_STATUSES = ('failed', 'error')
+
+# Base seconds between polls for each reported task status. Early statuses
+# flip quickly; indexing is the long tail.
+STATUS_INTERVALS = {
+    'validating': 2,
+    'uploading': 3,
+    'pending': 4,
+    'queued': 6,
+    'indexing': 8
+}
+
+SIZE_UNIT_BYTES = 256 * 1024 * 1024
+
+
+class _WatchedTask:
+
+    def __init__(self, task_id, service, index_id, file_size, deadline):
+        self.task_id = task_id
+        self.service = service
+        self.index_id = index_id
+        self.file_size = file_size or 0
+        self.deadline = deadline
+        self.future = Future()
+        self.callbacks = []
+        self.status = None
+        self.same_status_polls = 0
+        self.polls = 0
+        self.next_poll = 0
+        self.in_poll = False
+        self.expedite = False
+
+
+def _parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+class TaskPoller:
+    """One background loop that tracks every pending TwelveLabs indexing task.
+
+    Each watched task is polled on its own schedule: the interval starts from
+    a per-status base, grows with the file size, backs off exponentially while
+    the status stays the same and is jittered so tasks do not poll in step.
+    When several tasks on the same key and index are due together (or within
+    ``batch_window`` seconds of each other), one ``GET /tasks`` listing covers
+    all of those it contains and only the rest are fetched individually.
+
+    ``watch`` returns a ``concurrent.futures.Future`` that resolves to the
+    same dict ``TwelveLabsService.upload_video_file`` returns.
+
+    With webhooks enabled, ``notify`` resolves tasks as soon as TwelveLabs
+    reports them and polling drops to a slow safety net (at least
+    ``safety_interval`` seconds apart) for events that never arrive. A final
+    event can arrive before its task is watched (the upload has just
+    returned, or jobs are still being recovered after a restart); it is held
+    for ``early_event_ttl`` seconds and applied when ``watch`` registers the
+    task.
+    """
+
+    def __init__(self, min_interval=None, max_interval=None, backoff=None, batch_min=None, batch_window=None, page_limit=None, workers=None, webhooks_enabled=None, safety_interval=None, early_event_ttl=None):
+        self.min_interval = min_interval or float(os.environ.get('TASK_POLL_MIN_INTERVAL', 2))
+        self.max_interval = max_interval or float(os.environ.get('TASK_POLL_MAX_INTERVAL', 60))
+        self.backoff = backoff or float(os.environ.get('TASK_POLL_BACKOFF', 1.5))
+        self.batch_min = batch_min or int(os.environ.get('TASK_POLL_BATCH_MIN', 2))
+        self.batch_window = batch_window or float(os.environ.get('TASK_POLL_BATCH_WINDOW', 5))
+        self.page_limit = page_limit or int(os.environ.get('TASK_POLL_PAGE_LIMIT', 50))
+        self.workers = workers or int(os.environ.get('TASK_POLL_WORKERS', 4))
+        if webhooks_enabled is None:
+            webhooks_enabled = bool(os.environ.get('TWELVELABS_WEBHOOK_SECRET'))
+        self.webhooks_enabled = webhooks_enabled
+        self.safety_interval = safety_interval or float(os.environ.get('TASK_POLL_SAFETY_INTERVAL', 120))
+        self.early_event_ttl = early_event_ttl or float(os.environ.get('TASK_WEBHOOK_EARLY_EVENT_TTL', 300))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='task-poll')
+        self._tasks = {}
+        # task id -> (expires_at, status, result) of final events for tasks
+        # that were not watched yet
+        self._early_events = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stats = {
+            'watched': 0,
+            'polls': 0,
+            'list_polls': 0,
+            'list_hits': 0,
+            'poll_errors': 0,
+            'completed': 0,
+            'failed': 0,
+            'timed_out': 0,
+            'webhook_events': 0,
+            'webhook_matched': 0,
+            'webhook_held': 0,
+            'resolved_by_webhook': 0
+        }
+        self._resolved_polls = 0
+        self._lag_total = 0.0
+        self._lag_count = 0
+        self._lag_max = 0.0
+
+    def watch(self, task_id, service, index_id=None, file_size=None, timeout_seconds=900, on_status=None):
+        early = None
+        with self._condition:
+            task = self._tasks.get(task_id)
+            if task is None:
+                task = _WatchedTask(task_id, service, index_id, file_size, time.time() + timeout_seconds)
+                task.next_poll = time.time() + self._interval(task)
+                self._tasks[task_id] = task
+                self._stats['watched'] += 1
+                early = self._early_events.pop(task_id, None)
+                if early is not None and early[0] < time.time():
+                    early = None
+            else:
+                task.deadline = max(task.deadline, time.time() + timeout_seconds)
+            if on_status:
+                task.callbacks.append(on_status)
+            if early is not None:
+                self._stats['webhook_matched'] += 1
+                self._stats['resolved_by_webhook'] += 1
+            else:
+                self._ensure_thread()
+                self._condition.notify_all()
+        if early is not None:
+            _, status, result = early
+            self._resolve_event(task, status, result)
+        return task.future
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name='task-poller', daemon=True)
+            self._thread.start()
+
+    def _interval(self, task):
+        base = STATUS_INTERVALS.get(task.status, self.min_interval)
+        size_factor = min(4.0, 1 + task.file_size / SIZE_UNIT_BYTES)
+        interval = min(base * size_factor * (self.backoff ** task.same_status_polls), self.max_interval)
+        if self.webhooks_enabled:
+            interval = max(interval, self.safety_interval)
+        # Equal jitter: keep half the interval, randomize the other half
+        return max(self.min_interval, random.uniform(interval / 2, interval))
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.time()
+                    idle = [task for task in self._tasks.values() if not task.in_poll]
+                    due = [task for task in idle if task.next_poll <= now]
+                    if due:
+                        break
+                    timeout = min(task.next_poll for task in idle) - now if idle else None
+                    self._condition.wait(timeout)
+                # Tasks that share a listing with a due task and would be due
+                # shortly anyway ride along on the same request.
+                listable = {(task.service.api_key, task.index_id) for task in due if task.index_id}
+                due_ids = {id(task) for task in due}
+                for task in idle:
+                    if id(task) not in due_ids and task.next_poll <= now + self.batch_window \
+                            and (task.service.api_key, task.index_id) in listable:
+                        due.append(task)
+                for task in due:
+                    task.in_poll = True
+                    task.expedite = False
+
+            groups = {}
+            for task in due:
+                groups.setdefault((task.service.api_key, task.index_id), []).append(task)
+            for tasks in groups.values():
+                self._executor.submit(self._poll_group, tasks)
+
+    def _poll_group(self, tasks):
+        try:
+            remaining = tasks
+            if len(tasks) >= self.batch_min and tasks[0].index_id:
+                remaining = self._poll_listing(tasks)
+            for task in remaining:
+                try:
+                    result = task.service.get_task(task.task_id)
+                except Exception as e:
+                    logger.warning(f"Polling task {task.task_id} failed: {e}")
+                    result = None
+                with self._condition:
+                    self._stats['polls'] += 1
+                self._apply(task, result)
+        finally:
+            with self._condition:
+                for task in tasks:
+                    task.in_poll = False
+                self._condition.notify_all()
+
+    def _poll_listing(self, tasks):
+        # Returns the tasks the listing did not cover
+        service = tasks[0].service
+        try:
+            listed = service.list_tasks(tasks[0].index_id, page_limit=self.page_limit)
+        except Exception as e:
+            logger.warning(f"Listing tasks for index {tasks[0].index_id} failed: {e}")
+            listed = None
+        if listed is None:
+            return tasks
+
+        by_id = {item.get('_id') or item.get('id'): item for item in listed}
+        remaining = []
+        for task in tasks:
+            result = by_id.get(task.task_id)
+            if result is None:
+                remaining.append(task)
+            else:
+                with self._condition:
+                    self._stats['list_hits'] += 1
+                self._apply(task, result)
+        with self._condition:
+            self._stats['list_polls'] += 1
+        return remaining
+
+    def _apply(self, task, result):
+        now = time.time()
+        task.polls += 1
+        if result is None:
+            with self._condition:
+                self._stats['poll_errors'] += 1
+            task.same_status_polls += 1
+        else:
+            status = result.get('status')
+            if status != task.status:
+                task.status = status
+                task.same_status_polls = 0
+                for callback in list(task.callbacks):
+                    try:
+                        callback(status, result)
+                    except Exception as e:
+                        logger.warning(f"Task {task.task_id} status callback failed: {e}")
+            else:
+                task.same_status_polls += 1
+
+            if status in READY_STATUSES:
+                self._record_lag(result, now)
+                video_id = result.get('video_id') or (result.get('data') or {}).get('video_id')
+                self._resolve(task, {'status': status, 'video_id': video_id, 'task': result}, 'completed')
+                return
+            if status in FAILED_STATUSES:
+                self._resolve(task, {'error': f"Indexing failed with status {status}", 'task': result}, 'failed')
+                return
+
+        if now >= task.deadline:
+            self._resolve(task, {'error': 'Upload timed out'}, 'timed_out')
+            return
+        with self._condition:
+            task.next_poll = now if task.expedite else now + self._interval(task)
+
+    def notify(self, task_id, status, result):
+        # Entry point for webhook events. Terminal events carrying what the
+        # waiter needs resolve the task directly; anything else (including a
+        # ready event without a video id) triggers an immediate poll.
+        video_id = result.get('video_id') or (result.get('data') or {}).get('video_id')
+        final = (status in READY_STATUSES and video_id) or status in FAILED_STATUSES
+        with self._condition:
+            self._stats['webhook_events'] += 1
+            task = self._tasks.get(task_id)
+            if task is None:
+                if final:
+                    self._hold_early_event(task_id, status, result)
+                return False
+            self._stats['webhook_matched'] += 1
+            if not final:
+                task.expedite = True
+                task.next_poll = 0
+                self._condition.notify_all()
+                return True
+            self._stats['resolved_by_webhook'] += 1
+        self._resolve_event(task, status, result)
+        return True
+
+    def _hold_early_event(self, task_id, status, result):
+        # Called with the condition held
+        now = time.time()
+        self._early_events = {k: event for k, event in self._early_events.items() if event[0] > now}
+        self._early_events[task_id] = (now + self.early_event_ttl, status, result)
+        self._stats['webhook_held'] += 1
+
+    def _resolve_event(self, task, status, result):
+        video_id = result.get('video_id') or (result.get('data') or {}).get('video_id')
+        for callback in list(task.callbacks):
+            try:
+                callback(status, result)
+            except Exception as e:
+                logger.warning(f"Task {task.task_id} status callback failed: {e}")
+        if status in READY_STATUSES:
+            self._record_lag(result, time.time())
+            self._resolve(task, {'status': status, 'video_id': video_id, 'task': result}, 'completed')
+        else:
+            self._resolve(task, {'error': f"Indexing failed with status {status}", 'task': result}, 'failed')
+
+    def _record_lag(self, result, now):
+        # Time between TwelveLabs marking the task done and us noticing
+        updated_at = _parse_timestamp(result.get('updated_at'))
+        if updated_at is None:
+            return
+        lag = max(0.0, now - updated_at)
+        with self._condition:
+            self._lag_total += lag
+            self._lag_count += 1
+            self._lag_max = max(self._lag_max, lag)
+
+    def _resolve(self, task, result, outcome):
+        with self._condition:
+            if self._tasks.get(task.task_id) is not task:
+                # Already resolved, e.g. by a webhook racing a poll
+                return
+            del self._tasks[task.task_id]
+            self._stats[outcome] += 1
+            self._resolved_polls += task.polls
+        if not task.future.done():
+            task.future.set_result(result)
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._tasks)
+            stats['held_events'] = len(self._early_events)
+            stats['webhooks_enabled'] = self.webhooks_enabled
+            resolved = stats['completed'] + stats['failed'] + stats['timed_out']
+            stats['polls_per_task'] = round(self._resolved_polls / resolved, 2) if resolved else 0.0
+            stats['detection_lag_avg_seconds'] = round(self._lag_total / self._lag_count, 2) if self._lag_count else None
+            stats['detection_lag_max_seconds'] = round(self._lag_max, 2) if self._lag_count else None
+        return stats
+
+
+_task_poller = None
+_task_poller_lock = threading.Lock()
+
+
+def get_task_poller():
+    global _task_poller
+    if _task_poller is None:
+        with _task_poller_lock:
+            if _task_poller is None:
+                _task_poller = TaskPoller()
+    return _task_poller
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from service.analysis_cache import BACKEND_DIR
+from service.disk_store import SizeCappedDiskStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(BACKEND_DIR, '.cache', 'thumbnails')
+
+
+class ThumbnailCache:
+    """Two-tier cache for video thumbnail images.
+
+    The memory tier is an LRU bounded by total image bytes; the disk tier
+    keeps one file per thumbnail (a JSON header line followed by the image)
+    and is trimmed least-recently-used first once it grows past
+    ``max_disk_bytes``. Concurrent misses for the same thumbnail share one
+    upstream fetch, and thumbnails that do not exist yet (the video is still
+    indexing) are remembered briefly so a grid reload does not refetch them.
+
+    Entries are keyed on the API key as well as the video so one tenant's
+    thumbnails are never served to another.
+    """
+
+    def __init__(self, cache_dir=None, ttl_seconds=None, max_memory_bytes=None, max_disk_bytes=None, missing_ttl_seconds=None):
+        self.cache_dir = cache_dir or os.environ.get('THUMBNAIL_CACHE_DIR') or DEFAULT_CACHE_DIR
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.environ.get('THUMBNAIL_CACHE_TTL', 7 * 24 * 3600))
+        self.max_memory_bytes = max_memory_bytes or int(os.environ.get('THUMBNAIL_CACHE_MEMORY_MB', 32)) * 1024 * 1024
+        self.max_disk_bytes = max_disk_bytes or int(os.environ.get('THUMBNAIL_CACHE_DISK_MB', 256)) * 1024 * 1024
+        self.missing_ttl_seconds = missing_ttl_seconds if missing_ttl_seconds is not None else int(os.environ.get('THUMBNAIL_MISSING_TTL', 60))
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._missing = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._disk = SizeCappedDiskStore(self.cache_dir, '.thumb', self.max_disk_bytes, name='thumbnail cache')
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'missing_hits': 0,
+            'errors': 0
+        }
+
+    def make_key(self, api_key, index_id, video_id):
+        raw = json.dumps([api_key or '', index_id or '', video_id])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _is_expired(self, created_at):
+        return self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds
+
+    def get_or_fetch(self, api_key, index_id, video_id, fetch):
+        """Return ``{'data', 'content_type', 'etag', 'created_at'}`` or None.
+
+        ``fetch()`` returns ``(image_bytes, content_type)`` or None when the
+        video has no thumbnail yet; it is called at most once per key at a
+        time however many requests miss together.
+        """
+        key = self.make_key(api_key, index_id, video_id)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._is_expired(entry['created_at']):
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return entry
+            if self._missing.get(key, 0) > time.time():
+                self._stats['missing_hits'] += 1
+                return None
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._loading[key] = future
+            else:
+                self._stats['coalesced'] += 1
+
+        if owner:
+            self._load(key, fetch, future)
+        return future.result()
+
+    def _load(self, key, fetch, future):
+        try:
+            entry = self._read_disk(key)
+            if entry is not None:
+                with self._lock:
+                    self._stats['disk_hits'] += 1
+            else:
+                with self._lock:
+                    self._stats['misses'] += 1
+                fetched = fetch()
+                if fetched is not None:
+                    data, content_type = fetched
+                    entry = {
+                        'data': data,
+                        'content_type': content_type or 'image/jpeg',
+                        'etag': hashlib.sha256(data).hexdigest()[:32],
+                        'created_at': time.time()
+                    }
+                    self._write_disk(key, entry)
+        except Exception as e:
+            with self._lock:
+                self._loading.pop(key, None)
+                self._stats['errors'] += 1
+            logger.warning(f"Thumbnail fetch failed: {e}")
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            self._loading.pop(key, None)
+            if entry is None:
+                self._missing[key] = time.time() + self.missing_ttl_seconds
+            else:
+                self._missing.pop(key, None)
+                self._remember(key, entry)
+        future.set_result(entry)
+
+    def _remember(self, key, entry):
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous['data'])
+        self._memory[key] = entry
+        self._memory_bytes += len(entry['data'])
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted['data'])
+        if len(self._missing) > 4096:
+            now = time.time()
+            self._missing = {k: until for k, until in self._missing.items() if until > now}
+
+    @staticmethod
+    def _decode(data):
+        # A JSON header line followed by the image bytes
+        header_line, _, image = data.partition(b'\n')
+        header = json.loads(header_line)
+        header['data'] = image
+        return header
+
+    def _read_disk(self, key):
+        entry = self._disk.read(key, self._decode)
+        if entry is not None and self._is_expired(entry.get('created_at', 0)):
+            self._disk.remove(key)
+            return None
+        return entry
+
+    def _write_disk(self, key, entry):
+        header = {k: entry[k] for k in ('content_type', 'etag', 'created_at')}
+        self._disk.write(key, json.dumps(header).encode('utf-8') + b'\n' + entry['data'])
+
+    def stats(self):
+        disk_bytes = self._disk.disk_bytes
+        with self._lock:
+            stats = dict(self._stats)
+            stats['evictions'] = self._disk.evictions
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_bytes
+            stats['disk_bytes'] = disk_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+_thumbnail_cache = None
+_thumbnail_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache():
+    global _thumbnail_cache
+    if _thumbnail_cache is None:
+        with _thumbnail_cache_lock:
+            if _thumbnail_cache is None:
+                _thumbnail_cache = ThumbnailCache()
+    return _thumbnail_cache
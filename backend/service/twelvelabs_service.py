@@ -1,7 +1,18 @@
 from twelvelabs import TwelveLabs
-import requests
-import sys
+from collections import deque
 import os
+from service.analysis_cache import get_analysis_cache
+from service.catalog_cache import get_catalog_cache, get_catalog_executor
+from service.http_transport import get_transport
+from service.multipart_stream import MultipartStream
+from service.resilience import CallCancelled
+from service.task_poller import get_task_poller
+from service.thumbnail_cache import get_thumbnail_cache
+from service.video_catalog import IndexCatalog
+
+TASKS_URL = "https://api.twelvelabs.io/v1.3/tasks"
+# Uploads send the whole video inside one call, so they get a long deadline
+UPLOAD_DEADLINE = int(os.environ.get('UPLOAD_DEADLINE_SECONDS', 3600))
 
 class TwelveLabsService:
     
@@ -9,78 +20,110 @@ class TwelveLabsService:
         if api_key is None:
             api_key = os.environ.get('TWELVELABS_API_KEY', '')
         self.api_key = api_key
-        self.client = TwelveLabs(api_key=api_key)
+        self.http = get_transport()
+        self.client = TwelveLabs(api_key=api_key, httpx_client=self.http.sdk_client())
     
-    def get_indexes(self):
+    def get_indexes(self, refresh=False):
         try:
-            print("Fetching indexes...")
             if not self.api_key:
                 print("No API key available")
                 return []
             
-            # Use TwelveLabs client to get indexes
-            indexes = self.client.indexes.list()
-            
-            result = []
-            for index in indexes:
-                result.append({
-                    "id": index.id,
-                    "name": index.index_name
-                })
-                print(f"ID: {index.id}")
-                print(f"  Name: {index.index_name}")
-            
-            return result
+            return get_catalog_cache().get(('indexes', self.api_key, None, None), self._fetch_indexes, refresh=refresh)
         except Exception as e:
             print(f"Error fetching indexes: {e}")
             return []
+
+    def _fetch_indexes(self):
+        # Use TwelveLabs client to get indexes
+        indexes = self.client.indexes.list()
+        return [{"id": index.id, "name": index.index_name} for index in indexes]
     
-    def get_videos(self, index_id, page=1):
+    def get_videos(self, index_id, page=1, refresh=False):
         try:
             if not self.api_key:
                 print("No API key available")
                 return []
             
-            # Use TwelveLabs client to get videos
-            videos_response = self.client.indexes.videos.list(index_id=index_id, page=page)
-            
-            result = []
-            for video in videos_response.items:
-                system_metadata = video.system_metadata
-                hls_data = video.hls
-                thumbnail_urls = hls_data.get('thumbnail_urls', []) if hls_data else []
-                thumbnail_url = thumbnail_urls[0] if thumbnail_urls else None
-                video_url = hls_data.get('video_url') if hls_data else None
-                
-                result.append({
-                    "id": video.id,
-                    "name": system_metadata.filename if system_metadata and system_metadata.filename else f'Video {video.id}',
-                    "duration": system_metadata.duration if system_metadata else 0,
-                    "thumbnail_url": thumbnail_url,
-                    "video_url": video_url,
-                    "width": system_metadata.width if system_metadata else 0,
-                    "height": system_metadata.height if system_metadata else 0,
-                    "fps": system_metadata.fps if system_metadata else 0,
-                    "size": system_metadata.size if system_metadata else 0
-                })
-            
-            return result
+            page = int(page)
+            cache = get_catalog_cache()
+            key = ('videos', self.api_key, index_id, page)
+
+            # Load the next page in the background while this one is served,
+            # unless this page is known to be the last
+            cached = cache.peek(key)
+            if cached is None or cached['has_next']:
+                next_key = ('videos', self.api_key, index_id, page + 1)
+                cache.prefetch(next_key, lambda: self._fetch_videos(index_id, page + 1))
+
+            return cache.get(key, lambda: self._fetch_videos(index_id, page), refresh=refresh)['videos']
         except Exception as e:
             print(f"Error fetching videos for index {index_id}: {e}")
             return []
+
+    def _fetch_videos(self, index_id, page):
+        # Use TwelveLabs client to get videos
+        videos_response = self.client.indexes.videos.list(index_id=index_id, page=page)
+        
+        result = []
+        for video in videos_response.items or []:
+            system_metadata = video.system_metadata
+            hls_data = video.hls
+            thumbnail_urls = hls_data.get('thumbnail_urls', []) if hls_data else []
+            thumbnail_url = thumbnail_urls[0] if thumbnail_urls else None
+            video_url = hls_data.get('video_url') if hls_data else None
+            
+            result.append({
+                "id": video.id,
+                "name": system_metadata.filename if system_metadata and system_metadata.filename else f'Video {video.id}',
+                "duration": system_metadata.duration if system_metadata else 0,
+                "thumbnail_url": thumbnail_url,
+                "video_url": video_url,
+                "width": system_metadata.width if system_metadata else 0,
+                "height": system_metadata.height if system_metadata else 0,
+                "fps": system_metadata.fps if system_metadata else 0,
+                "size": system_metadata.size if system_metadata else 0
+            })
+        
+        return {"videos": result, "has_next": bool(videos_response.has_next)}
     
-    def analyze_video(self, video_id, prompt):
+    def get_catalog(self, index_id, refresh=False):
+        # Columnar snapshot of the whole index for server-side queries; shares
+        # the SWR cache (and upload invalidation) with the paged listings
+        key = ('catalog', self.api_key, index_id, None)
+        return get_catalog_cache().get(key, lambda: IndexCatalog.from_records(self.iter_videos(index_id)), refresh=refresh)
+    
+    def analyze_video(self, video_id, prompt, index_id=None, no_cache=False):
+        analysis, _ = self.analyze_video_cached(video_id, prompt, index_id=index_id, no_cache=no_cache)
+        return analysis
+
+    def analyze_video_cached(self, video_id, prompt, index_id=None, no_cache=False, deadline=None):
+        # Returns (analysis, cache_hit) so callers can report where the result came from
+        cache = get_analysis_cache()
+        return cache.get_or_compute(
+            self.api_key, index_id, video_id, prompt,
+            lambda: self._analyze_video_uncached(video_id, prompt, deadline),
+            no_cache=no_cache
+        )
+
+    def _analyze_video_uncached(self, video_id, prompt, deadline=None):
         try:
+            request_options = None
+            if deadline is not None:
+                if deadline.cancelled:
+                    raise CallCancelled(f"Analysis of video {video_id} was cancelled")
+                request_options = {'timeout_in_seconds': max(1, int(deadline.remaining()))}
             analysis_response = self.client.analyze(
                 video_id=video_id,
-                prompt=prompt
+                prompt=prompt,
+                request_options=request_options
             )
             return analysis_response.data
         except Exception as e:
             print(f"Error analyzing video {video_id}: {e}")
             raise e
 
-    def get_video_details(self, index_id, video_id):
+    def get_video_details(self, index_id, video_id, deadline=None):
         if not hasattr(self, 'client') or not getattr(self, 'client', None):
             return None
         if not self.api_key:
@@ -92,7 +135,7 @@ class TwelveLabsService:
             "Content-Type": "application/json"
         }
         try:
-            response = requests.get(url, headers=headers)
+            response = self.http.get(url, headers=headers, hedge=True, deadline=deadline)
             if response.status_code == 200:
                 return response.json()
             else:
@@ -103,48 +146,56 @@ class TwelveLabsService:
             return None
 
     def get_video_thumbnail(self, index_id, video_id):
-        if not hasattr(self, 'client') or not getattr(self, 'client', None):
-            print("[DEBUG] No client available", file=sys.stderr)
-            return None
+        # Image bytes, or None when the video has no thumbnail (yet)
+        entry = self.get_video_thumbnail_cached(index_id, video_id)
+        return entry['data'] if entry else None
+
+    def get_video_thumbnail_cached(self, index_id, video_id):
+        # {'data', 'content_type', 'etag', 'created_at'} or None
         if not self.api_key:
-            print("[DEBUG] No API key available", file=sys.stderr)
             return None
+        try:
+            return get_thumbnail_cache().get_or_fetch(
+                self.api_key, index_id, video_id,
+                lambda: self._fetch_thumbnail(index_id, video_id)
+            )
+        except Exception as e:
+            print(f"Exception getting thumbnail for video {video_id}: {str(e)}")
+            return None
+
+    def _fetch_thumbnail(self, index_id, video_id):
         url = f"https://api.twelvelabs.io/v1.3/indexes/{index_id}/videos/{video_id}/thumbnail"
         headers = {
             "accept": "application/json",
             "x-api-key": self.api_key
         }
-        try:
-            response = requests.get(url, headers=headers)
-            print(f"[DEBUG] Thumbnail endpoint content-type: {response.headers.get('Content-Type')}", file=sys.stderr)
-            if response.status_code != 200:
-                print(f"[DEBUG] Thumbnail endpoint returned status {response.status_code}: {response.text}", file=sys.stderr)
-                return None
-            data = response.json()
-            if not isinstance(data, dict) or 'thumbnail' not in data:
-                print(f"[DEBUG] Unexpected thumbnail response: {data}", file=sys.stderr)
-                return None
-            thumbnail_url = data.get('thumbnail')
-            print(f"[DEBUG] Extracted thumbnail URL: {thumbnail_url}", file=sys.stderr)
-            if thumbnail_url:
-                img_resp = requests.get(thumbnail_url)
-                print(f"[DEBUG] Image fetch status: {img_resp.status_code}", file=sys.stderr)
-                if img_resp.status_code == 200:
-                    print(f"[DEBUG] Image fetch successful, bytes: {len(img_resp.content)}", file=sys.stderr)
-                    return img_resp.content
-                else:
-                    print(f"[DEBUG] Failed to fetch actual thumbnail image: {img_resp.status_code}", file=sys.stderr)
-                    return None
-            else:
-                print("[DEBUG] No thumbnail URL in JSON response", file=sys.stderr)
-                return None
-        except Exception as e:
-            print(f"[DEBUG] Exception getting thumbnail: {str(e)}", file=sys.stderr)
+        response = self.http.get(url, headers=headers, hedge=True)
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise RuntimeError(f"Thumbnail lookup returned {response.status_code}")
+        data = response.json()
+        thumbnail_url = data.get('thumbnail') if isinstance(data, dict) else None
+        if not thumbnail_url:
             return None
+        img_resp = self.http.get(thumbnail_url, hedge=True)
+        if img_resp.status_code != 200:
+            raise RuntimeError(f"Thumbnail image download returned {img_resp.status_code}")
+        return img_resp.content, img_resp.headers.get('Content-Type')
 
     def upload_video_file(self, index_id: str, file_path: str, timeout_seconds: int = 900):
+        # Blocking create-and-wait, kept for scripts; the API uses upload jobs
+        created = self.create_upload_task(index_id, file_path)
+        if 'error' in created:
+            return created
+        return self.wait_for_task(
+            created['task_id'],
+            timeout_seconds=timeout_seconds,
+            index_id=index_id,
+            file_size=os.path.getsize(file_path)
+        )
 
-        import sys
+    def create_upload_task(self, index_id: str, file_path: str):
         try:
             if not self.api_key:
                 return {"error": "Missing TwelveLabs API key"}
@@ -152,15 +203,11 @@ class TwelveLabsService:
                 return {"error": "Missing index_id"}
             if not os.path.exists(file_path):
                 return {"error": f"File not found: {file_path}"}
-            
-            print(f"[DEBUG] Starting upload for file: {file_path}", file=sys.stderr)
 
-            tasks_url = "https://api.twelvelabs.io/v1.3/tasks"
             headers = {
                 "x-api-key": self.api_key
             }
 
-            # Create upload task
             with open(file_path, "rb") as f:
                 files = {
                     "video_file": (os.path.basename(file_path), f)
@@ -168,40 +215,156 @@ class TwelveLabsService:
                 data = {
                     "index_id": index_id
                 }
-                resp = requests.post(tasks_url, headers=headers, files=files, data=data)
+                resp = self.http.post(TASKS_URL, headers=headers, files=files, data=data, deadline=UPLOAD_DEADLINE)
 
-            if resp.status_code not in (200, 201):
-                return {"error": f"Failed to create upload task: {resp.status_code} {resp.text}"}
+            return self._created_task(resp)
+        except Exception as e:
+            return {"error": str(e)}
 
-            resp_json = resp.json() if resp.text else {}
-            task_id = resp_json.get("id") or resp_json.get("task_id") or resp_json.get("_id")
-            if not task_id:
-                return {"error": f"No task id returned: {resp_json}"}
+    def create_upload_task_from_stream(self, index_id: str, stream, filename: str, file_size=None, on_chunk=None):
+        # Pipes ``stream`` straight into the multipart POST without a local
+        # copy. The stream is consumed, so a failure cannot be retried here.
+        try:
+            if not self.api_key:
+                return {"error": "Missing TwelveLabs API key"}
+            if not index_id:
+                return {"error": "Missing index_id"}
 
-            # Poll task until ready
-            import time
-            start_time = time.time()
-            print(f"[DEBUG] Starting to poll task {task_id} for completion...", file=sys.stderr)
-            
-            while time.time() - start_time < timeout_seconds:
-                r = requests.get(f"{tasks_url}/{task_id}", headers=headers)
-                if r.status_code != 200:
-                    time.sleep(2)
-                    continue
-                task = r.json() if r.text else {}
-                status = task.get("status")
-                print(f"[DEBUG] Task {task_id} status: {status}", file=sys.stderr)
-                
-                if status in ("ready", "completed"):
-                    video_id = task.get("video_id") or (task.get("data") or {}).get("video_id")
-                    print(f"[DEBUG] Indexing completed successfully! Video ID: {video_id}", file=sys.stderr)
-                    return {"status": status, "video_id": video_id, "task": task}
-                if status in ("failed", "error"):
-                    print(f"[DEBUG] Indexing failed with status: {status}", file=sys.stderr)
-                    return {"error": f"Indexing failed with status {status}", "task": task}
-                time.sleep(2)
-
-            print(f"[DEBUG] Upload timed out after {timeout_seconds} seconds", file=sys.stderr)
-            return {"error": "Upload timed out"}
+            body = MultipartStream(
+                {"index_id": index_id},
+                "video_file",
+                filename,
+                stream,
+                file_size=file_size,
+                on_chunk=on_chunk
+            )
+            headers = {
+                "x-api-key": self.api_key,
+                "Content-Type": body.content_type
+            }
+            resp = self.http.post(TASKS_URL, headers=headers, data=body.body(), deadline=UPLOAD_DEADLINE)
+
+            return self._created_task(resp)
         except Exception as e:
-            return {"error": str(e)} 
\ No newline at end of file
+            return {"error": str(e)}
+
+    def _created_task(self, resp):
+        if resp.status_code not in (200, 201):
+            return {"error": f"Failed to create upload task: {resp.status_code} {resp.text}"}
+
+        resp_json = resp.json() if resp.text else {}
+        task_id = resp_json.get("id") or resp_json.get("task_id") or resp_json.get("_id")
+        if not task_id:
+            return {"error": f"No task id returned: {resp_json}"}
+        return {"task_id": task_id}
+
+    def video_exists(self, index_id: str, video_id: str):
+        # True or False, or None when TwelveLabs could not tell
+        url = f"https://api.twelvelabs.io/v1.3/indexes/{index_id}/videos/{video_id}?embed=false"
+        headers = {"accept": "application/json", "x-api-key": self.api_key}
+        try:
+            resp = self.http.get(url, headers=headers, hedge=True)
+        except Exception as e:
+            print(f"Exception checking video {video_id}: {str(e)}")
+            return None
+        resp.close()
+        if resp.status_code == 200:
+            return True
+        if resp.status_code == 404:
+            return False
+        return None
+
+    def set_video_user_metadata(self, index_id: str, video_id: str, user_metadata: dict):
+        url = f"https://api.twelvelabs.io/v1.3/indexes/{index_id}/videos/{video_id}"
+        headers = {
+            "x-api-key": self.api_key,
+            "Content-Type": "application/json"
+        }
+        resp = self.http.put(url, headers=headers, json={"user_metadata": user_metadata})
+        if resp.status_code not in (200, 204):
+            return {"error": f"Failed to update video metadata: {resp.status_code} {resp.text}"}
+        return {}
+
+    def iter_index_videos(self, index_id: str, page_limit: int = 50, window: int = 4):
+        # Raw video records (including user_metadata) for a whole index, in
+        # catalog order. Up to ``window`` pages are fetched concurrently ahead
+        # of the consumer, so memory stays at ``window`` pages however large
+        # the index is. Raises on a failed page so callers never act on a
+        # partial scan.
+        first = self._fetch_video_page(index_id, 1, page_limit)
+        total_pages = (first.get("page_info") or {}).get("total_page") or 1
+        executor = get_catalog_executor()
+        pending = deque()
+        next_page = 2
+        try:
+            for video in first.get("data") or []:
+                yield video
+            while next_page <= total_pages or pending:
+                while next_page <= total_pages and len(pending) < max(1, window):
+                    pending.append(executor.submit(self._fetch_video_page, index_id, next_page, page_limit))
+                    next_page += 1
+                body = pending.popleft().result()
+                for video in body.get("data") or []:
+                    yield video
+        finally:
+            # Consumer stopped early (client disconnect) or a page failed
+            for future in pending:
+                future.cancel()
+
+    def iter_videos(self, index_id: str, page_limit: int = 50, window: int = 4):
+        # Whole index in the same shape as get_videos, for exports
+        for video in self.iter_index_videos(index_id, page_limit=page_limit, window=window):
+            system_metadata = video.get("system_metadata") or {}
+            hls_data = video.get("hls") or {}
+            thumbnail_urls = hls_data.get("thumbnail_urls") or []
+            yield {
+                "id": video.get("_id"),
+                "name": system_metadata.get("filename") or f'Video {video.get("_id")}',
+                "duration": system_metadata.get("duration") or 0,
+                "thumbnail_url": thumbnail_urls[0] if thumbnail_urls else None,
+                "video_url": hls_data.get("video_url"),
+                "width": system_metadata.get("width") or 0,
+                "height": system_metadata.get("height") or 0,
+                "fps": system_metadata.get("fps") or 0,
+                "size": system_metadata.get("size") or 0
+            }
+
+    def _fetch_video_page(self, index_id: str, page: int, page_limit: int):
+        url = f"https://api.twelvelabs.io/v1.3/indexes/{index_id}/videos"
+        headers = {"x-api-key": self.api_key}
+        resp = self.http.get(url, headers=headers, params={"page": page, "page_limit": page_limit}, hedge=True)
+        if resp.status_code != 200:
+            raise RuntimeError(f"Failed to list videos (page {page}): {resp.status_code} {resp.text}")
+        return resp.json() if resp.text else {}
+
+    def get_task(self, task_id: str):
+        # Task JSON, or None when the status could not be fetched this time
+        r = self.http.get(f"{TASKS_URL}/{task_id}", headers={"x-api-key": self.api_key}, hedge=True)
+        if r.status_code != 200:
+            return None
+        return r.json() if r.text else {}
+
+    def list_tasks(self, index_id: str, page_limit: int = 50):
+        # Most recently updated tasks of an index, or None on failure
+        params = {
+            "index_id": index_id,
+            "page_limit": page_limit,
+            "sort_by": "updated_at",
+            "sort_option": "desc"
+        }
+        r = self.http.get(TASKS_URL, headers={"x-api-key": self.api_key}, params=params, hedge=True)
+        if r.status_code != 200:
+            return None
+        return (r.json() if r.text else {}).get("data") or []
+
+    def wait_for_task(self, task_id: str, timeout_seconds: int = 900, on_status=None, index_id=None, file_size=None):
+        # The shared poller does the polling; this only blocks on its future
+        future = get_task_poller().watch(
+            task_id,
+            self,
+            index_id=index_id,
+            file_size=file_size,
+            timeout_seconds=timeout_seconds,
+            on_status=on_status
+        )
+        return future.result()
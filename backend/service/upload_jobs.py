@@ -0,0 +1,474 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from service.analysis_cache import BACKEND_DIR
+from service.catalog_cache import get_catalog_cache
+from service.content_index import get_content_index
+from service.task_poller import get_task_poller
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_DIR = os.path.join(BACKEND_DIR, '.cache', 'upload_jobs')
+
+QUEUED = 'queued'
+UPLOADING = 'uploading'
+INDEXING = 'indexing'
+READY = 'ready'
+FAILED = 'failed'
+TERMINAL_STATUSES = (READY, FAILED)
+
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+
+class UploadJobManager:
+    """Background upload and indexing jobs.
+
+    The caller copies the upload into the spool directory with ``spool``
+    (which hashes it on the way) and ``submit`` returns the job straight
+    away; a worker pool then creates the
+    TwelveLabs task and hands it to the shared task poller, which completes
+    the job when indexing finishes. Every state change is written to
+    ``jobs_dir`` (one JSON file per job), so ``recover`` can pick up in-flight
+    jobs after a restart. This assumes a single backend process owns the job
+    directory. Ready and failed jobs are forgotten, in memory and on disk,
+    ``retention_seconds`` after their last update.
+
+    Uploads are deduplicated on the content hash computed here: a file
+    already indexed in the same index resolves to a ready job for the
+    existing video (once TwelveLabs confirms the video still exists), and one
+    still in flight resolves to the job that is uploading it.
+
+    API keys are never persisted; jobs run with the environment key, the same
+    one the upload endpoint uses.
+    """
+
+    def __init__(self, jobs_dir=None, workers=None, timeout_seconds=None, service_factory=None, retention_seconds=None):
+        self.jobs_dir = jobs_dir or os.environ.get('UPLOAD_JOBS_DIR') or DEFAULT_JOBS_DIR
+        self.spool_dir = os.path.join(self.jobs_dir, 'spool')
+        self.timeout_seconds = timeout_seconds or int(os.environ.get('UPLOAD_INDEX_TIMEOUT', 3600))
+        self.workers = workers or int(os.environ.get('UPLOAD_WORKERS', 4))
+        self.retention_seconds = retention_seconds or int(os.environ.get('UPLOAD_JOB_RETENTION_SECONDS', 86400))
+        self._service_factory = service_factory
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='upload-job')
+        self._jobs = {}
+        self._inflight = {}
+        self._last_prune = 0.0
+        self._condition = threading.Condition()
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'recovered': 0,
+            'deduplicated': 0,
+            'coalesced': 0,
+            'pruned': 0
+        }
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def _service(self):
+        if self._service_factory is not None:
+            return self._service_factory()
+        from service.client_registry import get_twelvelabs_service
+        return get_twelvelabs_service()
+
+    def _path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def spool(self, stream):
+        # Copies an incoming upload into the spool directory, hashing it as it
+        # is written so deduplication costs no extra pass over the file.
+        job_id = uuid.uuid4().hex
+        spool_path = os.path.join(self.spool_dir, job_id)
+        digest = hashlib.sha256()
+        with open(spool_path, 'wb') as f:
+            while True:
+                chunk = stream.read(SPOOL_CHUNK_BYTES)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+        return job_id, spool_path, digest.hexdigest()
+
+    def _persist(self, job):
+        tmp_path = f"{self._path(job['job_id'])}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._path(job['job_id']))
+
+    def _update(self, job_id, **changes):
+        with self._condition:
+            job = self._jobs[job_id]
+            job.update(changes)
+            job['version'] += 1
+            job['updated_at'] = time.time()
+            snapshot = dict(job)
+            self._condition.notify_all()
+        try:
+            self._persist(snapshot)
+        except OSError as e:
+            logger.warning(f"Could not persist upload job {job_id}: {e}")
+        return snapshot
+
+    def _create(self, job_id, status, index_id, filename, spool_path, file_size, content_sha256=None):
+        # Returns (job, created). When the same file is already indexed or in
+        # flight for this index, that job is returned instead and nothing new
+        # is started.
+        if content_sha256:
+            with self._condition:
+                existing = self._join_inflight(index_id, content_sha256, filename)
+            if existing is None:
+                existing = self._find_indexed(index_id, content_sha256, filename)
+            if existing is not None:
+                return existing, False
+        with self._condition:
+            if content_sha256:
+                # Another upload of the file may have started meanwhile
+                existing = self._join_inflight(index_id, content_sha256, filename)
+                if existing is not None:
+                    return existing, False
+            job = self._new_job(job_id, status, index_id, filename, spool_path, file_size, content_sha256)
+            if content_sha256:
+                self._inflight[(index_id, content_sha256)] = job_id
+            self._stats['submitted'] += 1
+        self._persist(job)
+        return dict(job), True
+
+    def _new_job(self, job_id, status, index_id, filename, spool_path, file_size, content_sha256, **fields):
+        now = time.time()
+        job = {
+            'job_id': job_id,
+            'status': status,
+            'index_id': index_id,
+            'filename': filename,
+            'spool_path': spool_path,
+            'file_size': file_size,
+            'content_sha256': content_sha256,
+            'duplicate': False,
+            'task_id': None,
+            'video_id': None,
+            'task_status': None,
+            'error': None,
+            'version': 0,
+            'created_at': now,
+            'updated_at': now
+        }
+        job.update(fields)
+        with self._condition:
+            self._jobs[job_id] = job
+        return job
+
+    def _join_inflight(self, index_id, content_sha256, filename):
+        # Called with the condition held
+        job_id = self._inflight.get((index_id, content_sha256))
+        job = self._jobs.get(job_id) if job_id else None
+        if job is not None and job['status'] != FAILED:
+            self._stats['coalesced'] += 1
+            logger.info(f"Upload of {filename} joined in-flight job {job_id}")
+            return dict(job)
+        return None
+
+    def _find_indexed(self, index_id, content_sha256, filename):
+        # A ready job for the video already indexed with this content, if
+        # TwelveLabs still has it
+        content_index = get_content_index()
+        entry = content_index.get(index_id, content_sha256)
+        if entry is None:
+            return None
+        exists = self._service().video_exists(index_id, entry['video_id'])
+        if not exists:
+            if exists is False:
+                logger.info(f"Indexed video {entry['video_id']} for {filename} was deleted, uploading again")
+                content_index.remove(index_id, content_sha256, entry['video_id'])
+            return None
+        with self._condition:
+            self._stats['deduplicated'] += 1
+        job = self._new_job(
+            uuid.uuid4().hex, READY, index_id, filename, None, None, content_sha256,
+            duplicate=True, video_id=entry['video_id'], task_status=READY
+        )
+        self._persist(job)
+        logger.info(f"Upload of {filename} matches indexed video {entry['video_id']}")
+        return dict(job)
+
+    def submit(self, job_id, spool_path, index_id, filename=None, content_sha256=None):
+        job, created = self._create(
+            job_id, QUEUED, index_id, filename, spool_path, os.path.getsize(spool_path), content_sha256
+        )
+        if not created:
+            self._discard_spool({'spool_path': spool_path})
+            return job
+        self._executor.submit(self._run, job_id)
+        logger.info(f"Queued upload job {job_id} for {filename}")
+        return job
+
+    def upload_stream(self, stream, index_id, filename, file_size=None, content_sha256=None):
+        # Streaming uploads run on the calling (request) thread because the
+        # body can only be read while the request is open. Nothing is spooled,
+        # so an interrupted upload fails instead of being retried on restart.
+        # A client-supplied ``content_sha256`` is only a hint: when it matches
+        # a known upload, the body is spooled and deduplicated on the hash
+        # computed from it, as for form uploads.
+        if content_sha256 and self._known_content(index_id, content_sha256):
+            job_id, spool_path, actual = self.spool(stream)
+            if actual != content_sha256:
+                logger.warning(f"Upload of {filename}: client hash {content_sha256[:12]} does not match content {actual[:12]}")
+            return self.submit(job_id, spool_path, index_id, filename=filename, content_sha256=actual)
+
+        job_id = uuid.uuid4().hex
+        job, _ = self._create(job_id, UPLOADING, index_id, filename, None, file_size)
+        logger.info(f"Streaming upload job {job_id} for {filename}")
+        digest = hashlib.sha256()
+        try:
+            service = self._service()
+            created = service.create_upload_task_from_stream(
+                index_id, stream, filename, file_size=file_size, on_chunk=digest.update
+            )
+            if 'error' in created:
+                self._fail(job_id, created['error'])
+                return self.get(job_id)
+            self._set_content_hash(job_id, index_id, content_sha256, digest.hexdigest())
+            self._update(job_id, status=INDEXING, task_id=created['task_id'])
+            self._watch(service, job_id, created['task_id'])
+        except Exception as e:
+            logger.error(f"Upload job {job_id} failed: {e}")
+            self._fail(job_id, str(e))
+        return self.get(job_id)
+
+    def _known_content(self, index_id, content_sha256):
+        with self._condition:
+            job_id = self._inflight.get((index_id, content_sha256))
+            if job_id is not None and self._jobs[job_id]['status'] != FAILED:
+                return True
+        return get_content_index().get(index_id, content_sha256) is not None
+
+    def _set_content_hash(self, job_id, index_id, claimed, actual):
+        if claimed and claimed != actual:
+            logger.warning(f"Upload job {job_id}: client hash {claimed[:12]} does not match content {actual[:12]}")
+        with self._condition:
+            self._inflight.setdefault((index_id, actual), job_id)
+        self._update(job_id, content_sha256=actual)
+
+    def get(self, job_id):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id, after_version, timeout):
+        # Blocks until the job moves past ``after_version`` or ``timeout``
+        # elapses; returns the current snapshot either way.
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job['version'] > after_version:
+                    return dict(job) if job else None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return dict(job)
+                self._condition.wait(remaining)
+
+    def _run(self, job_id):
+        job = self.get(job_id)
+        try:
+            service = self._service()
+            task_id = job['task_id']
+            if not task_id:
+                self._update(job_id, status=UPLOADING)
+                created = service.create_upload_task(job['index_id'], job['spool_path'])
+                if 'error' in created:
+                    self._fail(job_id, created['error'])
+                    return
+                task_id = created['task_id']
+                self._update(job_id, status=INDEXING, task_id=task_id)
+                self._discard_spool(job)
+            self._watch(service, job_id, task_id)
+        except Exception as e:
+            logger.error(f"Upload job {job_id} failed: {e}")
+            self._fail(job_id, str(e))
+
+    def _watch(self, service, job_id, task_id):
+        # Indexing is tracked by the shared task poller; the worker is free
+        # again as soon as the task is registered.
+        job = self.get(job_id)
+
+        def on_status(status, task):
+            self._update(job_id, task_status=status)
+
+        future = get_task_poller().watch(
+            task_id,
+            service,
+            index_id=job['index_id'],
+            file_size=job.get('file_size'),
+            timeout_seconds=self.timeout_seconds,
+            on_status=on_status
+        )
+        future.add_done_callback(lambda done: self._finish(job_id, done))
+
+    def _finish(self, job_id, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {'error': str(e)}
+        if 'error' in result:
+            self._fail(job_id, result['error'])
+            return
+        job = self._update(job_id, status=READY, video_id=result.get('video_id'), task_status=result.get('status'))
+        get_catalog_cache().invalidate(index_id=job['index_id'])
+        if job.get('content_sha256') and job['video_id']:
+            get_content_index().set(job['index_id'], job['content_sha256'], job['video_id'], filename=job.get('filename'))
+            self._executor.submit(self._tag_video, job)
+        with self._condition:
+            self._release(job)
+            self._stats['completed'] += 1
+        logger.info(f"Upload job {job_id} ready: video {result.get('video_id')}")
+        self.prune()
+
+    def _tag_video(self, job):
+        # Record the hash on the video itself so the content index can be
+        # rebuilt from the catalog
+        try:
+            result = self._service().set_video_user_metadata(
+                job['index_id'], job['video_id'], {'content_sha256': job['content_sha256']}
+            )
+            if result and 'error' in result:
+                logger.warning(f"Could not tag video {job['video_id']} with its content hash: {result['error']}")
+        except Exception as e:
+            logger.warning(f"Could not tag video {job['video_id']} with its content hash: {e}")
+
+    def _release(self, job):
+        # Called with the condition held
+        key = (job['index_id'], job.get('content_sha256'))
+        if self._inflight.get(key) == job['job_id']:
+            del self._inflight[key]
+
+    def _fail(self, job_id, error):
+        job = self._update(job_id, status=FAILED, error=error)
+        self._discard_spool(job)
+        with self._condition:
+            self._release(job)
+            self._stats['failed'] += 1
+        self.prune()
+
+    def _discard_spool(self, job):
+        spool_path = job.get('spool_path')
+        if spool_path and os.path.exists(spool_path):
+            try:
+                os.remove(spool_path)
+            except OSError as e:
+                logger.warning(f"Could not remove spooled upload {spool_path}: {e}")
+
+    def recover(self):
+        # Reload persisted jobs after a restart and resume the unfinished ones:
+        # indexing jobs go back to waiting on their task, queued/uploading jobs
+        # are re-uploaded if their spooled file survived.
+        try:
+            names = os.listdir(self.jobs_dir)
+        except FileNotFoundError:
+            return 0
+        resumed = 0
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.jobs_dir, name), 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable upload job {name}: {e}")
+                continue
+            job_id = job.get('job_id')
+            if not job_id:
+                continue
+            with self._condition:
+                if job_id in self._jobs:
+                    continue
+                self._jobs[job_id] = job
+                if job.get('content_sha256') and job.get('status') not in TERMINAL_STATUSES:
+                    self._inflight[(job.get('index_id'), job['content_sha256'])] = job_id
+            if job.get('status') in TERMINAL_STATUSES:
+                continue
+
+            if job.get('task_id') or (job.get('spool_path') and os.path.exists(job['spool_path'])):
+                if not job.get('task_id'):
+                    self._update(job_id, status=QUEUED)
+                self._executor.submit(self._run, job_id)
+                resumed += 1
+            else:
+                self._fail(job_id, 'Upload was interrupted by a server restart')
+
+        with self._condition:
+            self._stats['recovered'] += resumed
+        if resumed:
+            logger.info(f"Resumed {resumed} upload job(s)")
+        self.prune(force=True)
+        self._remove_orphaned_spool()
+        return resumed
+
+    def prune(self, force=False):
+        # At most once a minute, drop finished jobs past their retention
+        now = time.time()
+        with self._condition:
+            if not force and now - self._last_prune < 60:
+                return 0
+            self._last_prune = now
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.get('status') in TERMINAL_STATUSES and now - job.get('updated_at', 0) > self.retention_seconds
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+            self._stats['pruned'] += len(expired)
+        for job_id in expired:
+            try:
+                os.remove(self._path(job_id))
+            except OSError:
+                pass
+        if expired:
+            logger.info(f"Pruned {len(expired)} finished upload job(s)")
+        return len(expired)
+
+    def _remove_orphaned_spool(self):
+        with self._condition:
+            known = {job.get('spool_path') for job in self._jobs.values() if job.get('status') not in TERMINAL_STATUSES}
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            if path not in known:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            by_status = {}
+            for job in self._jobs.values():
+                by_status[job['status']] = by_status.get(job['status'], 0) + 1
+            stats['in_flight_hashes'] = len(self._inflight)
+        stats['workers'] = self.workers
+        stats['jobs'] = by_status
+        return stats
+
+
+_upload_job_manager = None
+_upload_job_manager_lock = threading.Lock()
+
+
+def get_upload_job_manager():
+    global _upload_job_manager
+    if _upload_job_manager is None:
+        with _upload_job_manager_lock:
+            if _upload_job_manager is None:
+                manager = UploadJobManager()
+                manager.recover()
+                _upload_job_manager = manager
+    return _upload_job_manager
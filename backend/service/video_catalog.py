@@ -0,0 +1,209 @@
+import base64
+import json
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+SORT_FIELDS = ('name', 'duration', 'width', 'height', 'fps', 'size')
+RANGE_FIELDS = ('duration', 'width', 'height', 'fps', 'size')
+
+
+def encode_cursor(value, video_id):
+    raw = json.dumps([value, video_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, video_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    return value, video_id
+
+
+class IndexCatalog:
+    """Column-oriented snapshot of one index's videos.
+
+    Each field is a parallel list or ``array`` indexed by row instead of one
+    dict per video. Sort orders are built on first use and kept, and ranges
+    on the sort column, name prefixes and cursors are resolved by bisecting
+    the order. Substring search runs over all names joined into one string.
+    Filters on other columns scan, but only until the page is full. Dicts
+    are materialised for the returned page alone.
+
+    Cursors are keyset cursors (sort value, video id), so paging stays
+    consistent when the snapshot is rebuilt between requests.
+    """
+
+    __slots__ = (
+        'ids', 'names', 'folded_names', 'duration', 'width', 'height', 'fps', 'size',
+        'thumbnail_urls', 'video_urls', 'built_at', '_orders', '_text', '_starts', '_lock'
+    )
+
+    def __init__(self):
+        self.ids = []
+        self.names = []
+        self.folded_names = []
+        self.duration = array('d')
+        self.width = array('l')
+        self.height = array('l')
+        self.fps = array('d')
+        self.size = array('q')
+        self.thumbnail_urls = []
+        self.video_urls = []
+        self.built_at = time.time()
+        self._orders = {}
+        self._text = None
+        self._starts = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_records(cls, videos):
+        # ``videos`` may be a generator; records are consumed one at a time
+        catalog = cls()
+        for video in videos:
+            catalog.append(video)
+        return catalog
+
+    def append(self, video):
+        name = video.get('name') or ''
+        self.ids.append(video['id'])
+        self.names.append(name)
+        self.folded_names.append(name.casefold())
+        self.duration.append(float(video.get('duration') or 0))
+        self.width.append(int(video.get('width') or 0))
+        self.height.append(int(video.get('height') or 0))
+        self.fps.append(float(video.get('fps') or 0))
+        self.size.append(int(video.get('size') or 0))
+        self.thumbnail_urls.append(video.get('thumbnail_url'))
+        self.video_urls.append(video.get('video_url'))
+        self._orders.clear()
+        self._text = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def record(self, row):
+        return {
+            'id': self.ids[row],
+            'name': self.names[row],
+            'duration': self.duration[row],
+            'thumbnail_url': self.thumbnail_urls[row],
+            'video_url': self.video_urls[row],
+            'width': self.width[row],
+            'height': self.height[row],
+            'fps': self.fps[row],
+            'size': self.size[row]
+        }
+
+    def _column(self, field):
+        return self.folded_names if field == 'name' else getattr(self, field)
+
+    def _order(self, field):
+        # Row numbers sorted by (value, id), and each row's position in that
+        # order. Ties on value are broken by id so cursors are unambiguous.
+        orders = self._orders.get(field)
+        if orders is None:
+            with self._lock:
+                orders = self._orders.get(field)
+                if orders is None:
+                    column, ids = self._column(field), self.ids
+                    order = array('l', sorted(range(len(ids)), key=lambda row: (column[row], ids[row])))
+                    rank = array('l', bytes(order.itemsize * len(order)))
+                    for position, row in enumerate(order):
+                        rank[row] = position
+                    orders = self._orders[field] = (order, rank)
+        return orders
+
+    def _search_rows(self, needle):
+        # Rows whose folded name contains ``needle``
+        if self._text is None:
+            with self._lock:
+                if self._text is None:
+                    starts, offset = array('l'), 0
+                    for name in self.folded_names:
+                        starts.append(offset)
+                        offset += len(name) + 1
+                    self._starts = starts
+                    self._text = '\0'.join(self.folded_names)
+        text, starts = self._text, self._starts
+        rows = []
+        found = text.find(needle)
+        while found != -1:
+            row = bisect_right(starts, found) - 1
+            rows.append(row)
+            if row + 1 >= len(starts):
+                break
+            found = text.find(needle, starts[row + 1])
+        return rows
+
+    def query(self, ranges=None, search=None, prefix=None, sort='name', descending=False, limit=50, cursor=None):
+        """Return ``(records, next_cursor)``.
+
+        ``ranges`` maps a field in ``RANGE_FIELDS`` to an inclusive
+        ``(low, high)`` pair where either bound may be None. ``search`` is a
+        case-insensitive substring and ``prefix`` a case-insensitive prefix
+        of the filename. ``next_cursor`` is None on the last page.
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_FIELDS)}")
+        ranges = {field: bounds for field, bounds in (ranges or {}).items() if bounds != (None, None)}
+        for field in ranges:
+            if field not in RANGE_FIELDS:
+                raise ValueError(f"Cannot filter on {field}")
+
+        order, rank = self._order(sort)
+        column, ids = self._column(sort), self.ids
+        lo, hi = 0, len(order)
+
+        # Narrow the scan to a contiguous slice of the sort order where possible
+        if sort in ranges:
+            low, high = ranges.pop(sort)
+            if low is not None:
+                lo = max(lo, bisect_left(order, low, key=column.__getitem__))
+            if high is not None:
+                hi = min(hi, bisect_right(order, high, key=column.__getitem__))
+        folded_prefix = prefix.casefold() if prefix else None
+        if folded_prefix and sort == 'name':
+            lo = max(lo, bisect_left(order, folded_prefix, key=column.__getitem__))
+            hi = min(hi, bisect_left(order, folded_prefix + '\U0010ffff', key=column.__getitem__))
+            folded_prefix = None
+        if cursor:
+            after = tuple(decode_cursor(cursor))
+            row_key = lambda row: (column[row], ids[row])
+            try:
+                if descending:
+                    hi = min(hi, bisect_left(order, after, key=row_key))
+                else:
+                    lo = max(lo, bisect_right(order, after, key=row_key))
+            except TypeError:
+                raise ValueError('Cursor does not match the requested sort')
+
+        checks = []
+        for field, (low, high) in ranges.items():
+            values = getattr(self, field)
+            if low is not None:
+                checks.append(lambda row, values=values, low=low: values[row] >= low)
+            if high is not None:
+                checks.append(lambda row, values=values, high=high: values[row] <= high)
+        if folded_prefix:
+            checks.append(lambda row: self.folded_names[row].startswith(folded_prefix))
+
+        positions = range(lo, hi)
+        folded_search = search.casefold().replace('\0', '') if search else None
+        if folded_search:
+            # Visit only the matching rows, in sort order
+            positions = sorted(p for p in map(rank.__getitem__, self._search_rows(folded_search)) if lo <= p < hi)
+        if descending:
+            positions = reversed(positions)
+        rows = []
+        for position in positions:
+            row = order[position]
+            if all(check(row) for check in checks):
+                if len(rows) == limit:
+                    last = rows[-1]
+                    return [self.record(r) for r in rows], encode_cursor(column[last], ids[last])
+                rows.append(row)
+        return [self.record(r) for r in rows], None
@@ -0,0 +1,289 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+from service.analysis_cache import BACKEND_DIR
+from service.leases import FileLeases
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_DIR = os.path.join(BACKEND_DIR, '.cache', 'workflows')
+
+RUNNING = 'running'
+FINISHED = 'finished'
+
+# Events that end a workflow stream
+TERMINAL_EVENTS = ('complete', 'error')
+
+# Buffered event lines are written out at least this often
+FLUSH_SECONDS = 1.0
+
+WORKFLOW_ID = re.compile(r'[0-9a-f]{32}')
+
+
+def _key_hash(api_key):
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()
+
+
+class WorkflowCheckpoint:
+    """Event log and finished stage results of one workflow run.
+
+    ``record`` numbers each NDJSON event with an ``event_id`` and appends it
+    to the log through one buffered handle; the buffer is written out by
+    ``flush`` (when ``flush_due``), at every ``stage_done`` and on ``close``.
+    ``stage_done`` saves a stage's result once its events have been sent.
+    Only the producer of the workflow writes to it.
+    """
+
+    def __init__(self, store, state):
+        self.store = store
+        self.state = state
+        self._terminal = False
+        self._events = None
+        self._flushed_at = time.monotonic()
+
+    @property
+    def workflow_id(self):
+        return self.state['workflow_id']
+
+    @property
+    def params(self):
+        return self.state['params']
+
+    @property
+    def stages(self):
+        return self.state['stages']
+
+    @property
+    def event_count(self):
+        return self.state['event_count']
+
+    @property
+    def resumable(self):
+        # Interrupted before its final event: a new run can pick it up
+        return self.state['status'] == RUNNING
+
+    def record(self, line):
+        event = json.loads(line)
+        self.state['event_count'] += 1
+        numbered = json.dumps(dict({'event_id': self.state['event_count']}, **event), ensure_ascii=False, separators=(',', ':')) + '\n'
+        if self._events is None:
+            self._events = open(self.store._events_path(self.workflow_id), 'a', encoding='utf-8')
+        self._events.write(numbered)
+        if event.get('type') in TERMINAL_EVENTS:
+            self._terminal = True
+        return numbered
+
+    @property
+    def flush_due(self):
+        return self._events is not None and (self._terminal or time.monotonic() - self._flushed_at >= FLUSH_SECONDS)
+
+    def flush(self):
+        if self._events is not None:
+            self._events.flush()
+        self._flushed_at = time.monotonic()
+
+    def stage_done(self, name, result):
+        # The stage's events go to disk before its result does
+        self.flush()
+        self.state['stages'][name] = result
+        self.store._persist(self.state)
+
+    def close(self):
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+        if self._terminal:
+            self.state['status'] = FINISHED
+        self.store._persist(self.state)
+
+    def replay(self, after=0):
+        """Logged events with an ``event_id`` above ``after``, in order.
+
+        A line cut short by a crash is dropped together with everything
+        after it, and the event count is trimmed to match.
+        """
+        path = self.store._events_path(self.workflow_id)
+        lines, truncated = [], False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        json.loads(line)
+                    except ValueError:
+                        truncated = True
+                        break
+                    lines.append(line)
+        except FileNotFoundError:
+            pass
+        if truncated:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            os.replace(tmp_path, path)
+        self.state['event_count'] = len(lines)
+        return lines[after:]
+
+
+class WorkflowCheckpointStore:
+    """Checkpoints that let a dropped workflow stream be resumed.
+
+    Every workflow gets an id. Its events are logged as they are sent and
+    each finished stage's result is saved under ``checkpoint_dir``, so a
+    client that reconnects with the workflow id and the last ``event_id`` it
+    saw gets the missed events replayed. A run that was interrupted before
+    its final event continues from the first unfinished stage without
+    repeating the upstream calls of the finished ones.
+
+    Only one process may produce a workflow at a time, since several
+    workers can share ``checkpoint_dir``. The producer holds a lease: a lock
+    file created with ``O_EXCL`` whose mtime it refreshes every third of
+    ``lease_seconds``. A lease left behind by a crashed process is taken over
+    once it is older than ``lease_seconds``.
+
+    The API key is never stored, only its hash; resuming requires the same
+    key. Checkpoints are deleted ``ttl_seconds`` after their last update.
+    """
+
+    def __init__(self, checkpoint_dir=None, ttl_seconds=None, lease_seconds=None):
+        self.checkpoint_dir = checkpoint_dir or os.environ.get('WORKFLOW_CHECKPOINT_DIR') or DEFAULT_CHECKPOINT_DIR
+        self.ttl_seconds = ttl_seconds or int(os.environ.get('WORKFLOW_CHECKPOINT_TTL_SECONDS', 3600))
+        self.lease_seconds = lease_seconds or float(os.environ.get('WORKFLOW_LEASE_SECONDS', 30))
+        # workflow id -> coalescing key of the runs produced here
+        self._live = {}
+        self._leases = FileLeases(self.checkpoint_dir, self.lease_seconds)
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+        self._stats = {'created': 0, 'reconnects': 0, 'resumed': 0, 'stages_restored': 0, 'pruned': 0}
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+    def _path(self, workflow_id):
+        return os.path.join(self.checkpoint_dir, f"{workflow_id}.json")
+
+    def _events_path(self, workflow_id):
+        return os.path.join(self.checkpoint_dir, f"{workflow_id}.events")
+
+    def _persist(self, state):
+        state['updated_at'] = time.time()
+        tmp_path = f"{self._path(state['workflow_id'])}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._path(state['workflow_id']))
+
+    def create(self, api_key, params, coalescing_key):
+        # ``params`` are the generate_workflow kwargs without the API key. The
+        # new workflow is claimed for this process right away.
+        self.prune()
+        now = time.time()
+        state = {
+            'workflow_id': uuid.uuid4().hex,
+            'key_hash': _key_hash(api_key),
+            'params': params,
+            'status': RUNNING,
+            'stages': {},
+            'event_count': 0,
+            'created_at': now,
+            'updated_at': now
+        }
+        self._persist(state)
+        self.claim(state['workflow_id'], coalescing_key)
+        with self._lock:
+            self._stats['created'] += 1
+        return WorkflowCheckpoint(self, state)
+
+    def load(self, workflow_id, api_key):
+        # None for unknown ids and for a different API key alike
+        if not isinstance(workflow_id, str) or not WORKFLOW_ID.fullmatch(workflow_id):
+            return None
+        try:
+            with open(self._path(workflow_id), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('key_hash') != _key_hash(api_key):
+            return None
+        return WorkflowCheckpoint(self, state)
+
+    def claim(self, workflow_id, coalescing_key):
+        """Take the lease to produce ``workflow_id`` in this process.
+
+        Returns False while another process holds a fresh lease on it.
+        """
+        if not self._leases.claim(workflow_id):
+            return False
+        with self._lock:
+            self._live[workflow_id] = coalescing_key
+        return True
+
+    def release(self, workflow_id):
+        with self._lock:
+            self._live.pop(workflow_id, None)
+        self._leases.release(workflow_id)
+
+    def held_elsewhere(self, workflow_id):
+        # Another process is producing this workflow right now
+        return self._leases.held_elsewhere(workflow_id)
+
+    def live_key(self, workflow_id):
+        # Coalescing key of the run producing this workflow in this process
+        with self._lock:
+            return self._live.get(workflow_id)
+
+    def count(self, counter, amount=1):
+        with self._lock:
+            self._stats[counter] += amount
+
+    def prune(self):
+        # At most once a minute, drop checkpoints past their TTL
+        now = time.time()
+        with self._lock:
+            if now - self._last_prune < 60:
+                return 0
+            self._last_prune = now
+            live = set(self._live)
+        removed = 0
+        try:
+            names = os.listdir(self.checkpoint_dir)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            workflow_id, _, extension = name.partition('.')
+            if workflow_id in live or extension not in ('json', 'events', 'lease'):
+                continue
+            path = os.path.join(self.checkpoint_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl_seconds:
+                    os.remove(path)
+                    removed += extension == 'json'
+            except OSError:
+                continue
+        if removed:
+            self.count('pruned', removed)
+            logger.info(f"Pruned {removed} expired workflow checkpoint(s)")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['live'] = len(self._live)
+        stats['ttl_seconds'] = self.ttl_seconds
+        stats['lease_seconds'] = self.lease_seconds
+        return stats
+
+
+_checkpoint_store = None
+_checkpoint_store_lock = threading.Lock()
+
+
+def get_checkpoint_store():
+    global _checkpoint_store
+    if _checkpoint_store is None:
+        with _checkpoint_store_lock:
+            if _checkpoint_store is None:
+                _checkpoint_store = WorkflowCheckpointStore()
+    return _checkpoint_store
@@ -0,0 +1,298 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+
+    def __init__(self, key, on_abandon=None):
+        self.key = key
+        self.events = []
+        self.done = False
+        self.subscribers = 0
+        self.on_abandon = on_abandon
+        self.condition = threading.Condition()
+
+
+class WorkflowCoalescer:
+    """Single-flight execution for identical streaming workflows.
+
+    The first request for a key starts the workflow generator on a background
+    thread; every subscriber (including that first one) reads from the shared
+    event log, so late joiners get the already-emitted events replayed before
+    the live tail. The flight is forgotten once the generator finishes, so a
+    request arriving afterwards starts a fresh run.
+
+    When the last subscriber goes away before the run is done, the flight
+    waits ``abandon_grace_seconds`` for a client to reconnect, then is dropped
+    and its ``on_abandon`` callback is called so the producer can stop work
+    nobody will read. ``on_join`` is called instead of starting
+    ``generator_factory`` when the request joins a run already in flight.
+    ``skip`` leaves out the first events of the log, for a client that
+    already received them before reconnecting. Subscribers given a ``heartbeat`` event get it
+    after ``heartbeat_seconds`` without output; writing it is how a server
+    notices a closed connection during a long silent stage.
+    """
+
+    def __init__(self, heartbeat_seconds=None, abandon_grace_seconds=None):
+        self.heartbeat_seconds = heartbeat_seconds or float(os.environ.get('WORKFLOW_HEARTBEAT_SECONDS', 10))
+        self.abandon_grace_seconds = abandon_grace_seconds if abandon_grace_seconds is not None else float(os.environ.get('WORKFLOW_ABANDON_GRACE_SECONDS', 15))
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'started': 0,
+            'joined': 0,
+            'completed': 0,
+            'failed': 0,
+            'abandoned': 0
+        }
+
+    @staticmethod
+    def make_key(*parts):
+        raw = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._flights
+
+    def subscribe(self, key, generator_factory, on_abandon=None, heartbeat=None, on_join=None, skip=0):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight(key, on_abandon)
+                self._flights[key] = flight
+                self._stats['started'] += 1
+                start = True
+            else:
+                self._stats['joined'] += 1
+                start = False
+
+        if start:
+            thread = threading.Thread(
+                target=self._run,
+                args=(flight, generator_factory),
+                name=f"workflow-{key[:8]}",
+                daemon=True
+            )
+            thread.start()
+        else:
+            logger.info(f"Joined in-flight workflow {key[:8]} ({len(flight.events)} events to replay)")
+            if on_join is not None:
+                on_join()
+
+        return self._iterate(flight, heartbeat, skip)
+
+    def _run(self, flight, generator_factory):
+        failed = False
+        try:
+            for event in generator_factory():
+                with flight.condition:
+                    flight.events.append(event)
+                    flight.condition.notify_all()
+        except Exception as e:
+            # generate_workflow reports its own errors as events; this only
+            # guards against the producer thread dying silently.
+            failed = True
+            logger.error(f"Workflow {flight.key[:8]} producer failed: {e}")
+        finally:
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+                self._stats['failed' if failed else 'completed'] += 1
+            with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+
+    def _iterate(self, flight, heartbeat=None, skip=0):
+        # Counted from the first step, so an iterator that is dropped
+        # unstarted (and never reaches the finally below) is never counted
+        with flight.condition:
+            flight.subscribers += 1
+        position = skip
+        timeout = self.heartbeat_seconds if heartbeat is not None else None
+        try:
+            while True:
+                with flight.condition:
+                    if position >= len(flight.events) and not flight.done:
+                        flight.condition.wait(timeout)
+                    pending = flight.events[position:]
+                    position += len(pending)
+                    finished = flight.done
+                if not pending and not finished:
+                    yield heartbeat
+                    continue
+                for event in pending:
+                    yield event
+                if finished:
+                    return
+        finally:
+            with flight.condition:
+                flight.subscribers -= 1
+                abandoned = flight.subscribers == 0 and not flight.done
+            if abandoned and self.abandon_grace_seconds > 0:
+                timer = threading.Timer(self.abandon_grace_seconds, self._abandon, args=(flight,))
+                timer.daemon = True
+                timer.start()
+            elif abandoned:
+                self._abandon(flight)
+
+    def _abandon(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is not flight:
+                return
+            with flight.condition:
+                if flight.subscribers or flight.done:
+                    # Someone reconnected during the grace period
+                    return
+            # A new request for the key starts a fresh run instead of joining this one
+            del self._flights[flight.key]
+            self._stats['abandoned'] += 1
+        logger.info(f"Workflow {flight.key[:8]} abandoned by all subscribers")
+        if flight.on_abandon is not None:
+            flight.on_abandon()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            flights = list(self._flights.values())
+        stats['in_flight'] = len(flights)
+        stats['subscribers'] = sum(flight.subscribers for flight in flights)
+        return stats
+
+
+class _AsyncFlight:
+
+    def __init__(self, key, on_abandon=None):
+        self.key = key
+        self.events = []
+        self.done = False
+        self.subscribers = 0
+        self.on_abandon = on_abandon
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        # Wake current waiters and arm a fresh event for the next change
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class AsyncWorkflowCoalescer:
+    """asyncio counterpart of ``WorkflowCoalescer`` for async generators.
+
+    Must be used from a single event loop (the ASGI server's). No heartbeat
+    is needed here: Starlette watches for the client disconnecting and closes
+    the stream, which abandons the flight like in the threaded version.
+    """
+
+    def __init__(self, abandon_grace_seconds=None):
+        self.abandon_grace_seconds = abandon_grace_seconds if abandon_grace_seconds is not None else float(os.environ.get('WORKFLOW_ABANDON_GRACE_SECONDS', 15))
+        self._flights = {}
+        self._stats = {
+            'started': 0,
+            'joined': 0,
+            'completed': 0,
+            'failed': 0,
+            'abandoned': 0
+        }
+
+    make_key = staticmethod(WorkflowCoalescer.make_key)
+
+    def in_flight(self, key):
+        return key in self._flights
+
+    def subscribe(self, key, generator_factory, on_abandon=None, on_join=None, skip=0):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _AsyncFlight(key, on_abandon)
+            self._flights[key] = flight
+            self._stats['started'] += 1
+            asyncio.ensure_future(self._run(flight, generator_factory))
+        else:
+            self._stats['joined'] += 1
+            logger.info(f"Joined in-flight async workflow {key[:8]} ({len(flight.events)} events to replay)")
+            if on_join is not None:
+                on_join()
+        return self._iterate(flight, skip)
+
+    async def _run(self, flight, generator_factory):
+        failed = False
+        try:
+            async for event in generator_factory():
+                flight.events.append(event)
+                flight.notify()
+        except Exception as e:
+            failed = True
+            logger.error(f"Async workflow {flight.key[:8]} producer failed: {e}")
+        finally:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            self._stats['failed' if failed else 'completed'] += 1
+            flight.done = True
+            flight.notify()
+
+    async def _iterate(self, flight, skip=0):
+        flight.subscribers += 1
+        position = skip
+        try:
+            while True:
+                changed = flight.changed
+                pending = flight.events[position:]
+                position += len(pending)
+                finished = flight.done
+                for event in pending:
+                    yield event
+                if finished:
+                    return
+                if position >= len(flight.events) and not flight.done:
+                    await changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                if self.abandon_grace_seconds > 0:
+                    asyncio.get_running_loop().call_later(self.abandon_grace_seconds, self._abandon, flight)
+                else:
+                    self._abandon(flight)
+
+    def _abandon(self, flight):
+        if flight.subscribers or flight.done or self._flights.get(flight.key) is not flight:
+            return
+        del self._flights[flight.key]
+        self._stats['abandoned'] += 1
+        logger.info(f"Async workflow {flight.key[:8]} abandoned by all subscribers")
+        if flight.on_abandon is not None:
+            flight.on_abandon()
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['in_flight'] = len(self._flights)
+        stats['subscribers'] = sum(flight.subscribers for flight in self._flights.values())
+        return stats
+
+
+_workflow_coalescer = None
+_workflow_coalescer_lock = threading.Lock()
+
+
+def get_workflow_coalescer():
+    global _workflow_coalescer
+    if _workflow_coalescer is None:
+        with _workflow_coalescer_lock:
+            if _workflow_coalescer is None:
+                _workflow_coalescer = WorkflowCoalescer()
+    return _workflow_coalescer
+
+
+_async_workflow_coalescer = None
+
+
+def get_async_workflow_coalescer():
+    global _async_workflow_coalescer
+    if _async_workflow_coalescer is None:
+        _async_workflow_coalescer = AsyncWorkflowCoalescer()
+    return _async_workflow_coalescer
@@ -0,0 +1,282 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+PRECOMPUTE = 'precompute'
+
+# Highest priority first
+PRIORITY_CLASSES = (INTERACTIVE, BATCH, PRECOMPUTE)
+
+# Classes limited to a share of the slots, so some are always left for
+# interactive workflows
+BACKGROUND_CLASSES = (BATCH, PRECOMPUTE)
+
+
+class SchedulerBusy(Exception):
+    """The workflow queue is full; the request was not queued.
+
+    ``status`` is 429 when the caller's own API key has too many workflows
+    waiting and 503 when the whole server is saturated.
+    """
+
+    def __init__(self, message, retry_after, per_key=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.per_key = per_key
+        self.status = 429 if per_key else 503
+
+
+class Ticket:
+    """A workflow's place in the scheduler: waiting, then running.
+
+    Call ``release()`` when the workflow ends (or the caller gives up
+    waiting); it frees the slot or leaves the queue and is safe to call more
+    than once.
+    """
+
+    def __init__(self, scheduler, key, priority, seq):
+        self.scheduler = scheduler
+        self.key = key
+        self.priority = priority
+        self.seq = seq
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self._granted = threading.Event()
+        self._callbacks = []
+        self._released = False
+
+    @property
+    def granted(self):
+        return self._granted.is_set()
+
+    def wait(self, timeout=None):
+        return self._granted.wait(timeout)
+
+    def on_grant(self, callback):
+        # Runs ``callback`` once the slot is granted (from the releasing
+        # thread), or right away if it already is
+        with self.scheduler._lock:
+            if not self.granted:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def position(self):
+        # 1-based place in the queue, 0 once running
+        return self.scheduler._position(self)
+
+    def release(self):
+        self.scheduler._release(self)
+
+
+class WorkflowScheduler:
+    """Admission control in front of workflow runs.
+
+    At most ``max_concurrent`` workflows run at once, and at most
+    ``max_per_key`` of them for one TwelveLabs API key (``max_per_env_key``
+    for the server's own key, which most requests share). Others wait in one
+    FIFO queue per priority class; a free slot goes to the oldest waiter of
+    the highest class whose key is under its cap, so interactive workflows
+    overtake queued batch and precompute work.
+
+    Batch and precompute work together may hold only ``background_share`` of
+    each cap, and never all of it: once they reach it they wait even while
+    slots are free, so an interactive request always finds one.
+
+    ``admit`` rejects a request with ``SchedulerBusy`` instead of queueing it
+    once ``max_queue`` requests of the same or higher priority are already
+    waiting, or ``max_queue_per_key`` of them for its key. Background work admitted
+    with ``bounded=False`` always queues; its producers already limit how
+    much of it waits at a time.
+    """
+
+    def __init__(self, max_concurrent=None, max_per_key=None, max_per_env_key=None, background_share=None,
+                 max_queue=None, max_queue_per_key=None, update_seconds=None):
+        self.max_concurrent = max_concurrent or int(os.environ.get('WORKFLOW_MAX_CONCURRENT', 16))
+        self.max_per_key = max_per_key or int(os.environ.get('WORKFLOW_MAX_PER_KEY', 4))
+        self.max_per_env_key = max_per_env_key or int(os.environ.get('WORKFLOW_MAX_PER_ENV_KEY', 12))
+        self.env_key = os.environ.get('TWELVELABS_API_KEY', '')
+        self.background_share = background_share or float(os.environ.get('WORKFLOW_BACKGROUND_SHARE', 0.5))
+        self.max_queue = max_queue if max_queue is not None else int(os.environ.get('WORKFLOW_MAX_QUEUE', 32))
+        self.max_queue_per_key = max_queue_per_key if max_queue_per_key is not None else int(os.environ.get('WORKFLOW_MAX_QUEUE_PER_KEY', 8))
+        self.update_seconds = update_seconds or float(os.environ.get('WORKFLOW_QUEUE_UPDATE_SECONDS', 2))
+        self._queues = {priority: deque() for priority in PRIORITY_CLASSES}
+        self._running = 0
+        self._running_by_key = {}
+        self._background = 0
+        self._background_by_key = {}
+        self._seq = 0
+        # Moving average of how long a workflow holds its slot, for Retry-After
+        self._average_run = 30.0
+        self._lock = threading.Lock()
+        self._stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'rejected_per_key': 0, 'abandoned': 0, 'wait_seconds': 0.0}
+
+    def _waiting_ahead(self, priority, key=None):
+        # Waiters a new request would queue behind, optionally only for one key
+        classes = PRIORITY_CLASSES[:PRIORITY_CLASSES.index(priority) + 1]
+        if key is None:
+            return sum(len(self._queues[p]) for p in classes)
+        return sum(1 for p in classes for ticket in self._queues[p] if ticket.key == key)
+
+    def _key_limit(self, key):
+        if self.env_key and key == self.env_key:
+            return self.max_per_env_key
+        return self.max_per_key
+
+    def _background_limit(self, limit):
+        # Leaves at least one slot of ``limit`` free unless it is 1
+        return max(1, min(int(limit * self.background_share), limit - 1))
+
+    def _retry_after(self, ahead):
+        return max(1, math.ceil(self._average_run * (ahead + 1) / self.max_concurrent))
+
+    def admit(self, key, priority=INTERACTIVE, bounded=True):
+        """Queue a workflow for ``key`` and return its ``Ticket``.
+
+        The ticket is granted straight away when a slot is free. Raises
+        ``SchedulerBusy`` for a ``bounded`` request that would overflow the
+        queue.
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITY_CLASSES)}")
+        with self._lock:
+            if bounded:
+                self._check_bounds(key, priority)
+            self._seq += 1
+            ticket = Ticket(self, key, priority, self._seq)
+            self._queues[priority].append(ticket)
+            self._stats['admitted'] += 1
+            granted = self._dispatch()
+            if ticket not in granted:
+                self._stats['queued'] += 1
+        self._notify(granted)
+        return ticket
+
+    def acquire(self, key, priority, cancelled=None):
+        """Block until a slot is granted; for background workers.
+
+        Returns the running ``Ticket``, or None if ``cancelled`` (a
+        ``threading.Event``) was set first.
+        """
+        ticket = self.admit(key, priority, bounded=False)
+        while not ticket.wait(self.update_seconds):
+            if cancelled is not None and cancelled.is_set():
+                ticket.release()
+                return None
+        return ticket
+
+    def check(self, key, priority=INTERACTIVE):
+        # Raise SchedulerBusy if a bounded request would be rejected right now
+        with self._lock:
+            self._check_bounds(key, priority)
+
+    def _check_bounds(self, key, priority):
+        ahead = self._waiting_ahead(priority)
+        if self._waiting_ahead(priority, key) >= self.max_queue_per_key:
+            self._stats['rejected_per_key'] += 1
+            raise SchedulerBusy('Too many workflows queued for this API key', self._retry_after(ahead), per_key=True)
+        if ahead >= self.max_queue:
+            self._stats['rejected'] += 1
+            raise SchedulerBusy('Server is busy, too many workflows queued', self._retry_after(ahead))
+
+    def _dispatch(self):
+        # Grant free slots in priority order; the caller holds the lock and
+        # runs the returned tickets' callbacks once it has let go of it
+        granted = []
+        for priority in PRIORITY_CLASSES:
+            waiting = self._queues[priority]
+            for ticket in list(waiting):
+                if self._running >= self.max_concurrent:
+                    return granted
+                if self._running_by_key.get(ticket.key, 0) >= self._key_limit(ticket.key):
+                    continue
+                background = priority in BACKGROUND_CLASSES
+                if background:
+                    if self._background >= self._background_limit(self.max_concurrent):
+                        break
+                    if self._background_by_key.get(ticket.key, 0) >= self._background_limit(self._key_limit(ticket.key)):
+                        continue
+                    self._background += 1
+                    self._background_by_key[ticket.key] = self._background_by_key.get(ticket.key, 0) + 1
+                waiting.remove(ticket)
+                self._running += 1
+                self._running_by_key[ticket.key] = self._running_by_key.get(ticket.key, 0) + 1
+                ticket.started_at = time.monotonic()
+                self._stats['wait_seconds'] += ticket.started_at - ticket.queued_at
+                ticket._granted.set()
+                granted.append(ticket)
+        return granted
+
+    @staticmethod
+    def _notify(granted):
+        for ticket in granted:
+            callbacks, ticket._callbacks = ticket._callbacks, []
+            for callback in callbacks:
+                callback()
+
+    def _release(self, ticket):
+        with self._lock:
+            if ticket._released:
+                return
+            ticket._released = True
+            if ticket.granted:
+                self._running -= 1
+                self._running_by_key[ticket.key] -= 1
+                if not self._running_by_key[ticket.key]:
+                    del self._running_by_key[ticket.key]
+                if ticket.priority in BACKGROUND_CLASSES:
+                    self._background -= 1
+                    self._background_by_key[ticket.key] -= 1
+                    if not self._background_by_key[ticket.key]:
+                        del self._background_by_key[ticket.key]
+                self._average_run = 0.8 * self._average_run + 0.2 * (time.monotonic() - ticket.started_at)
+            else:
+                self._queues[ticket.priority].remove(ticket)
+                self._stats['abandoned'] += 1
+            granted = self._dispatch()
+        self._notify(granted)
+
+    def _position(self, ticket):
+        with self._lock:
+            if ticket.granted or ticket._released:
+                return 0
+            rank = PRIORITY_CLASSES.index(ticket.priority)
+            ahead = sum(len(self._queues[p]) for p in PRIORITY_CLASSES[:rank])
+            return ahead + self._queues[ticket.priority].index(ticket) + 1
+
+    def retry_after(self, ticket):
+        # Rough seconds until ``ticket`` gets a slot, for queue updates
+        return self._retry_after(max(ticket.position() - 1, 0))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+            stats['running'] = self._running
+            stats['background_running'] = self._background
+            stats['waiting'] = {priority: len(self._queues[priority]) for priority in PRIORITY_CLASSES}
+            stats['keys_running'] = len(self._running_by_key)
+            stats['average_run_seconds'] = round(self._average_run, 1)
+        stats['max_concurrent'] = self.max_concurrent
+        stats['max_per_key'] = self.max_per_key
+        stats['max_per_env_key'] = self.max_per_env_key
+        stats['max_background'] = self._background_limit(self.max_concurrent)
+        stats['max_queue'] = self.max_queue
+        return stats
+
+
+_workflow_scheduler = None
+_workflow_scheduler_lock = threading.Lock()
+
+
+def get_workflow_scheduler():
+    global _workflow_scheduler
+    if _workflow_scheduler is None:
+        with _workflow_scheduler_lock:
+            if _workflow_scheduler is None:
+                _workflow_scheduler = WorkflowScheduler()
+    return _workflow_scheduler
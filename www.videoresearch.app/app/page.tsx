@@ -1280,18 +1280,50 @@ Please provide a comprehensive answer that builds upon the previous research and
     }
     setIsUploading(true)
     try {
-      const formData = new FormData()
-      formData.append('file', uploadFile)
-      const res = await fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.TWELVELABS.UPLOAD}`, {
-        method: 'POST',
-        body: formData
-      })
-      const data = await res.json().catch(() => ({} as any))
-      if (!res.ok || !data?.success) {
-        const msg = data?.error || `Upload failed with status ${res.status}`
-        throw new Error(msg)
+      // Stream the raw file first; fall back to the form upload, which the
+      // backend keeps on disk and can retry
+      let data: any = null
+      try {
+        const streamRes = await fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.TWELVELABS.UPLOAD_STREAM}?filename=${encodeURIComponent(uploadFile.name)}`, {
+          method: 'POST',
+          headers: { 'Content-Type': uploadFile.type || 'application/octet-stream' },
+          body: uploadFile
+        })
+        const streamData = await streamRes.json().catch(() => ({} as any))
+        if (streamRes.ok && streamData?.success) {
+          data = streamData
+        }
+      } catch {
+        data = null
+      }
+      if (!data) {
+        const formData = new FormData()
+        formData.append('file', uploadFile)
+        const res = await fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.TWELVELABS.UPLOAD}`, {
+          method: 'POST',
+          body: formData
+        })
+        data = await res.json().catch(() => ({} as any))
+        if (!res.ok || !data?.success) {
+          const msg = data?.error || `Upload failed with status ${res.status}`
+          throw new Error(msg)
+        }
+      }
+      // The backend indexes in the background; poll the job until it settles
+      let job = data
+      while (job.status !== 'ready' && job.status !== 'failed') {
+        await new Promise((resolve) => setTimeout(resolve, 3000))
+        const jobRes = await fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.TWELVELABS.UPLOAD_JOBS}/${data.job_id}`)
+        const jobData = await jobRes.json().catch(() => ({} as any))
+        if (!jobRes.ok || !jobData?.success) {
+          throw new Error(jobData?.error || `Upload status check failed with status ${jobRes.status}`)
+        }
+        job = jobData.job
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Video indexing failed')
       }
-      toast({ title: 'Upload complete', description: `Video uploaded. ID: ${data.video_id}` })
+      toast({ title: 'Upload complete', description: `Video uploaded. ID: ${job.video_id}` })
       // Remove the automatic reset to environment key - this was causing unwanted refreshes
       // await switchToEnvironmentKey()
       setIsUploadVideoModalOpen(false)
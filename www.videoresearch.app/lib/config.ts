@@ -11,6 +11,8 @@ export const API_CONFIG = {
       INDEXES: '/api/indexes',
       VIDEOS: '/api/videos',
       UPLOAD: '/api/upload',
+      UPLOAD_STREAM: '/api/upload/stream',
+      UPLOAD_JOBS: '/api/upload/jobs',
     },
     
     RESEARCH: {